@@ -1,6 +1,10 @@
 from tkinter import messagebox
-from backend import DVH, Prescription, dose_police_in_action, actualizar_dvh_con_mapeos
-import xlstools
+from backend import dose_police_in_action, actualizar_dvh_con_mapeos, save_mapping_and_volumes
+from dvhcache import DVHCache
+from protocolstore import ProtocolIndex, ProtocolStore
+from session import DosePoliceSession
+from background import BackgroundTasks
+from instrumentation import enable_from_env, stage
 import warnings
 import customtkinter as ctk
 import json
@@ -9,34 +13,20 @@ import sys
 import re
 import warnings
 
-# extra imports para PDF
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
 from customtkinter import filedialog as ctkfiledialog
-from datetime import datetime
+from planmatrix import ConstraintMatrix, STATUS_TEXT, evaluate_plan
+from report import result_segments, write_matrix_pdf, write_results_pdf
+from settings import constraint_excel_file_path, dvh_folder_path, results_folder_path
 
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("green")
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
-def resource_path(relative_path):
-    """ Get absolute path to resource, works for dev and for PyInstaller """
-    try:
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
-
-# Define the paths for the NAS directory and the Excel file
-NAS_directory = resource_path("//FS-201-Radioterapia.intecnus.org.ar/")
-constraint_excel_file_path = resource_path(NAS_directory + "fisicos/8 - Físicos Médicos/Natalia Espector/2024 - Protocolos clínicos/Protocolo de constraints.xlsx")
-dvh_folder_path = resource_path(NAS_directory + "monaco/FocalData/DVH Output/")
-results_folder_path = resource_path(NAS_directory + "fisicos/2 - Pacientes/0 - REPORTES/REPORTES DVH/")
-
+FILE_SEPARATOR = "; "   # entre archivos en el campo de texto del selector
+STATUS_COLORS = {"ideal": "green", "acceptable": "orange", "fail": "red"}
 
 class FileSelectorApp(ctk.CTkToplevel):
-    def __init__(self, master, predefined_folder, options_list):
+    def __init__(self, master, predefined_folder, options_list, on_file_selected=None):
         super().__init__(master)
 
         self.title("Selector de Archivo y Opción")
@@ -45,18 +35,22 @@ class FileSelectorApp(ctk.CTkToplevel):
         self.options_list = options_list
         self.filtered_options = options_list.copy()
         self.selected_file = None
+        self.selected_files = []   # con mas de un DVH se comparan los planes (ver run_plan_matrix)
         self.selected_string = None
+        self.on_file_selected = on_file_selected   # para empezar a leer el DVH mientras se elige el protocolo
 
         self.create_widgets()
+        if not options_list:
+            self.option_menu.set("Cargando protocolos...")
 
     def create_widgets(self):
-        self.file_label = ctk.CTkLabel(self, text="Archivo seleccionado:")
+        self.file_label = ctk.CTkLabel(self, text="Archivo(s) seleccionado(s):")
         self.file_label.pack(pady=(10, 0))
 
         self.file_entry = ctk.CTkEntry(self, width=500)
         self.file_entry.pack(pady=5)
 
-        self.browse_button = ctk.CTkButton(self, text="Elegir archivo", command=self.browse_file)
+        self.browse_button = ctk.CTkButton(self, text="Elegir archivo(s)", command=self.browse_file)
         self.browse_button.pack(pady=(0, 20))
 
         self.search_label = ctk.CTkLabel(self, text="Buscar en la lista:")
@@ -74,11 +68,24 @@ class FileSelectorApp(ctk.CTkToplevel):
         self.confirm_button.pack(pady=10)
 
     def browse_file(self):
-        file_path = ctkfiledialog.askopenfilename(initialdir=self.predefined_folder)
-        if file_path:
-            self.selected_file = file_path
+        file_paths = list(ctkfiledialog.askopenfilenames(initialdir=self.predefined_folder))
+        if file_paths:
+            self.selected_files = file_paths
+            self.selected_file = file_paths[0]
             self.file_entry.delete(0, ctk.END)
-            self.file_entry.insert(0, file_path)
+            self.file_entry.insert(0, FILE_SEPARATOR.join(file_paths))
+            if self.on_file_selected is not None:
+                for file_path in file_paths:
+                    self.on_file_selected(file_path)
+
+    def set_options(self, options_list):
+        """ Para cuando la lista de protocolos termina de cargarse con la ventana ya abierta """
+        if not self.winfo_exists():
+            return
+        self.options_list = options_list
+        self.filter_dropdown()
+        if not self.search_entry.get() and "PR+VS+LN 6000-20FX" in options_list:
+            self.option_menu.set("PR+VS+LN 6000-20FX")
 
     def filter_dropdown(self, event=None):
         search_term = self.search_entry.get().lower()
@@ -93,20 +100,27 @@ class FileSelectorApp(ctk.CTkToplevel):
         self.selected_string = value
 
     def confirm_selection(self):
+        if not self.options_list:   # todavia se esta cargando la lista de protocolos
+            return
         self.selected_string = self.option_menu.get()
-        self.selected_file = self.file_entry.get()
+        self.selected_files = [path.strip() for path in self.file_entry.get().split(FILE_SEPARATOR.strip()) if path.strip()]
+        self.selected_file = self.selected_files[0] if self.selected_files else None
         self.destroy()
 
 
 class EstructurasApp(ctk.CTkToplevel):
-    def __init__(self, master, dic_a, dic_b, subset_keys_a):
+    def __init__(self, master, dic_a, dic_b, subset_keys_a, previous_mapping=None, previous_ignored=(), plan_name=None):
         super().__init__(master)
         self.title("Mapeo de estructuras")
+        self.plan_name = plan_name
         self.geometry("900x800")
 
         self.dic_a = dic_a
         self.dic_b = dic_b
         self.subset_keys_a = subset_keys_a
+        # Ultimo mapeo usado con este plan: se usa como valor inicial de cada menu
+        self.previous_mapping = previous_mapping or {}
+        self.previous_ignored = set(previous_ignored or ())
 
         self.mappings = {}
         self.float_inputs = {}
@@ -119,7 +133,8 @@ class EstructurasApp(ctk.CTkToplevel):
         self.create_widgets()
 
     def create_widgets(self):
-        title = ctk.CTkLabel(self, text="Mapeo de estructuras:", font=("Arial", 18))
+        text = f"Mapeo de estructuras: {self.plan_name}" if self.plan_name else "Mapeo de estructuras:"
+        title = ctk.CTkLabel(self, text=text, font=("Arial", 18))
         title.pack(pady=10)
 
         frame = ctk.CTkScrollableFrame(self, width=850, height=600)
@@ -137,13 +152,15 @@ class EstructurasApp(ctk.CTkToplevel):
             # Menú de opciones para mapear
             values = ['-'] if key_a in self.dic_b else list(self.dic_b.keys())
             default_value = values[0]
+            if self.previous_mapping.get(key_a) in values:
+                default_value = self.previous_mapping[key_a]
             option_menu = ctk.CTkOptionMenu(frame, values=values)
             option_menu.set(default_value)
             option_menu.grid(row=i + 1, column=1, padx=10, pady=5, sticky="w")
             self.mappings[key_a] = option_menu
 
             # Checkbox para ignorar o incluir
-            var = ctk.BooleanVar(value=True)  # activado por defecto
+            var = ctk.BooleanVar(value=key_a not in self.previous_ignored)  # activado por defecto
             checkbox = ctk.CTkCheckBox(frame, text="", variable=var)
             checkbox.grid(row=i + 1, column=2, padx=10, pady=5)
             self.ignore_vars[key_a] = var
@@ -169,19 +186,20 @@ class EstructurasApp(ctk.CTkToplevel):
         self.destroy()
 
     @staticmethod
-    def run(master, dic_a, dic_b, subset_keys_a):
-        app = EstructurasApp(master, dic_a, dic_b, subset_keys_a)
+    def run(master, dic_a, dic_b, subset_keys_a, previous_mapping=None, previous_ignored=(), plan_name=None):
+        app = EstructurasApp(master, dic_a, dic_b, subset_keys_a, previous_mapping, previous_ignored, plan_name)
         app.grab_set()
         app.wait_window()
         return app.mapping_result, app.float_result, app.ignored_result
 
 
 class ResultsWindow(ctk.CTkToplevel):
-    def __init__(self, master, presc, dvh, ignored_structures):
+    def __init__(self, master, presc, dvh, ignored_structures, results, tasks=None):
         super().__init__(master)
 
         self.new_dvh_requested = False
         self.dvh = dvh
+        self.tasks = tasks
 
         self.title("Resultado de Constraints")
         self.geometry("800x600")
@@ -194,50 +212,9 @@ class ResultsWindow(ctk.CTkToplevel):
         self.textbox.tag_config("yellow", foreground="orange")
         self.textbox.tag_config("red", foreground="red")
 
-        flecha = "➜"  # flecha más grande y elegante
-
-        for p_name in presc.structures:
-            if p_name in ignored_structures: 
-                continue
-            self.textbox.insert("end", f'{p_name} constraints:\n', ("title",))
-            for constraint in presc.structures[p_name]:
-                if not constraint.ACCEPTABLE_LV_AVAILABLE:
-                    if constraint.VERIFIED_IDEAL[0]:
-                        mensaje = (
-                            f"    PASA IDEAL: {constraint.type}: "
-                            f"{constraint.ideal_dose} {constraint.ideal_volume}  {flecha}  "
-                            f"{constraint.ideal_dose} {constraint.VERIFIED_IDEAL[1]}\n\n"
-                        )
-                        self.textbox.insert("end", mensaje, ("green",))
-                    else:
-                        mensaje = (
-                            f"    NO PASA: {constraint.type}: "
-                            f"{constraint.ideal_dose} {constraint.ideal_volume}  {flecha}  "
-                            f"{constraint.ideal_dose} {constraint.VERIFIED_IDEAL[1]}\n\n"
-                        )
-                        self.textbox.insert("end", mensaje, ("red",))
-                else:
-                    if constraint.VERIFIED_IDEAL[0]:
-                        mensaje = (
-                            f"    PASA IDEAL: {constraint.type}: "
-                            f"{constraint.ideal_dose} {constraint.ideal_volume}  {flecha}  "
-                            f"{constraint.ideal_dose} {constraint.VERIFIED_IDEAL[1]}\n\n"
-                        )
-                        self.textbox.insert("end", mensaje, ("green",))
-                    elif constraint.VERIFIED_ACCEPTABLE[0]:
-                        mensaje = (
-                            f"    PASA ACEPTABLE: {constraint.type}: "
-                            f"{constraint.acceptable_dose} {constraint.acceptable_volume}  {flecha}  "
-                            f"{constraint.acceptable_dose} {constraint.VERIFIED_ACCEPTABLE[1]}\n\n"
-                        )
-                        self.textbox.insert("end", mensaje, ("yellow",))
-                    else:
-                        mensaje = (
-                            f"    NO PASA: {constraint.type}: "
-                            f"{constraint.acceptable_dose} {constraint.acceptable_volume}  {flecha}  "
-                            f"{constraint.acceptable_dose} {constraint.VERIFIED_ACCEPTABLE[1]}\n\n"
-                        )
-                        self.textbox.insert("end", mensaje, ("red",))
+        self.segments = result_segments(presc, results, ignored_structures)
+        for texto, tag in self.segments:
+            self.textbox.insert("end", texto, (tag,))
 
         self.textbox.configure(state="disabled")
         self.textbox.configure(font=("Arial", 16))
@@ -252,8 +229,8 @@ class ResultsWindow(ctk.CTkToplevel):
         new_button = ctk.CTkButton(button_frame, text="Elegir nuevo DVH...", command=self.choose_new)
         new_button.pack(side="left", padx=10)
 
-        save_pdf_button = ctk.CTkButton(button_frame, text="Guardar PDF", command=self.save_as_pdf)
-        save_pdf_button.pack(side="left", padx=10)
+        self.save_pdf_button = ctk.CTkButton(button_frame, text="Guardar PDF", command=self.save_as_pdf)
+        self.save_pdf_button.pack(side="left", padx=10)
 
     def close(self):
         self.destroy()
@@ -277,164 +254,321 @@ class ResultsWindow(ctk.CTkToplevel):
         if not file_path:
             return
 
-        content = self.textbox.get("1.0", "end-1c")
-        lines = content.split("\n")
+        if self.tasks is None:
+            self._write_pdf(file_path)
+            return
+
+        # El PDF se escribe en el NAS: en otro hilo para no congelar la ventana
+        self.save_pdf_button.configure(state="disabled", text="Guardando PDF...")
+        self.tasks.submit(self._write_pdf, file_path,
+                          on_done=lambda _: self._pdf_saved(None), on_error=self._pdf_saved)
+
+    def _write_pdf(self, file_path):
+        with stage('reporte', file=self.dvh.file_path):
+            write_results_pdf(file_path, self.dvh.plan_name, self.dvh.patient_id, self.segments)
+
+    def _pdf_saved(self, error):
+        if not self.winfo_exists():
+            return
+        self.save_pdf_button.configure(state="normal", text="Guardar PDF")
+        if error is not None:
+            messagebox.showerror("Error", f"No se pudo guardar el PDF:\n{error}", parent=self)
+
+
+class PlanMatrixWindow(ctk.CTkToplevel):
+    """ Constraints (filas) x planes (columnas), coloreados por estado, y el mejor plan de cada fila """
+    def __init__(self, master, matrix, tasks=None):
+        super().__init__(master)
+
+        self.new_dvh_requested = False
+        self.matrix = matrix
+        self.tasks = tasks
+
+        self.title("Comparación de planes")
+        self.geometry("1200x700")
+
+        ctk.CTkLabel(self, text=f"Protocolo: {matrix.prescription.presc_template_name}    Paciente: {matrix.patient_id}",
+                     font=("Arial", 16)).pack(pady=(15, 5))
+
+        frame = ctk.CTkScrollableFrame(self, width=1150, height=520)
+        frame.pack(expand=True, fill="both", padx=20, pady=10)
+
+        headers = ["Estructura", "Constraint"] + matrix.labels + ["Mejor"]
+        for column, text in enumerate(headers):
+            ctk.CTkLabel(frame, text=text, font=("Arial", 14, "bold")).grid(row=0, column=column, padx=8, pady=5, sticky="w")
+
+        for i, row in enumerate(matrix.rows, start=1):
+            ctk.CTkLabel(frame, text=row['structure']).grid(row=i, column=0, padx=8, pady=2, sticky="w")
+            ctk.CTkLabel(frame, text=matrix.constraint_text(row['constraint'])).grid(row=i, column=1, padx=8, pady=2, sticky="w")
+            for j, result in enumerate(row['cells']):
+                if result is None:
+                    label = ctk.CTkLabel(frame, text="no evaluada", text_color="gray")
+                else:
+                    font = ("Arial", 13, "bold") if j in row['best'] else ("Arial", 13)
+                    label = ctk.CTkLabel(frame, text=f"{result.ideal[1]}  {STATUS_TEXT[result.status]}",
+                                         text_color=STATUS_COLORS[result.status], font=font)
+                label.grid(row=i, column=2 + j, padx=8, pady=2, sticky="w")
+            best = ", ".join(matrix.labels[j] for j in row['best'])
+            ctk.CTkLabel(frame, text=best).grid(row=i, column=2 + len(matrix.labels), padx=8, pady=2, sticky="w")
+
+        # Totales por plan: cantidad de constraints en cada estado y filas en las que es el mejor
+        totals = len(matrix.rows) + 1
+        ctk.CTkLabel(frame, text="Totales", font=("Arial", 14, "bold")).grid(row=totals, column=0, padx=8, pady=(10, 5), sticky="w")
+        for j, counts in enumerate(matrix.plan_counts()):
+            text = f"{counts['ideal']} / {counts['acceptable']} / {counts['fail']}  (mejor en {counts['best']})"
+            ctk.CTkLabel(frame, text=text).grid(row=totals, column=2 + j, padx=8, pady=(10, 5), sticky="w")
+
+        # --- BOTONES ---
+        button_frame = ctk.CTkFrame(self)
+        button_frame.pack(pady=10)
+
+        ctk.CTkButton(button_frame, text="Cerrar", command=self.destroy).pack(side="left", padx=10)
+        ctk.CTkButton(button_frame, text="Elegir nuevo DVH...", command=self.choose_new).pack(side="left", padx=10)
+
+        self.save_pdf_button = ctk.CTkButton(button_frame, text="Guardar PDF", command=lambda: self.save("pdf"))
+        self.save_pdf_button.pack(side="left", padx=10)
+        self.save_csv_button = ctk.CTkButton(button_frame, text="Guardar CSV", command=lambda: self.save("csv"))
+        self.save_csv_button.pack(side="left", padx=10)
+
+    def choose_new(self):
+        self.new_dvh_requested = True
+        self.destroy()
+
+    def save(self, extension):
+        protocol = self.matrix.prescription.presc_template_name
+        patient_id = self.matrix.patient_id.replace(", ", "_")
+        file_path = ctkfiledialog.asksaveasfilename(
+            initialdir=results_folder_path,
+            initialfile=f"Comparacion_{patient_id}_{protocol}.{extension}",
+            defaultextension=f".{extension}",
+            filetypes=[(f"{extension.upper()} files", f"*.{extension}")],
+            title=f"Guardar comparación como {extension.upper()}"
+        )
+        if not file_path:
+            return
+
+        button = self.save_pdf_button if extension == "pdf" else self.save_csv_button
+        if self.tasks is None:
+            self._write(file_path, extension)
+            return
+
+        # Se escribe en el NAS: en otro hilo para no congelar la ventana
+        button.configure(state="disabled", text="Guardando...")
+        self.tasks.submit(self._write, file_path, extension,
+                          on_done=lambda _: self._saved(button, extension, None),
+                          on_error=lambda e: self._saved(button, extension, e))
+
+    def _write(self, file_path, extension):
+        with stage('reporte', file=file_path):
+            if extension == "pdf":
+                write_matrix_pdf(file_path, self.matrix)
+            else:
+                self.matrix.write_csv(file_path)
+
+    def _saved(self, button, extension, error):
+        if not self.winfo_exists():
+            return
+        button.configure(state="normal", text=f"Guardar {extension.upper()}")
+        if error is not None:
+            messagebox.showerror("Error", f"No se pudo guardar el {extension.upper()}:\n{error}", parent=self)
 
-        c = canvas.Canvas(file_path, pagesize=letter)
-        width, height = letter
 
-        # --- LOGO INTECNUS ---
+def dvh_units_ok(file_path) -> bool:
+    """ Revisa en la primera linea del DVH que la dosis este en cGy y el volumen en cc; si no, avisa """
+    # --- 🔹 Leer primera línea del archivo DVH ---
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            first_line = f.readline().strip()
+    except Exception as e:
+        messagebox.showerror("Error", f"No se pudo leer el archivo DVH:\n{e}")
+        return False
+
+    # --- 🔹 Extraer unidades con expresiones regulares ---
+    dose_match = re.search(r"Dose Units:\s*([A-Za-z]+)", first_line)
+    volume_match = re.search(r"Volume Units:\s*([A-Za-z³]+)", first_line)
+
+    dose_units = dose_match.group(1).lower() if dose_match else ""
+    volume_units = volume_match.group(1).lower() if volume_match else ""
+
+    # --- 🔹 Verificación de unidades ---
+    if "cgy" not in dose_units:
+        messagebox.showwarning(
+            "Dosis relativa detectada",
+            f"El DVH {os.path.basename(file_path)} no está en dosis absoluta (cGy).\n"
+            "Por favor, exporte o seleccione un DVH en dosis absoluta."
+        )
+        return False
+
+    if not any(u in volume_units for u in ["cm", "cc"]):
+        messagebox.showwarning(
+            "Volumen relativo detectado",
+            f"El DVH {os.path.basename(file_path)} no está en volumen absoluto (cc o cm³).\n"
+            "Por favor, exporte o seleccione un DVH en volumen absoluto."
+        )
+        return False
+    return True
+
+
+def run_plan_matrix(root, tasks, session, file_paths, protocol_name):
+    """
+    Compara varios planes contra un protocolo: los DVH se leen y se evaluan en paralelo y el
+    mapeo de estructuras se pide solo para los planes a los que les falta alguna estructura.
+    Devuelve True si se pidio elegir otro DVH, None si se cancelo.
+    """
+    presc_future = tasks.submit(session.prescription, protocol_name)
+    dvh_futures = [tasks.submit(session.dvh, file_path) for file_path in file_paths]
+    if not all(dvh_units_ok(file_path) for file_path in file_paths):
+        return None
+
+    try:
+        presc, *dvhs = tasks.wait([presc_future] + dvh_futures, f"Leyendo {len(file_paths)} DVH y protocolo...")
+    except Exception as e:
+        messagebox.showerror("Error", f"No se pudo cargar algún DVH o el protocolo:\n{e}")
+        return None
+
+    evaluation_futures = []
+    for dvh in dvhs:
+        name_mapping, volume_mapping, ignored_structures = session.last_mapping(dvh, presc.presc_template_name)
+        mapped = {v for v in name_mapping.values() if v and v != "-"}
+        missing = [name for name in presc.structures
+                   if name not in dvh.structures and name not in ignored_structures
+                   and name_mapping.get(name) not in dvh.structures]
+        if missing or not mapped.issubset(dvh.structures):
+            name_mapping, volume_mapping, ignored_structures = EstructurasApp.run(
+                root, presc.structures, dvh.structures, [], name_mapping, ignored_structures, dvh.plan_name
+            )
+            if name_mapping is None:   # se cerro la ventana de mapeo sin confirmar
+                return None
+        session.remember_mapping(dvh, presc.presc_template_name, name_mapping, volume_mapping, ignored_structures)
         try:
-            logo_path = resource_path("images\logo_intecnus.png")
-            c.drawImage(logo_path, 40, height - 130, width=120, preserveAspectRatio=True, mask='auto')
-        except Exception as e:
-            print("No se pudo cargar el logo:", e)
-
-        # --- ENCABEZADO ---
-        y = height - 50
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(180, y, "Resultados de Constraints")
-        y -= 25
-        c.setFont("Helvetica", 12)
-        c.drawString(180, y, f"Plan: {self.dvh.plan_name}")
-        y -= 20
-        c.drawString(180, y, f"Paciente ID: {self.dvh.patient_id}")
-        y -= 20
-        fecha = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        c.drawString(180, y, f"Fecha de generación: {fecha}")
-        y -= 40
-
-        # --- CUERPO CON COLORES ---
-        c.setFont("Helvetica", 10)
-        for i, line in enumerate(lines):
-            start_idx = f"{i+1}.0"
-            tags = self.textbox.tag_names(start_idx)
-
-            color = colors.black
-            if "green" in tags:
-                color = colors.green
-            elif "yellow" in tags:
-                color = colors.orange
-            elif "red" in tags:
-                color = colors.red
-
-            c.setFillColor(color)
-            c.drawString(40, y, line)
-            y -= 14  # interlineado más grande
-            if y < 40:
-                c.showPage()
-                y = height - 50
-                c.setFont("Helvetica", 10)
-
-        c.save()
-
-
-
-
-def get_temp_json_path(dvh):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    temp_folder = os.path.join(script_dir, "Temp")
-    os.makedirs(temp_folder, exist_ok=True)
-
-    filename = f"{dvh.plan_name}_{dvh.patient_id}.json"
-    return os.path.join(temp_folder, filename)
-
-def save_mapping_and_volumes(dvh, name_mapping, volume_mapping):
-    path = get_temp_json_path(dvh)
-    data = {"name_mapping": name_mapping, "volume_mapping": volume_mapping}
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
-def load_mapping_and_volumes_if_exists(dvh):
-    path = get_temp_json_path(dvh)
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data["name_mapping"], data["volume_mapping"]
-    return None, None
+            save_mapping_and_volumes(dvh, name_mapping, volume_mapping)
+        except OSError as e:
+            print(f"No se pudo guardar el mapeo de estructuras: {e}")
+        evaluation_futures.append(tasks.submit(evaluate_plan, dvh, presc, name_mapping, volume_mapping, ignored_structures))
+
+    try:
+        evaluations = tasks.wait(evaluation_futures, f"Evaluando {len(dvhs)} planes...")
+    except Exception as e:
+        messagebox.showerror("Error", f"No se pudieron evaluar los planes:\n{e}")
+        return None
+
+    window = PlanMatrixWindow(root, ConstraintMatrix(presc, evaluations), tasks)
+    window.grab_set()
+    window.wait_window()
+    return window.new_dvh_requested
+
 
 # ------------------------------------------------------------------------------------------------------ 
 
 def main():
     carpeta_predeterminada = dvh_folder_path
-    lista_opciones = xlstools.get_cell_content(
-        file_path=constraint_excel_file_path,
-        cell_coordinate='B2',
-        sheet_name=None
-    )[3:]
+
+    # Con DOSE_POLICE_TRACE=<archivo .json o .csv> se mide cada etapa (ver instrumentation.py)
+    tracer = enable_from_env()
+
+    # Indice local de protocolos (B2 de cada hoja): si ya existe se muestra enseguida y se
+    # revisa el Excel del NAS en segundo plano; la lista nueva se usa en la proxima seleccion
+    protocol_index = ProtocolIndex(constraint_excel_file_path)
 
     root = ctk.CTk()
     root.withdraw()
 
+    # Lectura del NAS, parseo del DVH, Excel y PDF en hilos de fondo; la interfaz no se congela
+    tasks = BackgroundTasks(root)
+    index_future = tasks.submit(protocol_index.refresh)
+
+    # Cache local de DVHs ya parseados: reabrir un plan no vuelve a leer el .txt del NAS
+    try:
+        dvh_cache = DVHCache()
+    except OSError as e:
+        print(f"No se pudo crear el cache de DVHs: {e}")
+        dvh_cache = None
+
+    # Copia local compilada del Excel de protocolos: se lee del NAS solo si el Excel cambio
+    protocol_store = ProtocolStore(constraint_excel_file_path)
+    tasks.submit(protocol_store.refresh)
+
+    # Prescripciones, DVHs y mapeos que se mantienen entre "Elegir nuevo DVH..."
+    session = DosePoliceSession(constraint_excel_file_path, protocol_store, dvh_cache)
+
     while True:
-        selector = FileSelectorApp(root, carpeta_predeterminada, lista_opciones)
+        # Precarga: el DVH se empieza a leer apenas se elige el archivo
+        prefetch = lambda file_path: tasks.submit(session.dvh, file_path, on_error=lambda e: None)
+        if protocol_index.load_cached():
+            selector = FileSelectorApp(root, carpeta_predeterminada, protocol_index.protocol_names(refresh=False)[3:], prefetch)
+        else:
+            # Primera vez: la lista de protocolos se carga mientras se elige el archivo
+            selector = FileSelectorApp(root, carpeta_predeterminada, [], prefetch)
+            tasks.when_done(index_future,
+                            lambda _: selector.set_options(protocol_index.protocol_names(refresh=False)[3:]),
+                            lambda e: messagebox.showerror("Error", f"No se pudo leer la lista de protocolos:\n{e}"))
         selector.grab_set()
         selector.wait_window()
 
         if not selector.selected_file or not selector.selected_string:
             break
 
-        dvh = DVH(selector.selected_file)
-
-        # 🔹 Verificación de unidades
-        # --- 🔹 Leer primera línea del archivo DVH ---
-        try:
-            with open(selector.selected_file, 'r', encoding='utf-8', errors='ignore') as f:
-                first_line = f.readline().strip()
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo leer el archivo DVH:\n{e}")
+        # Varios DVH: matriz de constraints x planes
+        if len(selector.selected_files) > 1:
+            new_dvh_requested = run_plan_matrix(root, tasks, session, selector.selected_files, selector.selected_string)
+            if tracer is not None:
+                tracer.write()
+            if new_dvh_requested is False:
+                break
             continue
 
-        # --- 🔹 Extraer unidades con expresiones regulares ---
-        dose_match = re.search(r"Dose Units:\s*([A-Za-z]+)", first_line)
-        volume_match = re.search(r"Volume Units:\s*([A-Za-z³]+)", first_line)
+        # DVH y prescripcion se cargan en paralelo mientras se revisan las unidades
+        dvh_future = tasks.submit(session.dvh, selector.selected_file)
+        presc_future = tasks.submit(session.prescription, selector.selected_string)
 
-        dose_units = dose_match.group(1).lower() if dose_match else ""
-        volume_units = volume_match.group(1).lower() if volume_match else ""
-
-        # --- 🔹 Verificación de unidades ---
-        if "cgy" not in dose_units:
-            messagebox.showwarning(
-                "Dosis relativa detectada",
-                "El DVH seleccionado no está en dosis absoluta (cGy).\n"
-                "Por favor, exporte o seleccione un DVH en dosis absoluta."
-            )
-            continue  # volver a seleccionar
-
-        if not any(u in volume_units for u in ["cm", "cc"]):
-            messagebox.showwarning(
-                "Volumen relativo detectado",
-                "El DVH seleccionado no está en volumen absoluto (cc o cm³).\n"
-                "Por favor, exporte o seleccione un DVH en volumen absoluto."
-            )
+        # 🔹 Verificación de unidades
+        if not dvh_units_ok(selector.selected_file):
             continue  # volver a seleccionar
 
+        try:
+            dvh, presc = tasks.wait([dvh_future, presc_future], "Leyendo DVH y protocolo...")
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo cargar el DVH o el protocolo:\n{e}")
+            continue
 
-        presc = Prescription(constraint_excel_file_path, selector.selected_string)
-
-        # name_mapping, volume_mapping = load_mapping_and_volumes_if_exists(dvh)
-        ignored_structures = [] 
+        previous_mapping, _, previous_ignored = session.last_mapping(dvh, presc.presc_template_name)
 
         volumen_requested_list = []
         name_mapping, volume_mapping, ignored_structures = EstructurasApp.run(
-            root, presc.structures, dvh.structures, volumen_requested_list
+            root, presc.structures, dvh.structures, volumen_requested_list, previous_mapping, previous_ignored,
+            dvh.plan_name
         )
+        if name_mapping is None:   # se cerro la ventana de mapeo sin confirmar
+            continue
+        session.remember_mapping(dvh, presc.presc_template_name, name_mapping, volume_mapping, ignored_structures)
+
+        # Se guarda el mapeo para que el modo batch (cli.py) lo reuse con este plan
+        try:
+            save_mapping_and_volumes(dvh, name_mapping, volume_mapping)
+        except OSError as e:
+            print(f"No se pudo guardar el mapeo de estructuras: {e}")
 
         # Invertir mapping: {nombre_dvh: nombre_presc}
         mapping_invertido = {v: k for k, v in name_mapping.items() if v and v != "-"}
 
-        actualizar_dvh_con_mapeos(dvh, mapping_invertido, volume_mapping)
+        with stage('mapeo', file=dvh.file_path):
+            actualizar_dvh_con_mapeos(dvh, mapping_invertido, volume_mapping)
 
         # Pasar estructuras ignoradas a dose_police_in_action
-        dose_police_in_action([dvh], presc, ignored_structures)
+        results = dose_police_in_action([dvh], presc, ignored_structures)
 
-        ventana_resultado = ResultsWindow(root, presc, dvh, ignored_structures)
+        ventana_resultado = ResultsWindow(root, presc, dvh, ignored_structures, results, tasks)
         ventana_resultado.grab_set()
         ventana_resultado.wait_window()
 
+        if tracer is not None:
+            tracer.write()
+
         if not ventana_resultado.new_dvh_requested:
             break
 
+    tasks.shutdown()
+
 
 if __name__ == "__main__":
     main()
@@ -1,26 +1,56 @@
-import tkinter as tk
-from tkinter import ttk
+import copy
 import os
-from tkinter import filedialog
+import json
+import warnings
+from collections.abc import MutableMapping
 from typing import List
 import xlstools
-from xlstools import open_workbook
-import matplotlib.pyplot as plt
+from xlstools import XlsxWorkbook
+from instrumentation import stage
+from settings import local_data_dir
 import numpy as np
-import pandas as pd
-from termcolor import colored
-from scipy.interpolate import interp1d
 
-import customtkinter as ctk
-from typing import List
+# tkinter, matplotlib y pandas se importan dentro de las funciones que los usan: la evaluacion
+# (batch, workers, cli) no los necesita y son la mayor parte del tiempo de "import backend"
 
 SPATIAL_RESOLUTION = 0.1 #cm
 BIN_WIDTH = 1 #cGy
 DOSE_UNIT = 'cGy'
 VOLUME_UNIT = '%'
 MAX_DOSE_ABS_VOLUME = 0.03 #cm3
+MAX_VOLUME_ERROR = 0.01 #cm3, error de interpolacion admitido al simplificar un DVH
+MAX_DOSE_ERROR = 1.0 #cGy
+CONSTRAINT_TYPES = ['V(D)>V_%', 'V(D)>V_cc', 'V(D)<V_%', 'V(D)<V_cc', 'D(V_%)<D', 'D(V_cc)<D', 'Dmax', 'Dmedia']
+DVH_ENCODING = 'latin-1' # los .txt de Monaco vienen en ISO-8859
+IGNORED_STRUCTURES = ['camilla', 'espuma', 'isoctsim', 'isoautocontour', 'encastre', 'body', 'external']
 corrected_dict = {}
 
+def round_value(value):
+    """
+    Redondeo a 0.1 de los resultados (volume_function, dose_function y valores de constraints).
+    Es el round() de Python sobre cada float (exacto sobre el valor binario: 4122.15 -> 4122.1),
+    el mismo para un escalar y para un array, asi Constraint.verify y ConstraintPlan coinciden.
+
+    Los arrays van por np.round, que redondea valor * 10 (ya redondeado en binario) a par: solo
+    puede elegir otro decimal que round() cuando valor * 10 queda a un error de redondeo de la
+    mitad, y esos pocos valores se redondean con round().
+    """
+    if np.ndim(value) == 0:
+        return round(float(value), 1)
+    values = np.ascontiguousarray(value, dtype=np.float64)
+    rounded = np.round(values, 1)
+    scaled = values * 10.0
+    with np.errstate(invalid='ignore'):
+        near_half = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) <= np.abs(scaled) * 1e-12)
+    flat_values, flat_rounded = values.ravel(), rounded.reshape(-1)
+    for i in near_half.tolist():
+        flat_rounded[i] = round(float(flat_values[i]), 1)
+    return rounded
+
+class DVHParseError(Exception):
+    """ El archivo de DVH no existe, no se puede leer o no tiene el formato de exportacion de Monaco """
+
+
 def lista_contenida(lista_pequena, lista_grande):
     # Convertimos las listas en conjuntos para aprovechar la eficiencia de las operaciones de conjuntos
     conjunto_pequeno = set(lista_pequena)
@@ -30,16 +60,275 @@ def lista_contenida(lista_pequena, lista_grande):
     return conjunto_pequeno.issubset(conjunto_grande)
 
 
+def parse_dvh_text(raw: bytes):
+    """
+    Parsea de una sola pasada el texto de un DVH exportado por Monaco.
+
+    Devuelve (patient_id, plan_name, date_and_time, labels, dose, volume), donde
+    labels es un array de bytes con la estructura de cada fila y dose/volume son
+    arrays float64 alineados con labels. Acepta cualquier cantidad de espacios
+    entre columnas.
+    """
+    lines = raw.split(b'\n', 3)
+    header = lines[0].decode(DVH_ENCODING).strip()
+    patient_id = header.split(' ')[2]
+    plan_name = header.split(' ')[6]
+
+    # El cuerpo va desde la 4ta linea hasta la fecha del pie (ultima linea no vacia)
+    body, _, footer = lines[3].rstrip().rpartition(b'\n')
+    date_and_time = footer.decode(DVH_ENCODING).strip()
+
+    labels, dose, volume = parse_dvh_rows(body)
+    return patient_id, plan_name, date_and_time, labels, dose, volume
+
+def parse_dvh_rows(body: bytes):
+    """
+    Convierte un bloque de filas "estructura  dosis  volumen" en (labels, dose, volume).
+    """
+    tokens = body.split()
+    n_rows = len(tokens) // 3
+    try:
+        if len(tokens) % 3:
+            raise ValueError('filas con cantidad de columnas distinta de 3')
+        labels = np.array(tokens[0::3])
+        values = np.array(tokens[1::3] + tokens[2::3], dtype=np.float64)
+    except ValueError:
+        # Algun nombre de estructura tiene espacios: separo las dos ultimas columnas por fila
+        rows = [line.rsplit(None, 2) for line in body.splitlines() if line.strip()]
+        n_rows = len(rows)
+        labels = np.array([row[0] for row in rows])
+        values = np.array([row[1] for row in rows] + [row[2] for row in rows], dtype=np.float64)
+
+    return labels, values[:n_rows], values[n_rows:]
+
+def pack_structures(labels: np.ndarray, dose: np.ndarray, volume: np.ndarray):
+    """
+    Agrupa las filas por estructura a partir de los cortes entre corridas de labels.
+
+    Devuelve (names, offsets, dose, volume): las filas de names[i] son
+    dose[offsets[i]:offsets[i+1]], en orden de aparicion. Si una estructura aparece en
+    varias corridas no contiguas sus filas se juntan.
+    """
+    if len(labels) == 0:
+        return [], np.zeros(1, dtype=np.int64), dose, volume
+    bounds = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    starts = np.concatenate(([0], bounds)).tolist()
+    stops = np.concatenate((bounds, [len(labels)])).tolist()
+
+    runs = {}
+    for start, stop in zip(starts, stops):
+        runs.setdefault(labels[start].decode(DVH_ENCODING).strip(), []).append((start, stop))
+
+    names = list(runs)
+    if len(names) < len(starts):
+        order = np.concatenate([np.arange(start, stop) for name in names for start, stop in runs[name]])
+        dose, volume = dose[order], volume[order]
+    lengths = [sum(stop - start for start, stop in runs[name]) for name in names]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    return names, offsets, dose, volume
+
+def structure_key(label: str):
+    """
+    Clave con la que se guarda una estructura en DVH.structures, o None si se ignora.
+    """
+    if label.lower() in IGNORED_STRUCTURES:     # Estructuras que no nos interesa evaluar
+        return None
+    if label.lower() == 'paciente(unsp.tiss.)':
+        return 'PACIENTE'
+    return label.upper()
+
+def index_dvh_blocks(buffer):
+    """
+    Primera pasada sobre el DVH (bytes): ubica el bloque de filas de cada estructura
+    sin convertir ningun numero.
+
+    Devuelve (patient_id, plan_name, date_and_time, blocks) con
+    blocks = {label: [(byte_inicio, byte_fin), ...]} en orden de aparicion. Monaco exporta
+    las filas de cada estructura contiguas; si no lo son, las corridas se juntan igual que
+    en pack_structures.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord('\n'))
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_stops = np.concatenate((newlines, [len(buffer)]))
+
+    header = bytes(buffer[line_starts[0]:line_stops[0]]).decode(DVH_ENCODING).strip()
+    patient_id = header.split(' ')[2]
+    plan_name = header.split(' ')[6]
+
+    # Lineas en blanco (line.strip() vacio). Las filas empiezan con el nombre de la estructura,
+    # asi que solo hace falta mirar las vacias y las que empiezan con un espacio
+    first_bytes = data[np.minimum(line_starts, len(data) - 1)]
+    maybe_blank = np.flatnonzero((line_stops <= line_starts) | (first_bytes == ord(' ')) | (first_bytes == ord('\t'))
+                                 | (first_bytes == ord('\r')) | (first_bytes == ord('\n')))
+    blank = np.zeros(len(line_starts), dtype=bool)
+    blank[maybe_blank] = [not buffer[start:stop].strip()
+                          for start, stop in zip(line_starts[maybe_blank].tolist(), line_stops[maybe_blank].tolist())]
+    # la ultima no vacia es la fecha del pie
+    non_blank = np.flatnonzero(~blank[3:]) + 3
+    footer = non_blank[-1]
+    date_and_time = bytes(buffer[line_starts[footer]:line_stops[footer]]).decode(DVH_ENCODING).strip()
+    row_starts = line_starts[non_blank[:-1]]
+    starts = row_starts.tolist()
+    stops = line_stops[non_blank[:-1]].tolist()
+
+    def label_at(row):
+        return bytes(buffer[starts[row]:stops[row]]).rsplit(None, 2)[0]
+
+    # Busqueda exponencial + binaria del fin de cada bloque: solo se leen O(log n) filas por estructura
+    runs = []
+    n_rows = len(starts)
+    first = 0
+    while first < n_rows:
+        label = label_at(first)
+        inside, outside, step = first, first + 1, 1
+        while outside < n_rows and label_at(outside) == label:
+            inside = outside
+            step *= 2
+            outside = min(first + step, n_rows)
+        while outside - inside > 1:
+            middle = (inside + outside) // 2
+            if label_at(middle) == label:
+                inside = middle
+            else:
+                outside = middle
+        runs.append((label, first, inside))
+        first = outside
+
+    # La busqueda supone filas contiguas: si entre las dos puntas de un bloque quedo otra estructura
+    # (la busqueda la salto), ese bloque se recorre fila por fila
+    blocks = {}
+    for label, first, last in runs:
+        if last - first > 1 and not rows_start_with(data, row_starts[first + 1:last], label):
+            labels = [label_at(row) for row in range(first, last + 1)]
+            bounds = [0] + [i for i in range(1, len(labels)) if labels[i] != labels[i - 1]] + [len(labels)]
+            sub_runs = [(labels[a], first + a, first + b - 1) for a, b in zip(bounds[:-1], bounds[1:])]
+        else:
+            sub_runs = [(label, first, last)]
+        for sub_label, sub_first, sub_last in sub_runs:
+            blocks.setdefault(sub_label.decode(DVH_ENCODING).strip(), []).append((starts[sub_first], stops[sub_last]))
+
+    return patient_id, plan_name, date_and_time, blocks
+
+def rows_start_with(data: np.ndarray, row_starts: np.ndarray, label: bytes) -> bool:
+    """ Si todas las filas que empiezan en row_starts (bytes de data) son de la estructura label """
+    # Se compara de a 8 bytes con una vista uint64 solapada de data (un elemento por byte)
+    words = np.ndarray((len(data) - 7,), dtype='<u8', buffer=data, strides=(1,))
+    padded = label + b'\0' * (-len(label) % 8)
+    for chunk in range(0, len(padded), 8):
+        expected = np.uint64(int.from_bytes(padded[chunk:chunk + 8], 'little'))
+        mask = np.uint64((1 << (8 * min(8, len(label) - chunk))) - 1)
+        if np.any((words[np.minimum(row_starts + chunk, len(words) - 1)] & mask) != expected):
+            return False
+    after = data[np.minimum(row_starts + len(label), len(data) - 1)]
+    return bool(np.all((after == ord(' ')) | (after == ord('\t'))))
+
+
+def simplify_curve(dose, volume, max_volume_error=MAX_VOLUME_ERROR, max_dose_error=MAX_DOSE_ERROR,
+                   reference_volume=None) -> np.ndarray:
+    """
+    Indices de las filas de un DVH acumulado (dosis creciente, volumen no creciente) que alcanzan
+    para que la interpolacion lineal entre ellas no se aparte de la curva original mas de
+    max_volume_error [cm3] en volumen (consultas V(D)) ni de max_dose_error [cGy] en dosis
+    (consultas D(V)), en ningun punto de la curva. Tambien acota a max_dose_error el cambio en la
+    dosis media (Structure.mean, calculada sobre reference_volume).
+
+    Refinamiento de arriba hacia abajo: se parte de los extremos y en cada pasada se agrega, en
+    cada tramo que no cumple, la fila con mayor error (todos los tramos a la vez, vectorizado).
+    """
+    dose = np.asarray(dose, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    n = len(dose)
+    if n <= 2:
+        return np.arange(n)
+    reference_volume = volume[0] if reference_volume is None else reference_volume
+    rows = np.arange(n)
+    # Filas con un tramo original no plano a un lado: solo ahi tiene sentido el error en dosis
+    sloped = np.zeros(n, dtype=bool)
+    sloped[1:] |= volume[:-1] > volume[1:]
+    sloped[:-1] |= volume[:-1] > volume[1:]
+    slab = (volume[:-1] - volume[1:]) * dose[:-1]   # aporte de cada fila a la media (Structure.mean)
+
+    kept = np.array([0, n - 1])
+    while True:
+        segment = np.minimum(np.searchsorted(kept, rows, side='right') - 1, len(kept) - 2)
+        a, b = kept[segment], kept[segment + 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            volume_line = volume[a] + (volume[b] - volume[a]) * (dose - dose[a]) / (dose[b] - dose[a])
+            dose_line = dose[a] + (dose[b] - dose[a]) * (volume - volume[a]) / (volume[b] - volume[a])
+        volume_error = np.abs(np.nan_to_num(volume_line - volume))
+        dose_error = np.where(sloped & (volume[a] != volume[b]), np.abs(np.nan_to_num(dose_line - dose)), 0.0)
+        error = np.maximum(volume_error / max_volume_error, dose_error / max_dose_error)
+        error[kept] = 0.0
+
+        worst = np.maximum.reduceat(error, kept[:-1])
+        if worst.max() > 1.0:
+            bad = worst > 1.0
+        else:
+            # Media: el DVH simplificado toma la dosis del inicio de cada tramo para todo el tramo
+            mean_loss = np.add.reduceat(slab - (volume[:-1] - volume[1:]) * dose[a[:-1]], kept[:-1])
+            excess = mean_loss.sum() / reference_volume - max_dose_error if reference_volume > 0 else 0.0
+            if excess <= 0:
+                return kept
+            order = np.argsort(-mean_loss)
+            needed = np.searchsorted(np.cumsum(mean_loss[order]) / reference_volume, excess) + 1
+            bad = np.zeros(len(worst), dtype=bool)
+            bad[order[:needed]] = True
+            bad &= np.diff(kept) > 1
+            # en esos tramos se parte en la fila que mas rectangulo de area recupera
+            error = (dose - dose[a]) * (volume - volume[b])
+            error[kept] = -1.0
+            worst = np.maximum.reduceat(error, kept[:-1])
+        candidates = np.flatnonzero(bad[segment] & (error == worst[segment]))
+        if not len(candidates):
+            return kept
+        _, first = np.unique(segment[candidates], return_index=True)
+        kept = np.union1d(kept, candidates[first])
+
+
 class Structure:
+    # Sin __dict__: con miles de planes en memoria el overhead por estructura importa. dose_axis y
+    # cumulated_volume_axis suelen ser vistas sobre los buffers de un PackedStructures.
+    # Las magnitudes derivadas (DVH diferencial, media, ...) se calculan recien al pedirlas y quedan
+    # guardadas; las que dependen de volume se descartan cuando cambia.
+    __slots__ = ('label', 'dose_axis', 'cumulated_volume_axis', '_volume', 'constraints',
+                 '_differential_volume_axis', '_mean', '_negated_volume_axis')
+
     def __init__(self, label, dose_axis, cumulated_volume_axis):
         self.label = 'Paciente' if label == 'Paciente(Unsp.Tiss.)' else label
         self.dose_axis = dose_axis
         self.cumulated_volume_axis = cumulated_volume_axis # in cm3
-        self.volume = cumulated_volume_axis[0]  # in cm3
-        self.differential_volume_axis = np.append(self.cumulated_volume_axis[:-1] - self.cumulated_volume_axis[1:], 0.0)
-        self.mean = self._mean_calculation()
+        self._volume = cumulated_volume_axis[0]  # in cm3
         self.constraints = []
-    
+        self._differential_volume_axis = None
+        self._mean = None
+        self._negated_volume_axis = None
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, volume):
+        self._volume = volume
+        self._mean = None   # depende del volumen de referencia
+
+    @property
+    def differential_volume_axis(self):
+        if self._differential_volume_axis is None:
+            self._differential_volume_axis = np.append(self.cumulated_volume_axis[:-1] - self.cumulated_volume_axis[1:], 0.0)
+        return self._differential_volume_axis
+
+    @property
+    def mean(self):
+        if self._mean is None:
+            self._mean = self._mean_calculation()
+        return self._mean
+
+    @property
+    def derived_nbytes(self) -> int:   # memoria de los arrays derivados ya calculados
+        return sum(axis.nbytes for axis in (self._differential_volume_axis, self._negated_volume_axis) if axis is not None)
+
     def _mean_calculation(self):
         if self.volume <= 0:
             return np.nan
@@ -53,24 +342,300 @@ class Structure:
         self.label = name
 
 
+    def _inverse_lookup(self):
+        # Eje de volumen negado: creciente (con mesetas repetidas) para usarlo con np.interp.
+        # En una meseta se toma la mayor dosis que cubre ese volumen, sin depender del orden de empates.
+        if self._negated_volume_axis is None:
+            self._negated_volume_axis = -np.asarray(self.cumulated_volume_axis, dtype=np.float64)
+        return self._negated_volume_axis
+
+    def volume_at(self, doses):   # Dosis en cGy (escalar o array), devuelve volumen en cm3 sin redondear
+        return np.interp(doses, self.dose_axis, self.cumulated_volume_axis,
+                         left=self.cumulated_volume_axis[0], right=self.cumulated_volume_axis[-1])
+
+    def dose_at(self, volumes):   # Volumen en cm3 (escalar o array), devuelve dosis en cGy sin redondear
+        return np.interp(np.negative(volumes), self._inverse_lookup(), self.dose_axis,
+                         left=self.dose_axis[-1], right=self.dose_axis[0])
+
+    def simplified(self, max_volume_error=MAX_VOLUME_ERROR, max_dose_error=MAX_DOSE_ERROR) -> 'Structure':
+        """ Copia con las filas minimas para no apartarse mas de los errores dados (ver simplify_curve) """
+        rows = simplify_curve(self.dose_axis, self.cumulated_volume_axis, max_volume_error, max_dose_error, self.volume)
+        return self._with_axes(self.dose_axis[rows], self.cumulated_volume_axis[rows])
+
+    def resampled(self, dose_grid) -> 'Structure':
+        """ Copia con la curva interpolada en dose_grid [cGy] (creciente, desde 0) """
+        dose_grid = np.asarray(dose_grid, dtype=np.float64)
+        return self._with_axes(dose_grid, self.volume_at(dose_grid))
+
+    def _with_axes(self, dose_axis, cumulated_volume_axis) -> 'Structure':
+        structure = Structure(self.label, dose_axis, cumulated_volume_axis)
+        structure.volume_update(self.volume)
+        return structure
+
     def volume_function(self, dose):   # Entrada de dosis en cGy, devuelve volumen en cm3
-        y_min = self.cumulated_volume_axis[0]
-        y_max = self.cumulated_volume_axis[-1]
-        dvh = interp1d(self.dose_axis, self.cumulated_volume_axis, kind='linear', bounds_error=False, fill_value=(y_min, y_max))
-        return round(dvh(dose).item(), 1)
+        return round_value(self.volume_at(dose))
     
     def dose_function(self, volume):   # Entrada de volumen en cm3, devuelve dosis en cGy
-        y_min = self.dose_axis[0]
-        y_max = self.dose_axis[-1]
-        vdh = interp1d(self.cumulated_volume_axis, self.dose_axis, kind='linear', bounds_error=False, fill_value=(y_min, y_max))
-        return round(vdh(volume).item(), 1)
+        return round_value(self.dose_at(volume))
+
+class LazyStructures(MutableMapping):
+    """
+    Mapping {clave: Structure} que parsea las filas de cada estructura recien cuando se la pide.
+
+    entries: {clave: (label, [(byte_inicio, byte_fin), ...])} sobre buffer (bytes).
+    """
+    def __init__(self, buffer, entries):
+        self._buffer = buffer
+        self._entries = dict(entries)
+
+    def __getitem__(self, key):
+        entry = self._entries[key]
+        if not isinstance(entry, Structure):
+            label, spans = entry
+            blocks = [parse_dvh_rows(self._buffer[start:stop]) for start, stop in spans]
+            dose_axis = np.concatenate([block[1] for block in blocks])
+            volume_axis = np.concatenate([block[2] for block in blocks])
+            entry = self._entries[key] = Structure(label, dose_axis, volume_axis)
+        return entry
+
+    def __setitem__(self, key, structure):
+        self._entries[key] = structure
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def is_loaded(self, key) -> bool:
+        return isinstance(self._entries[key], Structure)
+
+    def copy(self) -> 'LazyStructures':
+        """
+        Copia con las estructuras ya parseadas duplicadas (comparten los arrays), para
+        poder renombrarlas o cambiarles el volumen sin tocar este mapping.
+        """
+        entries = {key: copy.copy(entry) if isinstance(entry, Structure) else entry
+                   for key, entry in self._entries.items()}
+        return LazyStructures(self._buffer, entries)
+
+    def rekeyed(self, key_map: dict) -> 'LazyStructures':
+        """
+        Devuelve el mapping renombrado segun key_map {clave_vieja: (clave_nueva, label_nuevo)}
+        sin parsear las estructuras pendientes.
+        """
+        entries = {}
+        for old_key, (new_key, new_label) in key_map.items():
+            entry = self._entries[old_key]
+            if isinstance(entry, Structure):
+                entry.label_update(new_label)
+            else:
+                entry = (new_label, entry[1])
+            entries[new_key] = entry
+        return LazyStructures(self._buffer, entries)
+
+class PackedStructures(MutableMapping):
+    """
+    Mapping {clave: Structure} en formato struct-of-arrays: las filas de todas las estructuras estan
+    en un solo buffer de dosis y uno de volumen, y las de la estructura i son
+    dose[offsets[i]:offsets[i+1]]. Cada Structure se arma recien al pedirla y es una vista sobre
+    los buffers (no copia). Al serializarlo (pickle, procesos worker) viajan solo los buffers.
+
+    entries: {clave: (indice, label)}.
+    """
+    def __init__(self, offsets, dose, volume, entries):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.dose = dose
+        self.volume = volume
+        self._entries = dict(entries)
+        self._views = {}       # estructuras ya pedidas (pueden tener label o volumen cambiados)
+
+    @classmethod
+    def from_structures(cls, structures, dtype=np.float64) -> 'PackedStructures':
+        """ Empaqueta un mapping {clave: Structure} cualquiera en buffers nuevos de tipo dtype """
+        keys = list(structures)
+        items = [structures[key] for key in keys]
+        lengths = [len(structure.dose_axis) for structure in items]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        dose = np.empty(offsets[-1], dtype=dtype)
+        volume = np.empty(offsets[-1], dtype=dtype)
+        for i, structure in enumerate(items):
+            dose[offsets[i]:offsets[i + 1]] = structure.dose_axis
+            volume[offsets[i]:offsets[i + 1]] = structure.cumulated_volume_axis
+        packed = cls(offsets, dose, volume, {key: (i, structure.label) for i, (key, structure) in enumerate(zip(keys, items))})
+        for key, structure in zip(keys, items):
+            if structure.volume != structure.cumulated_volume_axis[0]:
+                packed[key].volume_update(structure.volume)
+        return packed
+
+    def __getitem__(self, key):
+        view = self._views.get(key)
+        if view is None:
+            index, label = self._entries[key][:2]
+            start, stop = self.offsets[index], self.offsets[index + 1]
+            view = Structure(label, self.dose[start:stop], self.volume[start:stop])
+            if len(self._entries[key]) > 2:     # volumen cambiado antes de serializar
+                view.volume_update(self._entries[key][2])
+            self._views[key] = view
+        return view
+
+    def __setitem__(self, key, structure):
+        # Una Structure de afuera no esta en los buffers: se guarda tal cual
+        self._entries[key] = (None, structure.label)
+        self._views[key] = structure
+
+    def __delitem__(self, key):
+        del self._entries[key]
+        self._views.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def is_loaded(self, key) -> bool:
+        return key in self._views
+
+    def index_of(self, key):
+        """ Posicion de la estructura en offsets, o None si no esta en los buffers """
+        return self._entries[key][0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.dose.nbytes + self.volume.nbytes
+
+    def astype(self, dtype) -> 'PackedStructures':
+        """ Copia con los buffers en dtype (np.float32 usa la mitad de memoria) """
+        return PackedStructures.from_structures(self, dtype)
+
+    def copy(self) -> 'PackedStructures':
+        """
+        Copia que comparte los buffers, con las estructuras ya pedidas duplicadas, para poder
+        renombrarlas o cambiarles el volumen sin tocar este mapping.
+        """
+        new = PackedStructures(self.offsets, self.dose, self.volume, self._entries)
+        new._views = {key: copy.copy(view) for key, view in self._views.items()}
+        return new
+
+    def rekeyed(self, key_map: dict) -> 'PackedStructures':
+        """
+        Devuelve el mapping renombrado segun key_map {clave_vieja: (clave_nueva, label_nuevo)}
+        sin armar las estructuras pendientes.
+        """
+        new = PackedStructures(self.offsets, self.dose, self.volume, {})
+        for old_key, (new_key, new_label) in key_map.items():
+            new._entries[new_key] = (self._entries[old_key][0], new_label) + tuple(self._entries[old_key][2:])
+            if old_key in self._views:
+                view = self._views[old_key]
+                view.label_update(new_label)
+                new._views[new_key] = view
+        return new
+
+    def __getstate__(self):
+        entries = {}
+        for key, entry in self._entries.items():
+            view = self._views.get(key)
+            if entry[0] is None:
+                entries[key] = view
+            elif view is None:
+                entries[key] = entry
+            elif view.volume != view.cumulated_volume_axis[0]:
+                entries[key] = (entry[0], view.label, view.volume)
+            else:
+                entries[key] = (entry[0], view.label)
+        return {'offsets': self.offsets, 'dose': self.dose, 'volume': self.volume, 'entries': entries}
+
+    def __setstate__(self, state):
+        self.__init__(state['offsets'], state['dose'], state['volume'], {})
+        for key, entry in state['entries'].items():
+            if isinstance(entry, Structure):
+                self[key] = entry
+            else:
+                self._entries[key] = entry
 
 class DVH:
-    def __init__(self, file_path):
+    def __init__(self, file_path, lazy: bool = False, cache=None):
+        """
+        lazy: indexa el archivo y parsea cada estructura recien al pedirla (el .txt queda en memoria,
+              no abierto).
+        cache: DVHCache opcional; si el DVH ya esta cacheado no se lee el .txt. Si se pasa cache,
+               gana sobre lazy: un DVH nuevo se parsea completo para poder guardarlo, y en los dos
+               casos las estructuras salen de un PackedStructures, que tambien arma cada Structure
+               recien al pedirla.
+        Levanta DVHParseError si el archivo no existe o no se puede parsear.
+        """
         self.file_path = file_path
-        self.patient_id, self.plan_name, self.date_and_time, self.structures = self._DVH_data_parser()
+        self.lazy = lazy
+        self.cache = cache
+        with stage('dvh', file=file_path):
+            if cache is not None:
+                self.patient_id, self.plan_name, self.date_and_time, self.structures = self._DVH_cached_parser()
+            elif lazy:
+                self.patient_id, self.plan_name, self.date_and_time, self.structures = self._DVH_lazy_indexer()
+            else:
+                self.patient_id, self.plan_name, self.date_and_time, self.structures = self._DVH_data_parser()
+
+    def copy(self) -> 'DVH':
+        """
+        Copia para remapear sin tocar este DVH: los arrays se comparten (nunca se modifican)
+        pero cada Structure es otro objeto, asi label_update/volume_update no afectan al original.
+        """
+        new = copy.copy(self)
+        if isinstance(self.structures, (LazyStructures, PackedStructures)):
+            new.structures = self.structures.copy()
+        else:
+            new.structures = {key: copy.copy(structure) for key, structure in self.structures.items()}
+        return new
+
+    def compact(self, dtype=np.float64) -> 'DVH':
+        """
+        Pasa las estructuras a un PackedStructures con buffers propios de tipo dtype (con
+        np.float32 ocupan la mitad) y sin las filas de las estructuras ignoradas. Un DVH lazy
+        se parsea completo. Devuelve el mismo DVH.
+        """
+        self.structures = PackedStructures.from_structures(self.structures, dtype)
+        self.lazy = False
+        return self
+
+    def simplify(self, max_volume_error=MAX_VOLUME_ERROR, max_dose_error=MAX_DOSE_ERROR) -> 'DVH':
+        """
+        Deja en cada estructura solo las filas necesarias para que V(D), D(V) y la dosis media no
+        cambien mas que max_volume_error [cm3] y max_dose_error [cGy], empaquetadas como en
+        compact(). Devuelve el mismo DVH.
+        """
+        with stage('simplificacion', file=self.file_path):
+            self.structures = PackedStructures.from_structures(
+                {key: structure.simplified(max_volume_error, max_dose_error) for key, structure in self.structures.items()})
+        self.lazy = False
+        return self
+
+    def resample(self, dose_step=BIN_WIDTH, max_dose=None) -> 'DVH':
+        """
+        Lleva todas las estructuras a la grilla uniforme 0, dose_step, ... hasta max_dose (por
+        defecto la mayor dosis del DVH) [cGy]. Devuelve el mismo DVH.
+        """
+        if max_dose is None:
+            max_dose = max((float(structure.dose_axis[-1]) for structure in self.structures.values()), default=0.0)
+        dose_grid = np.arange(0.0, max_dose + dose_step, dose_step)
+        self.structures = PackedStructures.from_structures(
+            {key: structure.resampled(dose_grid) for key, structure in self.structures.items()})
+        self.lazy = False
+        return self
 
     def _file_finder(self, window_title: str) -> str:
+        import tkinter as tk
+        from tkinter import filedialog
+
         tk.Tk().withdraw() # prevents an empty tkinter window from appearing
         my_directory = filedialog.askopenfilename(initialdir=os.getcwd(), 
                                            title=window_title, 
@@ -79,45 +644,82 @@ class DVH:
 
     def _DVH_data_parser(self) -> List:
             try:
-                with open(self.file_path, 'r') as file:
-                    data = file.readlines()
-                    header = data[0]
-
-                    patient_id = header.split(' ')[2]
-                    plan_name = header.split(' ')[6]
-                    date_and_time = data[-1]
-
-                    data_dict = {}
-                    for row in data[3:-3]:
-                        row = row.replace('\n','').split('                    ')
-                        key = row[0]
-                        values = [float(row[1]), float(row[2])]
-                        
-                        # Verificar si la key ya existe en el diccionario
-                        if key in data_dict.keys():
-                            data_dict[key].append(values)
-                        else:
-                            data_dict[key] = [values]
-
-                    structures_dict = {}
-                    for key in data_dict:
-                        # convierto a numpy.array para poder transponer
-                        dummy = np.array(data_dict[key]).T
-                        if key.lower() in ['camilla', 'espuma', 'isoctsim', 'isoautocontour', 'encastre', 'body', 'external']:     # Estructuras que no nos interesa evaluar
-                            continue
-                        elif key.lower()=='paciente(unsp.tiss.)':  
-                            structures_dict['PACIENTE']= Structure(key.upper(),dummy[0],dummy[1])
-                        else:
-                            structures_dict[key.upper()]= Structure(key.upper(),dummy[0],dummy[1])
-                           
-                    return patient_id, plan_name, date_and_time, structures_dict
-                
-            except FileNotFoundError:
-                print(f"El archivo '{self.archivo}' no fue encontrado.")
-            except Exception as e:
-                print(f"Error al leer el archivo: {e}")
+                with stage('dvh_lectura'), open(self.file_path, 'rb') as file:
+                    raw = file.read()
+
+                with stage('dvh_parseo'):
+                    patient_id, plan_name, date_and_time, labels, dose, volume = parse_dvh_text(raw)
+                    names, offsets, dose, volume = pack_structures(labels, dose, volume)
+
+                return patient_id, plan_name, date_and_time, self._structures_from_packed(names, offsets, dose, volume)
+
+            except FileNotFoundError as e:
+                raise DVHParseError(f"El archivo '{self.file_path}' no fue encontrado.") from e
+            except (OSError, ValueError, IndexError) as e:   # archivo ilegible o que no es un DVH de Monaco
+                raise DVHParseError(f"Error al leer el archivo '{self.file_path}': {e}") from e
+
+    def _DVH_cached_parser(self) -> List:
+            try:
+                entry = self.cache.get(self.file_path)
+                if entry is None:
+                    with stage('dvh_lectura'), open(self.file_path, 'rb') as file:
+                        raw = file.read()
+                    digest = self.cache.digest(raw)
+                    entry = self.cache.get(self.file_path, digest)
+
+                if entry is None:
+                    with stage('dvh_parseo'):
+                        patient_id, plan_name, date_and_time, labels, dose, volume = parse_dvh_text(raw)
+                        names, offsets, dose, volume = pack_structures(labels, dose, volume)
+                    entry = {'patient_id': patient_id, 'plan_name': plan_name, 'date_and_time': date_and_time,
+                             'names': names, 'offsets': offsets, 'dose': dose, 'volume': volume}
+                    try:
+                        self.cache.put(self.file_path, digest, entry)
+                    except OSError as e:
+                        print(f"No se pudo guardar el DVH en cache: {e}")
+
+                structures = self._structures_from_packed(entry['names'], entry['offsets'], entry['dose'], entry['volume'])
+                return entry['patient_id'], entry['plan_name'], entry['date_and_time'], structures
+
+            except FileNotFoundError as e:
+                raise DVHParseError(f"El archivo '{self.file_path}' no fue encontrado.") from e
+            except (OSError, ValueError, IndexError) as e:   # archivo ilegible o que no es un DVH de Monaco
+                raise DVHParseError(f"Error al leer el archivo '{self.file_path}': {e}") from e
+
+    @staticmethod
+    def _structures_from_packed(names, offsets, dose, volume) -> PackedStructures:
+        entries = {}
+        for i, label in enumerate(names):
+            key = structure_key(label)
+            if key is not None:
+                entries[key] = (i, label.upper())
+        return PackedStructures(offsets, dose, volume, entries)
+
+    def _DVH_lazy_indexer(self) -> List:
+            try:
+                # Se copia el archivo a memoria en vez de mapearlo: un mmap abierto mientras el DVH vive
+                # en la sesion impide en Windows renombrar o borrar la exportacion en el NAS
+                with stage('dvh_lectura'), open(self.file_path, 'rb') as file:
+                    buffer = file.read()
+
+                patient_id, plan_name, date_and_time, blocks = index_dvh_blocks(buffer)
+
+                entries = {}
+                for label, spans in blocks.items():
+                    key = structure_key(label)
+                    if key is not None:
+                        entries[key] = (label.upper(), spans)
+
+                return patient_id, plan_name, date_and_time, LazyStructures(buffer, entries)
+
+            except FileNotFoundError as e:
+                raise DVHParseError(f"El archivo '{self.file_path}' no fue encontrado.") from e
+            except (OSError, ValueError, IndexError) as e:   # archivo ilegible o que no es un DVH de Monaco
+                raise DVHParseError(f"Error al leer el archivo '{self.file_path}': {e}") from e
 
     def plot(self, DIFFERENTIAL_DVH: bool=False) -> None:
+        import matplotlib.pyplot as plt
+
         print('RESUMEN DEL DVH INGRESADO:')
         print(f'\tPatient ID: {self.patient_id}')
         print(f'\tPlan Name: {self.plan_name}')
@@ -149,12 +751,10 @@ class Constraint:
     def __init__(self, constraints_chart_line):
         self.structure_name, self.type, self.ideal_dose, self.ideal_volume, self.acceptable_dose, self.acceptable_volume = constraints_chart_line
         self.structure_name = self.structure_name.upper()
-        self.VERIFIED_IDEAL = (False, 0.0)
-        self.VERIFIED_ACCEPTABLE = (False, 0.0)
-        self.ACCEPTABLE_LV_AVAILABLE = self.acceptable_dose != 'None'
+        self.ACCEPTABLE_LV_AVAILABLE = self.acceptable_dose is not None
 
     def _evaluate(self, structure, ref1, ref2):   #ref1 y ref2 despues podran ser contraint ideal o aceptable
-        constraint_types = ['V(D)>V_%', 'V(D)>V_cc', 'V(D)<V_%', 'V(D)<V_cc', 'D(V_%)<D', 'D(V_cc)<D', 'Dmax', 'Dmedia']
+        constraint_types = CONSTRAINT_TYPES
 
         if self.type in constraint_types[:4]:
             is_superior = self.type in (constraint_types[2], constraint_types[3])
@@ -172,7 +772,7 @@ class Constraint:
             else:
                 PASS = False
             #print(PASS, result, ref_vol, ref_dose)
-            return (PASS, round(result, 1))
+            return (PASS, round_value(result))
             
             
         elif self.type in constraint_types[4:6]:
@@ -187,7 +787,7 @@ class Constraint:
                 PASS = True
             else:
                 PASS = False
-            return (PASS, round(result, 1))
+            return (PASS, round_value(result))
             
         elif self.type in constraint_types[6:]:
             dmax       = self.type == constraint_types[6]
@@ -202,31 +802,163 @@ class Constraint:
                 PASS = True
             else:
                 PASS = False
-            return (PASS, round(result, 1))
+            return (PASS, round_value(result))
             
         else:
             PASS = False
-            print('No existe el tipo de constraint en las lista de tipos de constraints.')
+            warnings.warn(f"No existe el tipo de constraint '{self.type}' en la lista de tipos de constraints.")
             return (PASS, 'None')
 
 
-    def verify(self, structure: Structure):   
-        #print(f'Verifico ideal?: {self.VERIFIED_IDEAL[0]}, Hay level aceptable?: {self.ACCEPTABLE_LV_AVAILABLE}')
-        self.VERIFIED_IDEAL = self._evaluate(structure, self.ideal_dose, self.ideal_volume)
+    def verify(self, structure: Structure) -> 'ConstraintResult':
+        # No modifica el constraint: el resultado es propio de la estructura (y del DVH) evaluados
+        ideal = self._evaluate(structure, self.ideal_dose, self.ideal_volume)
+        acceptable = None
+        if not ideal[0] and self.ACCEPTABLE_LV_AVAILABLE:
+            acceptable = self._evaluate(structure, self.acceptable_dose, self.acceptable_volume)
+        return ConstraintResult(self, ideal, acceptable)
 
-        if not self.VERIFIED_IDEAL[0] and self.ACCEPTABLE_LV_AVAILABLE:
-            
-            self.VERIFIED_ACCEPTABLE = self._evaluate(structure, self.acceptable_dose, self.acceptable_volume) 
+class ConstraintResult:
+    """
+    Resultado de evaluar un Constraint sobre una estructura de un DVH.
+
+    ideal y acceptable son tuplas (PASA, valor). acceptable es None si no hizo falta
+    evaluarlo (paso el ideal o el constraint no tiene nivel aceptable).
+    """
+    def __init__(self, constraint: Constraint, ideal: tuple, acceptable: tuple = None):
+        self.constraint = constraint
+        self.ideal = ideal
+        self.acceptable = acceptable
+
+    @property
+    def status(self) -> str:   # 'ideal', 'acceptable' o 'fail'
+        if self.ideal[0]:
+            return 'ideal'
+        if self.acceptable is not None and self.acceptable[0]:
+            return 'acceptable'
+        return 'fail'
+
+    @property
+    def value(self):   # valor del ultimo nivel evaluado
+        return self.ideal[1] if self.acceptable is None else self.acceptable[1]
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):   # celdas vacias (None) o texto
+        return np.nan
+
+class ConstraintPlan:
+    """
+    Constraints de una estructura compilados a arrays numericos.
+
+    Columna 0 = nivel ideal, columna 1 = nivel aceptable. evaluate() resuelve ambos niveles
+    de todos los constraints con una llamada a volume_at y otra a dose_at.
+    """
+    def __init__(self, constraints: List[Constraint]):
+        self.constraints = constraints
+        self.kind = np.array([CONSTRAINT_TYPES.index(c.type) if c.type in CONSTRAINT_TYPES else -1 for c in constraints], dtype=np.int8)
+        self.ref1 = np.array([[_to_float(c.ideal_dose), _to_float(c.acceptable_dose)] for c in constraints], dtype=np.float64).reshape(-1, 2)
+        self.ref2 = np.array([[_to_float(c.ideal_volume), _to_float(c.acceptable_volume)] for c in constraints], dtype=np.float64).reshape(-1, 2)
+        self.acceptable_available = np.array([c.ACCEPTABLE_LV_AVAILABLE for c in constraints], dtype=bool)
+
+        self.volume_query = self.kind <= 3                              # V(D): se interpola volumen en ref1
+        self.volume_in_percent = np.isin(self.kind, (0, 2, 4))        # V(D) o D(V) en %
+        self.dose_query = (self.kind == 4) | (self.kind == 5)           # D(V): se interpola dosis en ref1
+        self.dose_max = self.kind == 6
+        self.dose_mean = self.kind == 7
+        self.lower_bound = self.kind <= 1                               # unicos tipos 'mayor que'
+        self.unknown = self.kind < 0
+        for unknown_type in dict.fromkeys(c.type for c, unknown in zip(constraints, self.unknown) if unknown):
+            warnings.warn(f"No existe el tipo de constraint '{unknown_type}' en la lista de tipos de constraints.", stacklevel=2)
+        self.volume_query &= ~self.unknown
+        # Limite contra el que se compara: ref2 para V(D) y D(V), ref1 para Dmax y Dmedia
+        self.limit = np.where((self.dose_max | self.dose_mean)[:, None], self.ref1, self.ref2)
+        # Referencias que no son numeros (texto, celda vacia) en un nivel que se usa: Constraint.verify
+        # levanta ValueError en float(); evaluate() tambien, en vez de dejar un NaN que no pasa. El
+        # nivel aceptable solo se evalua (y solo falla) si no paso el ideal
+        needs_ref2 = (self.kind >= 0) & (self.kind <= 5)
+        self.invalid = (np.isnan(self.ref1) | (needs_ref2[:, None] & np.isnan(self.ref2))) & ~self.unknown[:, None]
+        self.invalid[:, 1] &= self.acceptable_available
+
+    def evaluate(self, structure: Structure):
+        """
+        Devuelve (passed, values), arrays (n_constraints, 2) para los niveles ideal y aceptable.
+        values es NaN para los tipos de constraint desconocidos y para un nivel aceptable con
+        referencias no numericas. Levanta ValueError si algun valor de referencia de un nivel a
+        evaluar no es numerico: el ideal siempre, el aceptable si no paso el ideal.
+        """
+        self._check_references(self.invalid[:, 0], 0)
+        values = np.full(self.ref1.shape, np.nan)
+
+        if self.volume_query.any():
+            volumes = round_value(structure.volume_at(self.ref1[self.volume_query]))
+            percent = self.volume_in_percent[self.volume_query, None]
+            values[self.volume_query] = np.where(percent, volumes / structure.volume * 100.0, volumes)
+
+        dose_rows = self.dose_query | self.dose_max
+        if dose_rows.any():
+            ref_volumes = np.where(self.volume_in_percent[:, None], self.ref1 / 100.0 * structure.volume, self.ref1)
+            ref_volumes[self.dose_max] = MAX_DOSE_ABS_VOLUME
+            values[dose_rows] = round_value(structure.dose_at(ref_volumes[dose_rows]))
+
+        if self.dose_mean.any():
+            values[self.dose_mean] = structure.mean
+
+        passed = np.where(self.lower_bound[:, None], values >= self.limit, values <= self.limit)
+        self._check_references(self.invalid[:, 1] & ~passed[:, 0], 1)
+        return passed, values
+
+    def _check_references(self, invalid, level):
+        if invalid.any():
+            constraint = self.constraints[int(np.flatnonzero(invalid)[0])]
+            refs = ((constraint.ideal_dose, constraint.ideal_volume), (constraint.acceptable_dose, constraint.acceptable_volume))[level]
+            raise ValueError(f"Constraint {constraint.structure_name} {constraint.type}: valor de referencia no numerico {refs}")
+
+    def verify(self, structure: Structure) -> List[ConstraintResult]:
+        # Mismo resultado que Constraint.verify sobre cada constraint, en una sola pasada
+        passed, values = self.evaluate(structure)
+        rounded = round_value(values).tolist()
+        results = []
+        for i, constraint in enumerate(self.constraints):
+            if self.unknown[i]:
+                acceptable = (False, 'None') if constraint.ACCEPTABLE_LV_AVAILABLE else None
+                results.append(ConstraintResult(constraint, (False, 'None'), acceptable))
+                continue
+            ideal = (bool(passed[i, 0]), rounded[i][0])
+            acceptable = None
+            if not passed[i, 0] and self.acceptable_available[i]:
+                acceptable = (bool(passed[i, 1]), rounded[i][1])
+            results.append(ConstraintResult(constraint, ideal, acceptable))
+        return results
+
+def prescription_sheet_charts(sheet) -> list:
+    """
+    Lee una hoja de protocolo (rango A4:G45) y devuelve [tabla_targets, tabla_constraints]
+    sin los encabezados: listas de filas con float, str o None en las celdas vacias.
+    """
+    excel_data = xlstools.cell_data_importer(sheet,
+                                            (4,'A'), 
+                                            (45,'G'))
+
+    chunks_charts = xlstools.none_based_data_parser(excel_data)
+
+    assert len(chunks_charts)==2, "Error de importacion de chunks. Numero de chunks: "+f'{len(chunks_charts)}'
+    return [chunks_charts[0][1:], chunks_charts[1][1:]]
 
-        #print(f'Constraint: {self.type} - {self.structure_name} - Ideal: {self.ideal_dose} {self.ideal_volume} - Aceptable: {self.acceptable_dose} {self.acceptable_volume}')
-            
 class Prescription:
-    def __init__(self, constraint_excel_filepath, presc_template_name):
+    def __init__(self, constraint_excel_filepath, presc_template_name, store=None):
+        """
+        store: ProtocolStore opcional; si se pasa, la hoja se lee de la copia compilada local
+               en vez de abrir el Excel.
+        """
         self.constraint_excel_filepath = constraint_excel_filepath
         self.presc_template_name = presc_template_name.upper()
+        self.store = store
         self.structures = {}
 
-        constraints_chart = self._prescription_importer()
+        with stage('prescripcion', file=constraint_excel_filepath, protocolo=self.presc_template_name):
+            constraints_chart = self._prescription_importer()
 
         target_chart = constraints_chart.pop(0)
         constraints_chart = [sublist[1:] for sublist in constraints_chart[0]]
@@ -238,31 +970,38 @@ class Prescription:
 
         for constraint_chart_line in constraints_chart:
             new_structure_name = constraint_chart_line[0]
-            if new_structure_name != 'None':
-                structure_name = new_structure_name.upper()
+            if new_structure_name is not None:
+                structure_name = str(new_structure_name).upper()
                 self.structures[structure_name] = []
-                self.structures[structure_name].append(Constraint(constraint_chart_line))
-            else:
-                self.structures[structure_name].append(Constraint(constraint_chart_line))   
-
+            # Las filas que siguen a la de la estructura tienen la celda del nombre vacia
+            self.structures[structure_name].append(Constraint([structure_name] + list(constraint_chart_line[1:])))
+
+        # Se compila una sola vez; despues la prescripcion es de solo lectura y se puede
+        # compartir entre DVHs, hilos o procesos
+        self._compiled_plans = {name: ConstraintPlan(constraints) for name, constraints in self.structures.items()}
+        self.store = None   # no hace falta despues de construir (y asi se serializa liviana)
+
+    def compiled(self) -> dict:
+        """
+        Constraints compilados por estructura, {nombre: ConstraintPlan}.
+        """
+        return self._compiled_plans
             
     def _prescription_importer(self):
         # workbook = openpyxl.load_workbook(self.constraint_excel_filepath)
         # for name in workbook.sheetnames:
         #     print(name)
-        excel_data = xlstools.cell_data_importer(open_workbook(self.constraint_excel_filepath, self.presc_template_name),
-                                                (4,'A'), 
-                                                (45,'G'))
-
-        chunks_charts = xlstools.none_based_data_parser(excel_data)
+        if self.store is not None:
+            # Copia local ya compilada del Excel (se recompila sola si el Excel cambio)
+            return self.store.constraints_chart(self.presc_template_name)
 
-        assert len(chunks_charts)==2, "Error de importacion de chunks. Numero de chunks: "+f'{len(chunks_charts)}'
-        if len(chunks_charts)==2:
-            constraints_chart = [chunks_charts[0][1:], chunks_charts[1][2:]]
+        with XlsxWorkbook(self.constraint_excel_filepath) as workbook:
+            return prescription_sheet_charts(workbook[self.presc_template_name])
 
-        return constraints_chart
+    def print(self, results: dict = None):
+        import pandas as pd
+        from report import reference_text
 
-    def print(self):
         print(f'Resumen de datos ingresados de la prescripcion:'.upper())
         print(f'\tPresc. Name: {self.presc_template_name}')
         print(f'\tPath: {self.constraint_excel_filepath}')
@@ -271,16 +1010,21 @@ class Prescription:
             print(f'\t\t{structure_name}:\t',content)
         print('\n')
         
+        if results is None:
+            return
+
         dummy = []
-        for structure_name, constraints in self.structures.items():
-            for constraint in constraints:
-                if constraint.VERIFIED_IDEAL[0]:
-                    check = f'    PASS IDEAL: {constraint.VERIFIED_IDEAL[1]}'  
-                elif constraint.VERIFIED_ACCEPTABLE[0]:
-                    check = f'    PASS ACEPTABLE: {constraint.VERIFIED_ACCEPTABLE[1]}'
+        for structure_name, structure_results in results.items():
+            for result in structure_results:
+                constraint = result.constraint
+                if result.status == 'ideal':
+                    check = f'    PASS IDEAL: {result.ideal[1]}'  
+                elif result.status == 'acceptable':
+                    check = f'    PASS ACEPTABLE: {result.acceptable[1]}'
                 else:
-                    check = f'    FAIL: {constraint.VERIFIED_ACCEPTABLE[1]}'
-                dummy.append([structure_name, constraint.type, constraint.ideal_dose, constraint.ideal_volume, constraint.acceptable_dose, constraint.acceptable_volume, check])
+                    check = f'    FAIL: {result.value}'
+                references = [reference_text(value) for value in (constraint.ideal_dose, constraint.ideal_volume, constraint.acceptable_dose, constraint.acceptable_volume)]
+                dummy.append([structure_name, constraint.type, *references, check])
         print(pd.DataFrame(dummy).to_string(header=False, index=False))
 
 def actualizar_dvh_con_mapeos(dvh: DVH, mapping: dict, volumes: dict) -> None:
@@ -295,9 +1039,10 @@ def actualizar_dvh_con_mapeos(dvh: DVH, mapping: dict, volumes: dict) -> None:
     norm = lambda s: s.strip().upper()
     mapping_norm = {norm(k): (v if v in (None, "", "-") else norm(v)) for k, v in mapping.items()}
 
-    new_structures = {}
+    key_map = {}    # {clave_vieja: (clave_final, label)}
+    used_keys = set()
 
-    for old_key, structure in dvh.structures.items():
+    for old_key in dvh.structures:
         ok = norm(old_key)
 
         # Nombre destino según mapping (o el mismo si no hay mapeo)
@@ -307,22 +1052,57 @@ def actualizar_dvh_con_mapeos(dvh: DVH, mapping: dict, volumes: dict) -> None:
         else:
             new_key = proposed_new
 
-        # Actualizar label mostrado en la clase Structure
-        structure.label_update(new_key)
-
         # Evitar colisiones si dos claves distintas mapean al mismo nombre
         final_key = new_key
-        if final_key in new_structures:
+        if final_key in used_keys:
             # crea un sufijo estable y visible
             suffix = 2
-            while f"{new_key}__{suffix}" in new_structures:
+            while f"{new_key}__{suffix}" in used_keys:
                 suffix += 1
             final_key = f"{new_key}__{suffix}"
 
-        new_structures[final_key] = structure
+        used_keys.add(final_key)
+        key_map[old_key] = (final_key, new_key)
 
     # Reemplazar el diccionario completo (cambia las keys efectivamente)
-    dvh.structures = new_structures
+    if isinstance(dvh.structures, (LazyStructures, PackedStructures)):
+        # Las estructuras todavia no armadas toman el label nuevo al cargarse
+        dvh.structures = dvh.structures.rekeyed(key_map)
+    else:
+        new_structures = {}
+        for old_key, (final_key, new_key) in key_map.items():
+            # Actualizar label mostrado en la clase Structure
+            structure = dvh.structures[old_key]
+            structure.label_update(new_key)
+            new_structures[final_key] = structure
+        dvh.structures = new_structures
+
+def get_temp_json_path(dvh):
+    # En la carpeta local del usuario: la carpeta del modulo, en el .exe de PyInstaller, es la de
+    # extraccion (_MEIPASS), que se borra al salir, y los mapeos no llegaban nunca al CLI
+    mapping_folder = os.path.join(local_data_dir(), "mapeos")
+    os.makedirs(mapping_folder, exist_ok=True)
+
+    filename = f"{dvh.plan_name}_{dvh.patient_id}.json"
+    return os.path.join(mapping_folder, filename)
+
+def _legacy_temp_json_path(dvh):
+    # Donde se guardaban antes (carpeta Temp junto al codigo), para no perder los de una instalacion desde el fuente
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "Temp", f"{dvh.plan_name}_{dvh.patient_id}.json")
+
+def save_mapping_and_volumes(dvh, name_mapping, volume_mapping):
+    path = get_temp_json_path(dvh)
+    data = {"name_mapping": name_mapping, "volume_mapping": volume_mapping}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+
+def load_mapping_and_volumes_if_exists(dvh):
+    for path in (get_temp_json_path(dvh), _legacy_temp_json_path(dvh)):
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["name_mapping"], data["volume_mapping"]
+    return None, None
 
 def match_strings_and_volume_entry(dvh_list_dummy, presc):
     def request_needed_volume(dvh_list_dummy, presc):
@@ -350,6 +1130,9 @@ def match_strings_and_volume_entry(dvh_list_dummy, presc):
         return list(set(filtered))
 
     def launch_gui(presc_names, dvh_names, needs_volume):
+        import tkinter as tk
+        from tkinter import ttk
+
         root = tk.Tk()
         root.title("Emparejar estructuras")
 
@@ -486,13 +1269,20 @@ def request_needed_volume(dvh, presc):
 
         return list(set(filtered))
 
-def dose_police_in_action(dvh_list_dummy: List, presc: Prescription, ignored_structures: List) -> None:
+def dose_police_in_action(dvh_list_dummy: List, presc: Prescription, ignored_structures: List) -> dict:
+    """
+    Evalua la prescripcion sobre el DVH y devuelve {estructura: [ConstraintResult, ...]}.
+    Ni la prescripcion ni sus constraints se modifican.
+    """
     # CHEQUEANDO CONSTRAINTS
     # print(list(presc.structures.keys()))
     # print(dvh_list_dummy[0].structures.keys())
-    for p_name in list(presc.structures.keys()):
-        for constraint in presc.structures[p_name]:
+    plans = presc.compiled()
+    results = {}
+    with stage('evaluacion', file=dvh_list_dummy[0].file_path):
+        for p_name in list(presc.structures.keys()):
             if p_name not in ignored_structures:
-                constraint.verify(dvh_list_dummy[0].structures[p_name])
+                results[p_name] = plans[p_name].verify(dvh_list_dummy[0].structures[p_name])
             else:
-                print(f"Estructura {p_name} no marcada para verificación de constraints.")
\ No newline at end of file
+                print(f"Estructura {p_name} no marcada para verificación de constraints.")
+    return results
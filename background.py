@@ -0,0 +1,103 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import customtkinter as ctk
+
+POLL_MS = 50         # cada cuanto el hilo de Tk revisa si hay callbacks pendientes
+SHOW_DELAY_MS = 200  # la ventana de espera solo aparece si la tarea tarda mas que esto
+
+
+class BackgroundTasks:
+    """
+    Pool de hilos para lo que tarda (leer del NAS, parsear el DVH, abrir el Excel, generar el PDF)
+    sin congelar la interfaz.
+
+    Tk no se puede usar desde otro hilo: los callbacks (on_done, on_error) se encolan
+    y el hilo principal los ejecuta en un after() periodico.
+    """
+    def __init__(self, master, max_workers: int = 4):
+        self.master = master
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dose_police')
+        self._callbacks = queue.Queue()
+        self._after_id = self.master.after(POLL_MS, self._poll)
+
+    def _poll(self):
+        while True:
+            try:
+                callback, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error en callback de tarea en segundo plano: {e}")
+        self._after_id = self.master.after(POLL_MS, self._poll)
+
+    def call_in_main(self, callback, *args) -> None:
+        """ Ejecuta callback(*args) en el hilo de Tk (se puede llamar desde cualquier hilo) """
+        self._callbacks.put((callback, args))
+
+    def when_done(self, future, on_done=None, on_error=None) -> None:
+        """
+        on_done(resultado) u on_error(excepcion) en el hilo de Tk cuando termine future.
+        """
+        def done(f):
+            if f.cancelled():
+                return
+            error = f.exception()
+            if error is None:
+                if on_done is not None:
+                    self.call_in_main(on_done, f.result())
+            elif on_error is not None:
+                self.call_in_main(on_error, error)
+            else:
+                print(f"Error en tarea en segundo plano: {error}")
+        future.add_done_callback(done)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, **kwargs):
+        future = self._executor.submit(fn, *args, **kwargs)
+        self.when_done(future, on_done, on_error)
+        return future
+
+    def wait(self, futures, message: str = "Cargando..."):
+        """
+        Espera futures sin bloquear la interfaz: corre el loop de Tk (como wait_window) y, si
+        tarda, muestra una ventana con una barra de progreso. Devuelve la lista de resultados o
+        levanta la excepcion de la primera tarea que fallo.
+        """
+        futures = list(futures)
+        finished = ctk.BooleanVar(master=self.master, value=False)
+
+        def check(_=None):
+            if all(f.done() for f in futures):
+                finished.set(True)
+
+        for future in futures:
+            self.when_done(future, check, check)
+
+        window = None
+        if not all(f.done() for f in futures):
+            def show():
+                nonlocal window
+                if finished.get():
+                    return
+                window = ctk.CTkToplevel(self.master)
+                window.title("Dose Police")
+                window.geometry("360x110")
+                window.protocol("WM_DELETE_WINDOW", lambda: None)   # no se puede cerrar mientras espera
+                ctk.CTkLabel(window, text=message).pack(pady=(20, 10))
+                bar = ctk.CTkProgressBar(window, mode="indeterminate", width=300)
+                bar.pack(pady=(0, 20))
+                bar.start()
+
+            show_id = self.master.after(SHOW_DELAY_MS, show)
+            self.master.wait_variable(finished)
+            self.master.after_cancel(show_id)
+            if window is not None:
+                window.destroy()
+
+        return [f.result() for f in futures]
+
+    def shutdown(self) -> None:
+        self.master.after_cancel(self._after_id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,193 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List
+
+import instrumentation
+from backend import DVH, ConstraintResult, DVHParseError, actualizar_dvh_con_mapeos, load_mapping_and_volumes_if_exists
+from dvhcache import DVHCache
+from instrumentation import stage
+
+
+class PlanEvaluation:
+    """
+    Resultado de evaluar un DVH contra una prescripcion.
+
+    results: {estructura: [ConstraintResult, ...]} con los mismos Constraint de la prescripcion.
+    missing_structures: estructuras de la prescripcion que no estan en el DVH (no se evaluan).
+    error: mensaje si el DVH no se pudo leer o evaluar (results queda vacio).
+    """
+    def __init__(self, file_path, prescription, patient_id=None, plan_name=None, date_and_time=None,
+                 results=None, missing_structures=None, error=None):
+        self.file_path = file_path
+        self.prescription = prescription
+        self.patient_id = patient_id
+        self.plan_name = plan_name
+        self.date_and_time = date_and_time
+        self.results = results if results is not None else {}
+        self.missing_structures = missing_structures if missing_structures is not None else []
+        self.error = error
+
+    @property
+    def passed(self) -> bool:   # se evaluaron todas las estructuras y ningun constraint quedo en 'fail'
+        if self.error is not None or self.missing_structures:
+            return False
+        return all(result.status != 'fail' for results in self.results.values() for result in results)
+
+
+# Prescripciones del proceso worker: se reciben una sola vez al crear el pool
+_worker_prescriptions = None
+_worker_cache = None
+
+def _init_worker(prescriptions, cache_dir, trace_memory=None):
+    """ trace_memory: None si el proceso principal no esta midiendo, si no si mide memoria """
+    global _worker_prescriptions, _worker_cache
+    _worker_prescriptions = prescriptions
+    _worker_cache = DVHCache(cache_dir) if cache_dir else None
+    if trace_memory is not None:
+        instrumentation.enable(memory=trace_memory)
+
+def _evaluate_file(file_path, mapping, ignored_structures, use_saved_mappings=False, prescriptions=None, cache=None):
+    """
+    Parsea un DVH y lo evalua contra todas las prescripciones.
+
+    Devuelve un dict liviano (sin objetos Constraint) para mandar de vuelta al proceso principal.
+    """
+    prescriptions = prescriptions if prescriptions is not None else _worker_prescriptions
+    cache = cache if cache is not None else _worker_cache
+    try:
+        dvh = DVH(file_path, lazy=True, cache=cache)
+    except DVHParseError as e:
+        return {'file_path': file_path, 'error': str(e)}
+
+    try:
+        volume_mapping = {}
+        if mapping is None and use_saved_mappings:
+            # Mapeo guardado por la GUI para este plan: {nombre_presc: nombre_dvh}, se invierte igual que en main()
+            name_mapping, saved_volumes = load_mapping_and_volumes_if_exists(dvh)
+            if name_mapping:
+                mapping = {v: k for k, v in name_mapping.items() if v and v != "-"}
+                volume_mapping = saved_volumes or {}
+        if mapping:
+            with stage('mapeo', file=file_path):
+                actualizar_dvh_con_mapeos(dvh, mapping, volume_mapping)
+
+        evaluations = []
+        with stage('evaluacion', file=file_path):
+            for presc in prescriptions:
+                missing = [name for name in presc.structures if name not in dvh.structures]
+                rows = []
+                for name, plan in presc.compiled().items():
+                    if name in ignored_structures or name in missing:
+                        continue
+                    for i, result in enumerate(plan.verify(dvh.structures[name])):
+                        rows.append((name, i, result.ideal, result.acceptable))
+                evaluations.append((missing, rows))
+    except Exception as e:
+        return {'file_path': file_path, 'error': f'{type(e).__name__}: {e}'}
+
+    return {'file_path': file_path, 'patient_id': dvh.patient_id, 'plan_name': dvh.plan_name,
+            'date_and_time': dvh.date_and_time, 'evaluations': evaluations}
+
+def _evaluate_file_in_worker(*args) -> dict:
+    """ _evaluate_file en un worker; si se esta midiendo, la traza vuelve en raw['trace'] """
+    tracer = instrumentation.tracer()
+    if tracer is None:
+        return _evaluate_file(*args)
+    with tracer.capture() as records:
+        raw = _evaluate_file(*args)
+    raw['trace'] = records
+    return raw
+
+def _plan_evaluations(raw: dict, prescriptions) -> List[PlanEvaluation]:
+    if 'error' in raw:
+        return [PlanEvaluation(raw['file_path'], presc, error=raw['error']) for presc in prescriptions]
+
+    plan_evaluations = []
+    for presc, (missing, rows) in zip(prescriptions, raw['evaluations']):
+        results = {}
+        for name, i, ideal, acceptable in rows:
+            results.setdefault(name, []).append(ConstraintResult(presc.structures[name][i], ideal, acceptable))
+        plan_evaluations.append(PlanEvaluation(raw['file_path'], presc, raw['patient_id'], raw['plan_name'],
+                                               raw['date_and_time'], results, missing))
+    return plan_evaluations
+
+class BatchEvaluator:
+    """
+    Evaluador reutilizable: mantiene las prescripciones y el pool de procesos entre llamadas,
+    util para procesos de larga vida (watcher) que evaluan tandas sucesivas de DVHs.
+    """
+    def __init__(self, prescriptions: List, max_workers: int = None, ignored_structures=(),
+                 use_saved_mappings: bool = False, cache_dir: str = None):
+        self.prescriptions = prescriptions
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.ignored_structures = set(ignored_structures)
+        self.use_saved_mappings = use_saved_mappings
+        self.cache_dir = cache_dir
+        self._executor = None
+        self._cache = None
+
+    def iter(self, dvh_paths: List[str], mappings: dict = None) -> Iterator[PlanEvaluation]:
+        """
+        Evalua cada DVH contra cada prescripcion y va devolviendo los PlanEvaluation a medida que
+        termina cada archivo (no en el orden de dvh_paths).
+        """
+        mappings = mappings or {}
+        if self.max_workers == 1 or (len(dvh_paths) <= 1 and self._executor is None):
+            if self._cache is None and self.cache_dir:
+                self._cache = DVHCache(self.cache_dir)
+            for file_path in dvh_paths:
+                raw = _evaluate_file(file_path, mappings.get(file_path), self.ignored_structures,
+                                     self.use_saved_mappings, self.prescriptions, self._cache)
+                yield from _plan_evaluations(raw, self.prescriptions)
+            return
+
+        tracer = instrumentation.tracer()
+        if self._executor is None:
+            trace_memory = tracer.memory if tracer is not None else None
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                                 initargs=(self.prescriptions, self.cache_dir, trace_memory))
+        futures = [self._executor.submit(_evaluate_file_in_worker, file_path, mappings.get(file_path),
+                                         self.ignored_structures, self.use_saved_mappings)
+                   for file_path in dvh_paths]
+        for future in as_completed(futures):
+            raw = future.result()
+            if tracer is not None:
+                tracer.extend(raw.pop('trace', None))
+            yield from _plan_evaluations(raw, self.prescriptions)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_batch(dvh_paths: List[str], prescriptions: List, max_workers: int = None, ignored_structures=(),
+               mappings: dict = None, use_saved_mappings: bool = False, cache_dir: str = None) -> Iterator[PlanEvaluation]:
+    """
+    Evalua cada DVH contra cada prescripcion y va devolviendo los PlanEvaluation a medida que
+    termina cada archivo (no en el orden de dvh_paths).
+
+    max_workers: procesos a usar (por defecto os.cpu_count()); con 1 se evalua en este proceso.
+    mappings: {ruta_dvh: {nombre_en_dvh: nombre_en_prescripcion}} opcional, por archivo.
+    use_saved_mappings: para los archivos sin mapeo en mappings, usa el que guardo la GUI para ese plan.
+    cache_dir: carpeta de un DVHCache para no volver a parsear DVHs ya vistos.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(dvh_paths), 1))
+    with BatchEvaluator(prescriptions, max_workers, ignored_structures, use_saved_mappings, cache_dir) as evaluator:
+        yield from evaluator.iter(dvh_paths, mappings)
+
+def evaluate_batch(dvh_paths: List[str], prescriptions: List, **kwargs) -> List[PlanEvaluation]:
+    """
+    Igual que iter_batch pero espera a todos y devuelve la lista en el orden de dvh_paths
+    (y de prescriptions dentro de cada archivo).
+    """
+    order = {file_path: i for i, file_path in enumerate(dvh_paths)}
+    presc_order = {id(presc): i for i, presc in enumerate(prescriptions)}
+    evaluations = list(iter_batch(dvh_paths, prescriptions, **kwargs))
+    evaluations.sort(key=lambda e: (order[e.file_path], presc_order[id(e.prescription)]))
+    return evaluations
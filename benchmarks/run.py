@@ -0,0 +1,263 @@
+"""
+Micro-benchmarks del camino caliente: parseo de DVH, interpolacion, evaluacion de constraints,
+carga del protocolo desde el xlsx y generacion del PDF.
+
+    python benchmarks/run.py                  # corre todo y compara con benchmarks/baseline.json
+    python benchmarks/run.py -k parse         # solo los casos cuyo nombre contiene 'parse'
+    python benchmarks/run.py --save           # guarda los resultados actuales como baseline
+
+Cada caso se repite hasta juntar --min-time segundos por muestra y se toma la mejor de
+--samples muestras. Como los segundos dependen de la maquina, cada caso se guarda y se compara
+como multiplo de una carga de calibracion fija (calibration_workload) medida en la misma
+corrida: asi la baseline sirve en otra maquina o en el runner de CI. Sale con codigo 1 si algun
+caso es mas lento que baseline * (1 + tolerancia).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+
+from backend import DVH, Prescription, dose_police_in_action
+from dvhcompare import compare_plans
+from dvhstats import dvh_statistics
+from protocolstore import ProtocolStore
+from report import result_segments, write_results_pdf
+from synthetic_dvh import make_structures, write_dvh_export, write_protocol_workbook
+
+BASELINE_VERSION = 2   # 2: casos relativos a la calibracion (la 1 guardaba segundos)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+EXAMPLES_DIR = os.path.join(REPO_DIR, 'ejemplos_dvh')
+SMALL_DVH = os.path.join(EXAMPLES_DIR, '12616855_VMI_DVH_1.txt')
+LARGE_DVH = os.path.join(EXAMPLES_DIR, '68216079_PrmVsVMAT_DVH_1.txt')
+PROTOCOL = 'PR+VS+LN 6000-20FX'
+SYNTHETIC_STRUCTURES = 40   # con bins de 1 cGy da una exportacion ~8 veces mas grande que LARGE_DVH
+QUERIES_PER_CALL = 1000
+
+# Protocolo de prueba para LARGE_DVH: (estructura o None si sigue la anterior, tipo, dosis/vol ideal, dosis/vol aceptable)
+PROTOCOL_TARGETS = [('PTV_PR', 6000, 300), ('PTV_VS', 5600, 280)]
+PROTOCOL_ROWS = [
+    ('RECTO', 'V(D)<V_%', 4000, 35, 4000, 40), (None, 'V(D)<V_%', 6000, 15, 6000, 20),
+    (None, 'V(D)<V_cc', 6500, 1, None, None), (None, 'Dmax', 6000, None, 6200, None),
+    ('VEJIGA', 'V(D)<V_%', 4000, 35, 4000, 50), (None, 'V(D)<V_%', 6000, 5, None, None),
+    (None, 'Dmedia', 1000, None, 1200, None),
+    ('BULBO_PENEANO', 'Dmedia', 500, None, 700, None), (None, 'D(V_%)<D', 90, 500, 90, 800),
+    ('FEMUR_D', 'D(V_cc)<D', 10, 2000, 10, 3000), (None, 'Dmax', 4000, None, None, None),
+    ('FEMUR_I', 'D(V_%)<D', 5, 2500, None, None),
+    ('INTESTINO', 'V(D)<V_cc', 4500, 10, 4500, 20),
+    ('SIGMA', 'Dmax', 2000, None, 2500, None), (None, 'V(D)<V_cc', 1000, 5, 1000, 8),
+    ('PTV_PR', 'V(D)>V_%', 5700, 95, 5600, 95), (None, 'D(V_%)<D', 2, 6300, 2, 6420),
+    (None, 'V(D)>V_cc', 5700, 45, None, None),
+    ('CAUDA_EQUINA', 'Dmax', 4500, None, None, None),
+]
+
+
+class Context:
+    """ Archivos de entrada y objetos ya armados, compartidos por todos los casos """
+    def __init__(self, work_dir: str):
+        self.work_dir = work_dir
+        self.workbook = os.path.join(work_dir, 'protocolos.xlsx')
+        write_protocol_workbook(self.workbook, {PROTOCOL: (PROTOCOL_TARGETS, PROTOCOL_ROWS)})
+        self.synthetic_dvh = os.path.join(work_dir, 'synthetic.txt')
+        write_dvh_export(self.synthetic_dvh, make_structures(SYNTHETIC_STRUCTURES), bin_width=1.0)
+
+        self.dvh = DVH(LARGE_DVH)
+        self.presc = Prescription(self.workbook, PROTOCOL)
+        self.ignored = [name for name in self.presc.structures if name not in self.dvh.structures]
+        self.store = ProtocolStore(self.workbook, os.path.join(work_dir, 'store.json'))
+        self.store.refresh()
+
+
+# Cada caso recibe el Context y devuelve (funcion sin argumentos, operaciones por llamada)
+
+def case_parse_small(ctx):
+    return (lambda: DVH(SMALL_DVH)), 1
+
+def case_parse_large(ctx):
+    return (lambda: DVH(LARGE_DVH)), 1
+
+def case_parse_synthetic(ctx):
+    return (lambda: DVH(ctx.synthetic_dvh)), 1
+
+def case_volume_function(ctx):
+    structure = ctx.dvh.structures['RECTO']
+    doses = np.linspace(0, structure.dose_axis[-1], QUERIES_PER_CALL).tolist()
+    def run():
+        for dose in doses:
+            structure.volume_function(dose)
+    return run, QUERIES_PER_CALL
+
+def case_dose_function(ctx):
+    structure = ctx.dvh.structures['RECTO']
+    volumes = np.linspace(0, structure.volume, QUERIES_PER_CALL).tolist()
+    def run():
+        for volume in volumes:
+            structure.dose_function(volume)
+    return run, QUERIES_PER_CALL
+
+def case_constraint_verify(ctx):
+    pairs = [(constraint, ctx.dvh.structures[name]) for name, constraints in ctx.presc.structures.items()
+             if name not in ctx.ignored for constraint in constraints]
+    def run():
+        for constraint, structure in pairs:
+            constraint.verify(structure)
+    return run, 1
+
+def case_dose_police_in_action(ctx):
+    return (lambda: dose_police_in_action([ctx.dvh], ctx.presc, ctx.ignored)), 1
+
+def case_dvh_statistics(ctx):
+    return (lambda: dvh_statistics(ctx.dvh, ctx.presc)), 1
+
+def case_compare_plans(ctx):
+    other = DVH(LARGE_DVH)
+    return (lambda: compare_plans([ctx.dvh, other])), 1
+
+def case_simplify_dvh(ctx):
+    return (lambda: ctx.dvh.copy().simplify()), 1
+
+def case_prescription_xlsx(ctx):
+    return (lambda: Prescription(ctx.workbook, PROTOCOL)), 1
+
+def case_prescription_store(ctx):
+    return (lambda: Prescription(ctx.workbook, PROTOCOL, store=ctx.store)), 1
+
+def case_results_pdf(ctx):
+    results = dose_police_in_action([ctx.dvh], ctx.presc, ctx.ignored)
+    segments = result_segments(ctx.presc, results, ctx.ignored)
+    pdf_path = os.path.join(ctx.work_dir, 'resultados.pdf')
+    return (lambda: write_results_pdf(pdf_path, ctx.dvh.plan_name, ctx.dvh.patient_id, segments)), 1
+
+
+CASES = {
+    'parse_small': case_parse_small,
+    'parse_large': case_parse_large,
+    'parse_synthetic': case_parse_synthetic,
+    'volume_function': case_volume_function,
+    'dose_function': case_dose_function,
+    'constraint_verify': case_constraint_verify,
+    'dose_police_in_action': case_dose_police_in_action,
+    'dvh_statistics': case_dvh_statistics,
+    'compare_plans': case_compare_plans,
+    'simplify_dvh': case_simplify_dvh,
+    'prescription_xlsx': case_prescription_xlsx,
+    'prescription_store': case_prescription_store,
+    'results_pdf': case_results_pdf,
+}
+
+
+def calibration_workload() -> None:
+    """
+    Trabajo fijo que no usa codigo del repo, mitad Python puro y mitad numpy como los casos:
+    su tiempo es la unidad de la baseline.
+    """
+    total = 0
+    for i in range(20000):
+        total += i * i % 7
+    values = np.arange(200000, dtype=np.float64)
+    np.interp(values * 0.5, values, values[::-1]).sum()
+    np.sort(values[::-1] * 1.5)
+
+
+def measure(fn, min_time: float, samples: int) -> float:
+    """ Mejor tiempo por llamada (s) de samples muestras de al menos min_time segundos """
+    fn()   # calentamiento
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    best = elapsed / number
+    for _ in range(samples - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def machine_id() -> str:
+    return f'{platform.node()} {platform.machine()} {platform.python_implementation()} {platform.python_version()}'
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f'{seconds:.2f} s'
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.2f} ms'
+    return f'{seconds * 1e6:.2f} us'
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de Dose Police.")
+    parser.add_argument('-k', dest='pattern', default='', help="Solo los casos cuyo nombre contiene este texto")
+    parser.add_argument('--save', action='store_true', help="Guardar los resultados como baseline")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Archivo de baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Cuanto mas lento que la baseline se acepta (0.25 = 25%%)")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Segundos minimos por muestra")
+    parser.add_argument('--samples', type=int, default=5, help="Muestras por caso (se toma la mejor)")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('version') != BASELINE_VERSION:
+            print("Aviso: baseline en un formato viejo, se ignora (regenerarla con --save)")
+            baseline = {}
+
+    names = [name for name in CASES if args.pattern in name]
+    results = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        ctx = Context(work_dir)
+        calibration = measure(calibration_workload, args.min_time, args.samples)
+        print(f"calibracion: {format_time(calibration)}\n")
+        print(f"{'caso':<24}{'por operacion':>16}{'x calibracion':>16}{'vs baseline':>14}")
+        for name in names:
+            fn, ops = CASES[name](ctx)
+            per_op = measure(fn, args.min_time, args.samples) / ops
+            relative = per_op / calibration
+            results[name] = relative
+
+            reference = baseline.get('cases', {}).get(name)
+            comparison = ''
+            if reference:
+                ratio = relative / reference
+                comparison = f'{ratio:.2f}x'
+                if ratio > 1 + args.tolerance:
+                    comparison += ' LENTO'
+                    regressions.append(name)
+            print(f'{name:<24}{format_time(per_op):>16}{relative:>16.4g}{comparison:>14}')
+
+    if args.save:
+        cases = dict(baseline.get('cases', {}))
+        cases.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'version': BASELINE_VERSION, 'machine': machine_id(), 'calibration_s': calibration,
+                       'cases': cases}, f, indent=2)
+            f.write('\n')
+        print(f"Baseline guardada en {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\nMas lentos que la baseline (+{args.tolerance:.0%}): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Generador de exportaciones de DVH sinteticas (formato de texto de Monaco) y de un Excel de
+protocolos que les corresponde, para probar parseo, memoria y throughput del batch con archivos
+mucho mas grandes que los de ejemplos_dvh/ y sin datos de pacientes.
+
+    python benchmarks/synthetic_dvh.py salida/ -n 20 --estructuras 40 --bin 0.1 --excel salida/protocolos.xlsx
+
+Las curvas acumuladas son monotonas (volumen total en 0 cGy, 0 cc en la dosis maxima de cada
+estructura): targets con caida abrupta cerca de la prescripcion y organos con mezcla de caidas
+suaves. Con la misma --seed se generan siempre los mismos archivos.
+"""
+import argparse
+import math
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+
+DVH_ENCODING = 'latin-1'
+LABEL_SEPARATOR = ' ' * 20   # como en las exportaciones de Monaco
+HEADER_COLUMNS = 'Structure Name |                     Dose |                     Volume'
+
+TARGET_NAMES = ['PTV_PR', 'PTV_VS', 'PTV_LN', 'CTV', 'GTV']
+OAR_NAMES = ['RECTO', 'VEJIGA', 'BULBO_PENEANO', 'FEMUR_D', 'FEMUR_I', 'INTESTINO', 'SIGMA', 'CAUDA_EQUINA',
+             'MEDULA', 'CORAZON', 'PULMON_D', 'PULMON_I', 'ESOFAGO', 'MAMA_D', 'TRONCO', 'QUIASMA']
+BODY_NAME = 'Paciente(Unsp.Tiss.)'
+
+
+class SyntheticStructure:
+    """
+    Estructura sintetica: la curva acumulada es volume * (f(d) - f(max_dose)) / (f(0) - f(max_dose)),
+    con f una suma de logisticas decrecientes (centro, ancho, peso) en components.
+    """
+    def __init__(self, name: str, kind: str, volume: float, max_dose: float, components: list,
+                 prescribed_dose: float = None):
+        self.name = name
+        self.kind = kind   # 'target', 'oar' o 'body'
+        self.prescribed_dose = prescribed_dose   # solo targets
+        self.volume = volume
+        self.max_dose = max_dose
+        self.components = components
+
+    def _profile(self, dose):
+        dose = np.asarray(dose, dtype=np.float64)
+        total = np.zeros_like(dose)
+        for center, width, weight in self.components:
+            total += weight / (1.0 + np.exp(np.clip((dose - center) / width, -60, 60)))
+        return total
+
+    def cumulative_volume(self, dose):
+        """ Volumen (cm3) que recibe al menos cada dosis (cGy) """
+        dose = np.asarray(dose, dtype=np.float64)
+        top, bottom = self._profile(0.0), self._profile(self.max_dose)
+        volume = self.volume * (self._profile(dose) - bottom) / (top - bottom)
+        volume = np.clip(volume, 0.0, self.volume)
+        volume[dose >= self.max_dose] = 0.0
+        return volume
+
+
+def make_structures(n_structures: int = 12, prescription_dose: float = 6000.0, seed: int = 0) -> list:
+    """
+    Lista de n_structures estructuras: un body, algunos targets y el resto organos de riesgo
+    (con los nombres de OAR_NAMES y despues OAR_<n>).
+    """
+    rng = np.random.default_rng(seed)
+    n_targets = max(1, min(len(TARGET_NAMES), n_structures // 6))
+    structures = [SyntheticStructure(BODY_NAME, 'body', float(rng.uniform(8000, 20000)), prescription_dose * 1.08,
+                                     [(prescription_dose * 0.05, prescription_dose * 0.05, 0.7),
+                                      (prescription_dose * 0.95, prescription_dose * 0.02, 0.3)])]
+
+    for i in range(n_targets):
+        dose = prescription_dose * (1.0 - 0.07 * i)
+        structures.append(SyntheticStructure(TARGET_NAMES[i], 'target', float(rng.uniform(50, 900)),
+                                             dose * float(rng.uniform(1.04, 1.08)),
+                                             [(dose * float(rng.uniform(0.97, 0.99)), dose * float(rng.uniform(0.008, 0.015)), 1.0)],
+                                             prescribed_dose=dose))
+
+    for i in range(n_structures - len(structures)):
+        name = OAR_NAMES[i] if i < len(OAR_NAMES) else f'OAR_{i - len(OAR_NAMES) + 1}'
+        components = [(prescription_dose * float(rng.uniform(0.05, 0.9)), prescription_dose * float(rng.uniform(0.02, 0.15)),
+                       float(rng.uniform(0.2, 1.0))) for _ in range(int(rng.integers(1, 4)))]
+        structures.append(SyntheticStructure(name, 'oar', float(rng.uniform(2, 1500)),
+                                             prescription_dose * float(rng.uniform(0.6, 1.05)), components))
+    return structures
+
+
+def _dose_decimals(bin_width: float) -> int:
+    # Decimales para imprimir los centros de bin (bin_width/2) sin perder precision
+    exponent = Decimal(repr(bin_width / 2)).normalize().as_tuple().exponent
+    return max(1, -exponent)
+
+
+def structure_rows(structure: SyntheticStructure, bin_width: float, plan_max_dose: float, compress: bool = True):
+    """
+    (dosis, volumen) de una estructura como los exporta Monaco: fila en 0 cGy con el volumen
+    total, centros de bin hasta la dosis maxima del plan y una ultima fila en esa dosis con 0 cc.
+    Con compress se omiten las filas interiores de las mesetas (como hace Monaco).
+    """
+    n_bins = int(round(plan_max_dose / bin_width))
+    centers = (np.arange(n_bins) + 0.5) * bin_width
+    dose = np.concatenate([[0.0], centers, [plan_max_dose]])
+    volume = np.round(structure.cumulative_volume(dose), 3)
+    volume[0] = round(structure.volume, 3)
+    volume[-1] = 0.0
+
+    if compress:
+        keep = np.ones(len(volume), dtype=bool)
+        same_as_previous = np.zeros(len(volume), dtype=bool)
+        same_as_previous[1:] = volume[1:] == volume[:-1]
+        same_as_next = np.zeros(len(volume), dtype=bool)
+        same_as_next[:-1] = volume[:-1] == volume[1:]
+        keep[1:-2] = ~(same_as_previous[1:-2] & same_as_next[1:-2])
+        dose, volume = dose[keep], volume[keep]
+    return dose, volume
+
+
+def write_dvh_export(file_path: str, structures: list, bin_width: float = 1.0, patient_id: str = '00000001',
+                     plan_name: str = 'SINTETICO', date_and_time: datetime = None, compress: bool = True) -> int:
+    """
+    Escribe la exportacion (latin-1, CRLF, igual que Monaco). Devuelve la cantidad de filas.
+    """
+    date_and_time = date_and_time or datetime(2025, 1, 1, 12, 0, 0)
+    plan_max_dose = math.ceil(max(s.max_dose for s in structures) / bin_width) * bin_width
+    decimals = _dose_decimals(bin_width)
+
+    lines = [f'Patient ID: 1~{patient_id} | Plan Name: {plan_name} | Resolution: 0.10(cm) | '
+             f'Bin Width: {bin_width}(cGy) | Dose Units: cGy | Volume Units: cm³',
+             '', HEADER_COLUMNS]
+    n_rows = 0
+    for structure in structures:
+        dose, volume = structure_rows(structure, bin_width, plan_max_dose, compress)
+        prefix = structure.name + LABEL_SEPARATOR
+        lines.extend(f'{prefix}{d:.{decimals}f}{LABEL_SEPARATOR}{v:.3f}' for d, v in zip(dose.tolist(), volume.tolist()))
+        n_rows += len(dose)
+    lines.extend(['', '', date_and_time.strftime('%Y-%m-%d-%a  %H:%M:%S')])
+
+    with open(file_path, 'wb') as file:
+        file.write('\r\n'.join(lines).encode(DVH_ENCODING))
+    return n_rows
+
+
+def protocol_rows(structures: list, prescription_dose: float, seed: int = 0) -> list:
+    """
+    Constraints para las estructuras sinteticas, en el formato de las filas del Excel:
+    (estructura o None si sigue la anterior, tipo, dosis ideal, vol ideal, dosis aceptable, vol aceptable).
+    Los limites salen de la propia curva, asi que unos pasan y otros no.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for structure in structures:
+        if structure.kind == 'body':
+            continue
+        name = structure.name.upper()
+        if structure.kind == 'target':
+            dose = int(round(structure.prescribed_dose * 0.95))
+            rows.append((name, 'V(D)>V_%', dose, 95, dose, 90))
+            rows.append((None, 'D(V_%)<D', 2, int(round(structure.max_dose * 0.99)), 2, int(round(structure.max_dose * 1.02))))
+            continue
+
+        dose = int(round(structure.max_dose * float(rng.uniform(0.3, 0.7)), -1))
+        percent = 100.0 * float(structure.cumulative_volume([dose])[0]) / structure.volume
+        ideal = max(1, int(round(percent * float(rng.uniform(0.8, 1.2)))))
+        rows.append((name, 'V(D)<V_%', dose, ideal, dose, ideal + 10))
+        rows.append((None, 'Dmax', int(round(structure.max_dose * float(rng.uniform(0.95, 1.05)), -1)), None, None, None))
+        if rng.random() < 0.5:
+            rows.append((None, 'Dmedia', int(round(prescription_dose * float(rng.uniform(0.2, 0.5)), -1)), None,
+                         int(round(prescription_dose * 0.6, -1)), None))
+        else:
+            cc = max(1, int(structure.volume * 0.1))
+            rows.append((None, 'D(V_cc)<D', cc, int(round(structure.max_dose * 0.8, -1)), None, None))
+    return rows
+
+
+def write_protocol_workbook(file_path: str, protocols: dict) -> None:
+    """
+    Excel con el formato del de protocolos: tres hojas iniciales (INDICE, PLANTILLA, NOTAS) y una
+    hoja por protocolo con el nombre en B2, la tabla de targets desde A4 y la de constraints abajo.
+
+    protocols: {nombre: (targets [(nombre, dosis total, dosis diaria)], filas de protocol_rows)}
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    workbook.active.title = 'INDICE'
+    for sheet_name in ('PLANTILLA', 'NOTAS'):
+        workbook.create_sheet(sheet_name)
+
+    for protocol_name, (targets, rows) in protocols.items():
+        sheet = workbook.create_sheet(protocol_name.upper())
+        sheet['B2'] = protocol_name
+        for column, value in enumerate(['Target', 'Dosis total', 'Dosis diaria'], start=1):
+            sheet.cell(4, column, value)
+        for row, target in enumerate(targets, start=5):
+            for column, value in enumerate(target, start=1):
+                sheet.cell(row, column, value)
+        header_row = 5 + len(targets) + 1   # una fila vacia separa las dos tablas
+        for column, value in enumerate(['#', 'Estructura', 'Tipo', 'Dosis ideal', 'Vol ideal', 'Dosis acept', 'Vol acept'], start=1):
+            sheet.cell(header_row, column, value)
+        for row, values in enumerate(rows, start=header_row + 1):
+            for column, value in enumerate(values, start=2):
+                if value is not None:
+                    sheet.cell(row, column, value)
+    workbook.save(file_path)
+
+
+def protocol_targets(structures: list, fractions: int) -> list:
+    """ Tabla de targets del Excel: (nombre, dosis total, dosis diaria) """
+    return [(s.name.upper(), int(round(s.prescribed_dose)), int(round(s.prescribed_dose / fractions)))
+            for s in structures if s.kind == 'target']
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Genera DVHs sinteticos en formato Monaco y un Excel de protocolos.")
+    parser.add_argument('carpeta', help="Carpeta de salida")
+    parser.add_argument('-n', '--archivos', type=int, default=1, help="Cantidad de exportaciones")
+    parser.add_argument('--estructuras', type=int, default=12, help="Estructuras por exportacion")
+    parser.add_argument('--bin', type=float, default=1.0, help="Ancho de bin en cGy (desde 0.1)")
+    parser.add_argument('--prescripcion', type=float, default=6000.0, help="Dosis de prescripcion en cGy")
+    parser.add_argument('--dosis-max', type=float, default=None,
+                        help="Dosis maxima del plan en cGy (por defecto la que salga de las curvas, ~1.08 x prescripcion)")
+    parser.add_argument('--fracciones', type=int, default=20, help="Fracciones (para la tabla de targets del Excel)")
+    parser.add_argument('--sin-comprimir', action='store_true', help="Escribir todos los bins (Monaco omite las mesetas)")
+    parser.add_argument('--excel', help="Si se indica, escribe un Excel de protocolos que corresponde a los DVHs")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.bin < 0.1:
+        parser.error("--bin tiene que ser de al menos 0.1 cGy")
+    os.makedirs(args.carpeta, exist_ok=True)
+
+    protocol_name = f'SINTETICO {int(args.prescripcion)}-{args.fracciones}FX'
+    protocols = {}
+    for i in range(args.archivos):
+        structures = make_structures(args.estructuras, args.prescripcion, seed=args.seed + i)
+        if args.dosis_max is not None:
+            for structure in structures:
+                structure.max_dose = min(structure.max_dose, args.dosis_max)
+        file_path = os.path.join(args.carpeta, f'{10000000 + i}_SINTETICO_DVH_1.txt')
+        n_rows = write_dvh_export(file_path, structures, args.bin, patient_id=str(10000000 + i),
+                                  plan_name=f'SINTETICO{i + 1}', compress=not args.sin_comprimir)
+        print(f'{file_path}: {len(structures)} estructuras, {n_rows} filas, {os.path.getsize(file_path) / 1e6:.1f} MB')
+        if i == 0:
+            protocols[protocol_name] = (protocol_targets(structures, args.fracciones),
+                                        protocol_rows(structures, args.prescripcion, seed=args.seed))
+
+    if args.excel:
+        write_protocol_workbook(args.excel, protocols)
+        print(f'{args.excel}: protocolo "{protocol_name}"')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Modo batch sin interfaz grafica: evalua todos los DVH (*.txt) de una carpeta contra uno o
+mas protocolos del Excel de constraints y escribe un resumen CSV o JSON lines.
+
+    python cli.py "DVH Output" -p "PR+VS+LN 6000-20FX" -o resumen.csv --pdf reportes/
+
+Con --watch queda corriendo y evalua cada DVH nuevo que aparece en la carpeta. Con --traza
+(o DOSE_POLICE_TRACE) mide cada etapa y al final escribe la traza e imprime un resumen.
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+import warnings
+
+import instrumentation
+from backend import Prescription
+from batch import iter_batch
+from instrumentation import stage
+from planmatrix import ConstraintMatrix
+from protocolstore import ProtocolStore
+from report import SummaryWriter, result_segments, write_matrix_pdf, write_results_pdf
+from settings import constraint_excel_file_path
+
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+
+def pdf_file_name(evaluation, with_protocol: bool) -> str:
+    name = f"Resultados_{evaluation.patient_id}_{evaluation.plan_name}"
+    if with_protocol:
+        name += f"_{evaluation.prescription.presc_template_name}"
+    return re.sub(r'[<>:"/\\|?*]', '_', name) + ".pdf"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Dose Police en modo batch (sin interfaz grafica).")
+    parser.add_argument("carpeta", help="Carpeta con los DVH exportados por Monaco (*.txt)")
+    parser.add_argument("-p", "--protocolo", action="append", required=True,
+                        help="Nombre de la hoja del protocolo en el Excel (se puede repetir)")
+    parser.add_argument("--excel", default=constraint_excel_file_path, help="Excel de protocolos de constraints")
+    parser.add_argument("-o", "--salida", default="resumen_dose_police.jsonl",
+                        help="Resumen de resultados: .csv (una fila por constraint) o .jsonl (una linea por plan)")
+    parser.add_argument("--pdf", metavar="CARPETA", help="Si se indica, guarda un PDF de resultados por plan en esta carpeta")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Procesos a usar (por defecto todos los nucleos)")
+    parser.add_argument("--ignorar", nargs="*", default=[], help="Estructuras de la prescripcion a no evaluar")
+    parser.add_argument("--sin-mapeos", action="store_true", help="No usar los mapeos de estructuras guardados por la GUI")
+    parser.add_argument("--cache-dir", help="Carpeta de cache de DVHs parseados")
+    parser.add_argument("--watch", action="store_true",
+                        help="Queda vigilando la carpeta y evalua solo los DVH nuevos o modificados (agrega al resumen)")
+    parser.add_argument("--intervalo", type=float, default=5.0, help="Con --watch, segundos entre escaneos")
+    parser.add_argument("--solo-nuevos", action="store_true",
+                        help="Con --watch, no evaluar los DVH que ya estaban en la carpeta al arrancar")
+    parser.add_argument("--matriz", metavar="ARCHIVO",
+                        help="Matriz de constraints x planes de la carpeta (.csv o .pdf), una por protocolo")
+    parser.add_argument("--traza", metavar="ARCHIVO",
+                        help="Medir tiempo y memoria de cada etapa y guardarlos en ARCHIVO (.json o .csv)")
+    return parser
+
+
+def report_evaluation(evaluation, args, n_prescriptions: int) -> None:
+    if evaluation.error is not None:
+        print(f"ERROR  {evaluation.file_path}: {evaluation.error}")
+        return
+    print(f"{'PASA ' if evaluation.passed else 'FALLA'}  {evaluation.plan_name} ({evaluation.patient_id}) "
+          f"- {evaluation.prescription.presc_template_name}")
+
+    if args.pdf:
+        ignored = [name.upper() for name in args.ignorar]
+        segments = result_segments(evaluation.prescription, evaluation.results, ignored)
+        pdf_path = os.path.join(args.pdf, pdf_file_name(evaluation, n_prescriptions > 1))
+        with stage('reporte', file=evaluation.file_path):
+            write_results_pdf(pdf_path, evaluation.plan_name, evaluation.patient_id, segments)
+
+
+def write_matrices(file_path: str, evaluations, prescriptions) -> None:
+    """ Una matriz por protocolo con los planes en el orden de los archivos; con varios protocolos se agrega el nombre """
+    root, extension = os.path.splitext(file_path)
+    for prescription in prescriptions:
+        plans = [evaluation for evaluation in evaluations
+                 if evaluation.error is None and evaluation.prescription is prescription]
+        if not plans:
+            continue
+        path = file_path
+        if len(prescriptions) > 1:
+            path = root + "_" + re.sub(r'[<>:"/\\|?*]', '_', prescription.presc_template_name) + extension
+        matrix = ConstraintMatrix(prescription, sorted(plans, key=lambda evaluation: evaluation.file_path))
+        with stage('reporte', file=path):
+            if extension.lower() == ".pdf":
+                write_matrix_pdf(path, matrix)
+            else:
+                matrix.write_csv(path)
+        print(f"Matriz de {len(plans)} planes ({prescription.presc_template_name}): {path}")
+
+
+def write_trace() -> None:
+    tracer = instrumentation.tracer()
+    if tracer is None or not tracer.path:
+        return
+    path = tracer.write()
+    print(f"\nTraza por etapa ({path}):\n{tracer.format_summary()}")
+
+
+def watch(args) -> int:
+    from watcher import DVHWatcher
+
+    watcher = DVHWatcher(args.carpeta, args.excel, args.protocolo, args.salida, interval=args.intervalo,
+                         max_workers=args.workers, ignored_structures=[name.upper() for name in args.ignorar],
+                         use_saved_mappings=not args.sin_mapeos, cache_dir=args.cache_dir,
+                         skip_existing=args.solo_nuevos)
+    print(f"Vigilando '{args.carpeta}' cada {args.intervalo:g} s (Ctrl+C para salir). Resumen: {args.salida}")
+    try:
+        watcher.run(on_evaluation=lambda evaluation: report_evaluation(evaluation, args, len(args.protocolo)))
+    except KeyboardInterrupt:
+        print("Fin de la vigilancia.")
+    finally:
+        write_trace()
+    return 0
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.traza:
+        instrumentation.enable(args.traza)
+    else:
+        instrumentation.enable_from_env()
+    if args.pdf:
+        os.makedirs(args.pdf, exist_ok=True)
+    if args.watch:
+        return watch(args)
+
+    dvh_paths = sorted(glob.glob(os.path.join(args.carpeta, "*.txt")))
+    if not dvh_paths:
+        print(f"No hay archivos .txt en '{args.carpeta}'.")
+        return 1
+
+    store = ProtocolStore(args.excel)
+    prescriptions = [Prescription(args.excel, name, store=store) for name in args.protocolo]
+
+    start = time.perf_counter()
+    n_plans = n_failed = n_errors = 0
+    ignored = [name.upper() for name in args.ignorar]
+    evaluations = []
+    with SummaryWriter(args.salida) as writer:
+        for evaluation in iter_batch(dvh_paths, prescriptions, max_workers=args.workers, ignored_structures=ignored,
+                                     use_saved_mappings=not args.sin_mapeos, cache_dir=args.cache_dir):
+            writer.write(evaluation)
+            if args.matriz:
+                evaluations.append(evaluation)
+            report_evaluation(evaluation, args, len(prescriptions))
+            n_plans += 1
+            if evaluation.error is not None:
+                n_errors += 1
+            elif not evaluation.passed:
+                n_failed += 1
+
+    print(f"\n{n_plans} evaluaciones ({len(dvh_paths)} DVH) en {time.perf_counter() - start:.1f} s: "
+          f"{n_failed} con constraints que no pasan, {n_errors} con error. Resumen: {args.salida}")
+    if args.matriz:
+        write_matrices(args.matriz, evaluations, prescriptions)
+    write_trace()
+    return 1 if n_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
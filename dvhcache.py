@@ -0,0 +1,161 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+from settings import local_data_dir
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+CACHE_DIR_ENV = 'DOSE_POLICE_CACHE_DIR'
+
+
+def default_cache_dir() -> str:
+    """
+    Carpeta local para el cache: la variable DOSE_POLICE_CACHE_DIR si esta definida,
+    si no %LOCALAPPDATA%/DosePolice/dvh_cache (o ~/.cache/DosePolice/dvh_cache).
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    return os.path.join(local_data_dir(), 'dvh_cache')
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class DVHCache:
+    """
+    Cache binario (.npz) de DVHs ya parseados.
+
+    Cada DVH se guarda una vez por contenido en <hash_contenido>.npz. Un archivo alias
+    <hash(ruta, tamaño, mtime)>.key apunta a ese hash, asi que reabrir la misma exportacion
+    no necesita leer el .txt. Al superar max_bytes se borran los .npz usados hace mas tiempo.
+    """
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _stat_key(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        key = f'{CACHE_VERSION}|{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}'
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _data_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f'{digest}.npz')
+
+    def _alias_path(self, stat_key: str) -> str:
+        return os.path.join(self.cache_dir, f'{stat_key}.key')
+
+    @staticmethod
+    def digest(raw: bytes) -> str:
+        """ Clave por contenido del .txt, para get y put (se calcula una sola vez por lectura) """
+        return f'{CACHE_VERSION}-{content_hash(raw)}'
+
+    def get(self, file_path: str, digest: str = None):
+        """
+        Devuelve el DVH cacheado como dict (ver put) o None.
+
+        Sin digest solo se busca por ruta/tamaño/mtime; con digest (DVHCache.digest del
+        contenido) tambien por contenido (misma exportacion copiada o re-guardada).
+        """
+        stat_key = self._stat_key(file_path)
+        from_content = digest is not None
+        if not from_content:
+            try:
+                with open(self._alias_path(stat_key), 'r') as file:
+                    digest = file.read().strip()
+            except OSError:
+                return None
+
+        data_path = self._data_path(digest)
+        try:
+            with np.load(data_path, allow_pickle=False) as data:
+                entry = {
+                    'patient_id': str(data['patient_id']),
+                    'plan_name': str(data['plan_name']),
+                    'date_and_time': str(data['date_and_time']),
+                    'names': data['names'].tolist(),
+                    'offsets': data['offsets'],
+                    'dose': data['dose'],
+                    'volume': data['volume'],
+                }
+        except (OSError, KeyError, ValueError):
+            return None
+
+        os.utime(data_path)  # marca de uso para el desalojo LRU
+        if from_content:
+            self._write_alias(stat_key, digest)
+        return entry
+
+    def put(self, file_path: str, digest: str, entry: dict) -> None:
+        """
+        Guarda un DVH parseado con la clave digest (DVHCache.digest del .txt). entry tiene
+        patient_id, plan_name, date_and_time, names (labels por estructura), offsets
+        (len(names)+1) y los arrays dose y volume.
+        """
+        def write(file):
+            np.savez(file,
+                     patient_id=entry['patient_id'],
+                     plan_name=entry['plan_name'],
+                     date_and_time=entry['date_and_time'],
+                     names=np.array(entry['names'], dtype=str),
+                     offsets=np.asarray(entry['offsets'], dtype=np.int64),
+                     dose=entry['dose'],
+                     volume=entry['volume'])
+        self._replace(self._data_path(digest), write, 'wb')
+        self._write_alias(self._stat_key(file_path), digest)
+        self._evict()
+
+    def _write_alias(self, stat_key: str, digest: str) -> None:
+        self._replace(self._alias_path(stat_key), lambda file: file.write(digest), 'w')
+
+    def _replace(self, path: str, write, mode: str) -> None:
+        # Temporal con nombre unico (varios hilos o procesos pueden guardar la misma entrada a la vez)
+        # y os.replace: nadie lee nunca un archivo a medio escribir
+        with tempfile.NamedTemporaryFile(mode, dir=self.cache_dir, suffix='.tmp', delete=False) as file:
+            write(file)
+        try:
+            os.replace(file.name, path)
+        except OSError:
+            os.remove(file.name)
+            raise
+
+    def _evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+
+        # Alias que apuntan a datos ya borrados
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.key'):
+                continue
+            alias_path = os.path.join(self.cache_dir, name)
+            try:
+                with open(alias_path, 'r') as file:
+                    digest = file.read().strip()
+                if not os.path.exists(self._data_path(digest)):
+                    os.remove(alias_path)
+            except OSError:
+                continue
+
+    def clear(self) -> None:
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(('.npz', '.key')):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,206 @@
+"""
+Comparacion de planes: lleva las estructuras que tienen en comun dos o mas DVH a una misma
+grilla de dosis (una sola interpolacion vectorizada para todas) y calcula, contra el primer
+plan, la diferencia de las curvas, el area entre curvas y la diferencia en el valor de cada
+constraint de un protocolo.
+
+    python dvhcompare.py plan_a.txt plan_b.txt -p "PR+VS+LN 6000-20FX" -o comparacion.csv
+"""
+import argparse
+import csv
+import sys
+from typing import List
+
+import numpy as np
+
+from backend import BIN_WIDTH, DVH, DVHParseError, PackedStructures, Prescription
+from dvhstats import packed_volume_at
+from instrumentation import stage
+from report import plan_labels, reference_text
+
+CURVE_FIELDS = ['structure', 'plan', 'reference_plan', 'volume_cc', 'area_cc_cgy', 'area_percent_gy',
+                'max_difference_cc', 'max_difference_percent', 'dose_at_max_difference']
+CONSTRAINT_FIELDS = ['structure', 'type', 'ideal_dose', 'ideal_volume', 'plan', 'value', 'status', 'difference']
+
+
+def common_keys(dvhs: List[DVH]) -> list:
+    """ Estructuras presentes en todos los DVH, en el orden del primero """
+    return [key for key in dvhs[0].structures if all(key in dvh.structures for dvh in dvhs[1:])]
+
+
+class PlanComparison:
+    """
+    DVHs de varios planes en una grilla de dosis comun. El plan 0 es la referencia.
+
+    curves: (n_planes, n_estructuras, n_dosis), volumen [cm3] que recibe al menos cada dosis.
+    difference: curves - curves[0].
+    area: (n_planes, n_estructuras), integral de |difference| en la dosis [cm3 * cGy].
+    """
+    def __init__(self, dvhs: List[DVH], keys: list, dose_grid: np.ndarray, volumes: np.ndarray, curves: np.ndarray):
+        self.dvhs = dvhs
+        self.labels = plan_labels(dvhs)
+        self.keys = keys
+        self.dose_grid = dose_grid
+        self.volumes = volumes            # (n_planes, n_estructuras) volumen de referencia de cada estructura
+        self.curves = curves
+        self.difference = curves - curves[:1]
+        self.area = np.trapezoid(np.abs(self.difference), dose_grid, axis=-1) if len(dose_grid) > 1 \
+            else np.zeros(curves.shape[:2])
+
+    @property
+    def relative_curves(self) -> np.ndarray:   # curvas en % del volumen de cada estructura
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.curves / self.volumes[:, :, None] * 100.0
+
+    def curve_rows(self) -> List[dict]:
+        """ Una fila por estructura y plan (sin la referencia) con CURVE_FIELDS """
+        relative = self.relative_curves
+        relative_difference = relative - relative[:1]
+        relative_area = np.trapezoid(np.abs(relative_difference), self.dose_grid / 100.0, axis=-1) \
+            if len(self.dose_grid) > 1 else np.zeros(self.area.shape)
+        rows = []
+        for j, key in enumerate(self.keys):
+            for i in range(1, len(self.dvhs)):
+                worst = int(np.argmax(np.abs(self.difference[i, j]))) if len(self.dose_grid) else 0
+                rows.append({
+                    'structure': key, 'plan': self.labels[i], 'reference_plan': self.labels[0],
+                    'volume_cc': round(float(self.volumes[i, j]), 3),
+                    'area_cc_cgy': round(float(self.area[i, j]), 3),
+                    'area_percent_gy': round(float(relative_area[i, j]), 3),
+                    'max_difference_cc': round(float(self.difference[i, j, worst]), 3),
+                    'max_difference_percent': round(float(relative_difference[i, j, worst]), 3),
+                    'dose_at_max_difference': round(float(self.dose_grid[worst]), 1),
+                })
+        return rows
+
+    def constraint_rows(self, prescription: Prescription, ignored_structures=()) -> List[dict]:
+        """
+        Valor de cada constraint de la prescripcion en cada plan (nivel ideal, para comparar la
+        misma consulta en todos), su estado y la diferencia con el plan de referencia.
+        Solo las estructuras que estan en todos los planes.
+        """
+        rows = []
+        for name, plan in prescription.compiled().items():
+            if name in ignored_structures or name not in self.keys:
+                continue
+            results = [plan.verify(dvh.structures[name]) for dvh in self.dvhs]
+            for k, constraint in enumerate(plan.constraints):
+                reference = results[0][k].ideal[1]
+                for i, label in enumerate(self.labels):
+                    value = results[i][k].ideal[1]
+                    difference = value - reference if isinstance(value, float) and isinstance(reference, float) else None
+                    rows.append({
+                        'structure': name, 'type': constraint.type, 'ideal_dose': reference_text(constraint.ideal_dose),
+                        'ideal_volume': reference_text(constraint.ideal_volume), 'plan': label, 'value': value,
+                        'status': results[i][k].status,
+                        'difference': round(difference, 1) if difference is not None else None,
+                    })
+        return rows
+
+    def format_summary(self) -> str:
+        lines = [f"Referencia: {self.labels[0]}",
+                 f"{'Estructura':<20}{'Plan':<20}{'Area [cc*Gy]':>14}{'Max dV [cc]':>14}{'a [cGy]':>10}"]
+        for row in self.curve_rows():
+            lines.append(f"{row['structure']:<20}{row['plan']:<20}{row['area_cc_cgy'] / 100.0:>14.2f}"
+                         f"{row['max_difference_cc']:>14.2f}{row['dose_at_max_difference']:>10.1f}")
+        return '\n'.join(lines)
+
+    def plot(self, keys=None) -> None:
+        """ DVH acumulados de todos los planes superpuestos: un color por estructura, un trazo por plan """
+        import matplotlib.pyplot as plt
+
+        styles = ['-', '--', ':', '-.']
+        plt.figure()
+        for j, key in enumerate(self.keys):
+            if keys is not None and key not in keys:
+                continue
+            color = None
+            for i, label in enumerate(self.labels):
+                line, = plt.plot(self.dose_grid, self.curves[i, j], styles[i % len(styles)], color=color,
+                                 label=f'{key} - {label}')
+                color = line.get_color()
+        plt.title('Cumulated dose-volume histogram')
+        plt.xlabel('Dosis[cGy]')
+        plt.ylabel('Volume[cm3]')
+        plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+        plt.grid()
+        plt.show()
+
+
+def compare_plans(dvhs: List[DVH], keys=None, dose_step: float = BIN_WIDTH, max_dose: float = None) -> PlanComparison:
+    """
+    Compara las estructuras keys (por defecto las que estan en todos los DVH) en la grilla
+    0, dose_step, ... hasta max_dose (por defecto la mayor dosis de esas estructuras) [cGy].
+    """
+    if len(dvhs) < 2:
+        raise ValueError("Hacen falta al menos dos DVH para comparar")
+    keys = common_keys(dvhs) if keys is None else list(keys)
+    with stage('comparacion'):
+        stacked = {(i, key): dvh.structures[key] for i, dvh in enumerate(dvhs) for key in keys}
+        packed = PackedStructures.from_structures(stacked)
+        if max_dose is None:
+            max_dose = float(packed.dose.max(initial=0.0))
+        dose_grid = np.arange(0.0, max_dose + dose_step, dose_step)
+
+        indices = np.arange(len(stacked), dtype=np.int64)
+        curves = packed_volume_at(packed, indices, np.broadcast_to(dose_grid, (len(indices), len(dose_grid))))
+        volumes = np.array([structure.volume for structure in stacked.values()], dtype=np.float64)
+    return PlanComparison(dvhs, keys, dose_grid, volumes.reshape(len(dvhs), len(keys)),
+                          curves.reshape(len(dvhs), len(keys), len(dose_grid)))
+
+
+def write_comparison(file_path: str, comparison: PlanComparison, prescription: Prescription = None) -> None:
+    """
+    CSV con las diferencias de curvas por estructura y plan; si hay prescripcion, se escribe
+    ademas <archivo>_constraints.csv con la comparacion de cada constraint.
+    """
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CURVE_FIELDS)
+        writer.writeheader()
+        writer.writerows(comparison.curve_rows())
+    if prescription is not None:
+        root, extension = file_path.rsplit('.', 1) if '.' in file_path else (file_path, 'csv')
+        with open(f'{root}_constraints.{extension}', 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CONSTRAINT_FIELDS)
+            writer.writeheader()
+            writer.writerows(comparison.constraint_rows(prescription))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Comparacion de DVHs de distintos planes del mismo paciente.")
+    parser.add_argument("dvhs", nargs="+", help="DVH exportados por Monaco (.txt); el primero es la referencia")
+    parser.add_argument("-p", "--protocolo", help="Protocolo del Excel para comparar los constraints")
+    parser.add_argument("--excel", help="Excel de protocolos de constraints")
+    parser.add_argument("--paso", type=float, default=BIN_WIDTH, help="Paso de la grilla de dosis en cGy")
+    parser.add_argument("-o", "--salida", help="CSV con la comparacion (y <salida>_constraints.csv con -p)")
+    parser.add_argument("--graficar", action="store_true", help="Mostrar los DVH superpuestos")
+    args = parser.parse_args(argv)
+
+    if len(args.dvhs) < 2:
+        parser.error("hacen falta al menos dos DVH")
+    try:
+        dvhs = [DVH(file_path) for file_path in args.dvhs]
+    except DVHParseError as e:
+        print(e)
+        return 1
+    prescription = None
+    if args.protocolo:
+        from settings import constraint_excel_file_path
+        prescription = Prescription(args.excel or constraint_excel_file_path, args.protocolo)
+
+    comparison = compare_plans(dvhs, dose_step=args.paso)
+    print(comparison.format_summary())
+    if prescription is not None:
+        print()
+        for row in comparison.constraint_rows(prescription):
+            difference = '' if row['difference'] is None or row['plan'] == comparison.labels[0] else f"{row['difference']:+.1f}"
+            print(f"{row['structure']:<20}{row['type']:<12}{row['plan']:<20}{row['value']!s:>10}  {row['status']:<11}{difference:>8}")
+    if args.salida:
+        write_comparison(args.salida, comparison, prescription)
+    if args.graficar:
+        comparison.plot()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
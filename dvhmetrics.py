@@ -0,0 +1,224 @@
+"""
+Tabla de metricas Vx / Dx para auditorias: para cada estructura, el volumen (cc y %) que recibe
+cada dosis de una grilla y la dosis que cubre cada % de volumen de otra, calculados con una
+sola interpolacion vectorizada por DVH (o por tanda de DVHs). Se exporta a CSV o xlsx.
+
+    python dvhmetrics.py "DVH Output" -o metricas.xlsx --dosis 5:70:1 --volumenes 1:99:1
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List
+
+import numpy as np
+
+from backend import DVH, DVHParseError, PackedStructures
+from dvhcache import DVHCache
+from dvhstats import packed_dose_at, packed_volume_at, packed_segments
+from instrumentation import stage
+
+DEFAULT_DOSES = np.arange(500.0, 7001.0, 100.0)     # V5 ... V70 Gy, en cGy
+DEFAULT_VOLUME_PERCENTS = np.arange(1.0, 100.0)      # D1 ... D99 %
+PLAN_FIELDS = ['patient_id', 'plan_name', 'date_and_time', 'file_path', 'structure', 'volume_cc']
+
+
+def parse_grid(text: str) -> np.ndarray:
+    """ 'inicio:fin:paso' (fin incluido) o lista separada por comas: '5:70:1', '2,50,98' """
+    if ':' in text:
+        start, stop, step = (float(part) for part in text.split(':'))
+        return np.arange(start, stop + step / 2, step)
+    return np.array([float(part) for part in text.split(',')])
+
+
+def _level(value: float) -> str:
+    return f'{value:g}'
+
+
+class MetricsTable:
+    """
+    Metricas de un DVH: matrices estructuras x niveles alineadas con keys.
+
+    volume_cc / volume_percent: (n_estructuras, len(doses)), volumen que recibe al menos cada dosis.
+    dose: (n_estructuras, len(volume_percents)), dosis [cGy] que cubre cada % del volumen.
+    error: mensaje si el DVH no se pudo leer (las matrices quedan vacias).
+    """
+    def __init__(self, file_path, patient_id, plan_name, date_and_time, keys, volumes, doses, volume_percents,
+                 volume_cc, dose, error=None):
+        self.file_path = file_path
+        self.patient_id = patient_id
+        self.plan_name = plan_name
+        self.date_and_time = date_and_time
+        self.keys = keys
+        self.volumes = volumes
+        self.doses = doses
+        self.volume_percents = volume_percents
+        self.volume_cc = volume_cc
+        self.dose = dose
+        self.error = error
+
+    @property
+    def volume_percent(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.volume_cc / self.volumes[:, None] * 100.0
+
+    def columns(self) -> List[str]:
+        """ Columnas de metricas: V<dosis Gy>[cc], V<dosis Gy>[%] y D<vol %>[cGy] """
+        columns = []
+        for dose in self.doses:
+            columns += [f'V{_level(dose / 100.0)}Gy[cc]', f'V{_level(dose / 100.0)}Gy[%]']
+        return columns + [f'D{_level(percent)}%[cGy]' for percent in self.volume_percents]
+
+    def rows(self) -> List[list]:
+        """ Una fila por estructura con los valores de PLAN_FIELDS y de columns() """
+        percent = self.volume_percent
+        metrics = np.empty((len(self.keys), 2 * len(self.doses) + len(self.volume_percents)))
+        metrics[:, 0:2 * len(self.doses):2] = self.volume_cc
+        metrics[:, 1:2 * len(self.doses):2] = percent
+        metrics[:, 2 * len(self.doses):] = self.dose
+        metrics = np.round(metrics, 3)
+        plan = [self.patient_id, self.plan_name, self.date_and_time, self.file_path]
+        return [plan + [key, round(float(self.volumes[i]), 3)] + metrics[i].tolist() for i, key in enumerate(self.keys)]
+
+
+def _structure_tables(entries, doses, volume_percents) -> List[MetricsTable]:
+    """
+    entries: [(dvh, keys)]. Todas las estructuras de todos los DVH se interpolan juntas: una
+    llamada para los Vx y otra para los Dx.
+    """
+    doses = np.asarray(doses, dtype=np.float64)
+    volume_percents = np.asarray(volume_percents, dtype=np.float64)
+    if len(entries) == 1:
+        dvh, keys = entries[0]
+        packed, indices = packed_segments(dvh.structures, keys)
+    else:
+        stacked = {(n, key): dvh.structures[key] for n, (dvh, keys) in enumerate(entries) for key in keys}
+        packed, indices = PackedStructures.from_structures(stacked), np.arange(len(stacked), dtype=np.int64)
+    volumes = np.array([dvh.structures[key].volume for dvh, keys in entries for key in keys], dtype=np.float64)
+
+    volume_cc = packed_volume_at(packed, indices, np.broadcast_to(doses, (len(indices), len(doses))))
+    dose = packed_dose_at(packed, indices, volumes[:, None] * volume_percents / 100.0)
+
+    tables = []
+    first = 0
+    for dvh, keys in entries:
+        rows = slice(first, first + len(keys))
+        tables.append(MetricsTable(dvh.file_path, dvh.patient_id, dvh.plan_name, dvh.date_and_time, list(keys),
+                                   volumes[rows], doses, volume_percents, volume_cc[rows], dose[rows]))
+        first += len(keys)
+    return tables
+
+
+def metrics_table(dvh: DVH, doses=DEFAULT_DOSES, volume_percents=DEFAULT_VOLUME_PERCENTS, keys=None) -> MetricsTable:
+    """ Metricas de las estructuras keys (todas por defecto) del DVH. doses en cGy. """
+    with stage('metricas', file=dvh.file_path):
+        return _structure_tables([(dvh, list(dvh.structures) if keys is None else list(keys))], doses, volume_percents)[0]
+
+
+def metrics_tables(dvhs: List[DVH], doses=DEFAULT_DOSES, volume_percents=DEFAULT_VOLUME_PERCENTS) -> List[MetricsTable]:
+    """ Igual que metrics_table para varios DVH ya leidos, con una sola interpolacion para todos """
+    if not dvhs:
+        return []
+    with stage('metricas'):
+        return _structure_tables([(dvh, list(dvh.structures)) for dvh in dvhs], doses, volume_percents)
+
+
+_worker_cache = None
+
+def _init_worker(cache_dir):
+    global _worker_cache
+    _worker_cache = DVHCache(cache_dir) if cache_dir else None
+
+def _metrics_file(file_path, doses, volume_percents, cache=None) -> MetricsTable:
+    cache = cache if cache is not None else _worker_cache
+    try:
+        dvh = DVH(file_path, cache=cache)
+    except DVHParseError as e:
+        return MetricsTable(file_path, None, None, None, [], np.empty(0), doses, volume_percents,
+                            np.empty((0, len(doses))), np.empty((0, len(volume_percents))),
+                            error=str(e))
+    return metrics_table(dvh, doses, volume_percents)
+
+
+def iter_metrics(dvh_paths: List[str], doses=DEFAULT_DOSES, volume_percents=DEFAULT_VOLUME_PERCENTS,
+                 max_workers: int = None, cache_dir: str = None) -> Iterator[MetricsTable]:
+    """
+    MetricsTable de cada DVH, en paralelo (max_workers procesos, por defecto todos los nucleos) y
+    a medida que terminan (no en el orden de dvh_paths). Con max_workers=1 corre en este proceso.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(dvh_paths), 1))
+    if max_workers == 1:
+        cache = DVHCache(cache_dir) if cache_dir else None
+        for file_path in dvh_paths:
+            yield _metrics_file(file_path, doses, volume_percents, cache)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(cache_dir,)) as executor:
+        futures = [executor.submit(_metrics_file, file_path, doses, volume_percents) for file_path in dvh_paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def write_metrics(file_path: str, tables: List[MetricsTable]) -> int:
+    """
+    Escribe las tablas en un solo archivo (una fila por plan y estructura): xlsx si termina en
+    .xlsx, si no CSV. Todas las tablas tienen que usar las mismas grillas. Devuelve las filas escritas.
+    """
+    tables = [table for table in tables if table.error is None]
+    header = PLAN_FIELDS + (tables[0].columns() if tables else [])
+    n_rows = 0
+    if file_path.lower().endswith('.xlsx'):
+        # openpyxl solo hace falta para exportar a Excel
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Metricas')
+        sheet.append(header)
+        for table in tables:
+            for row in table.rows():
+                sheet.append(row)
+                n_rows += 1
+        workbook.save(file_path)
+    else:
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for table in tables:
+                rows = table.rows()
+                writer.writerows(rows)
+                n_rows += len(rows)
+    return n_rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tabla de metricas Vx/Dx de uno o mas DVH.")
+    parser.add_argument("entradas", nargs="+", help="DVH exportados por Monaco (.txt) o carpetas con DVHs")
+    parser.add_argument("-o", "--salida", default="metricas_dvh.csv", help="Archivo de salida (.csv o .xlsx)")
+    parser.add_argument("--dosis", default="5:70:1", help="Dosis de los Vx en Gy: inicio:fin:paso o lista (por defecto 5:70:1)")
+    parser.add_argument("--volumenes", default="1:99:1", help="Volumenes de los Dx en %%: inicio:fin:paso o lista (por defecto 1:99:1)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Procesos a usar (por defecto todos los nucleos)")
+    parser.add_argument("--cache-dir", help="Carpeta de cache de DVHs parseados")
+    args = parser.parse_args(argv)
+
+    dvh_paths = []
+    for entry in args.entradas:
+        dvh_paths += sorted(glob.glob(os.path.join(entry, "*.txt"))) if os.path.isdir(entry) else [entry]
+    if not dvh_paths:
+        print("No hay DVHs para procesar.")
+        return 1
+
+    order = {file_path: i for i, file_path in enumerate(dvh_paths)}
+    tables = sorted(iter_metrics(dvh_paths, parse_grid(args.dosis) * 100.0, parse_grid(args.volumenes),
+                                 max_workers=args.workers, cache_dir=args.cache_dir),
+                    key=lambda table: order[table.file_path])
+    for table in tables:
+        if table.error is not None:
+            print(f"ERROR  {table.error}")
+    n_rows = write_metrics(args.salida, tables)
+    print(f"{n_rows} filas ({len(tables)} DVH) en {args.salida}")
+    return 1 if any(table.error is not None for table in tables) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Simplificacion y remuestreo de DVHs con error acotado (DVH.simplify / DVH.resample) y
+verificacion: cuanto se aparta el DVH reducido del original en V(D), D(V), Dmedia, Dmax y, con
+un protocolo, en el valor y el estado de cada constraint.
+
+    python dvhresample.py "DVH Output/plan.txt" --volumen 0.01 --dosis 1 -p "PR+VS+LN 6000-20FX"
+    python dvhresample.py "DVH Output/plan.txt" --grilla 10 -o verificacion.csv
+"""
+import argparse
+import csv
+import sys
+from typing import List
+
+import numpy as np
+
+from backend import DVH, DVHParseError, MAX_DOSE_ABS_VOLUME, MAX_DOSE_ERROR, MAX_VOLUME_ERROR, Prescription
+
+DEVIATION_FIELDS = ['structure', 'rows', 'resampled_rows', 'max_volume_error_cc', 'dose_at_max_volume_error',
+                    'max_dose_error_cgy', 'volume_at_max_dose_error', 'mean_error_cgy', 'dmax_error_cgy',
+                    'max_constraint_difference', 'status_changes']
+
+
+def structure_deviation(original, resampled) -> dict:
+    """
+    Peor diferencia entre las dos curvas en volumen (a igual dosis) y en dosis (a igual volumen),
+    mas la de Dmedia y Dmax. Las dos son lineales entre filas, asi que alcanza con mirar las filas
+    de ambas (y, para la dosis, a cada lado de cada volumen: en las mesetas D(V) salta).
+    """
+    doses = np.union1d(original.dose_axis, resampled.dose_axis)
+    volume_error = np.abs(original.volume_at(doses) - resampled.volume_at(doses))
+    worst_dose = int(np.argmax(volume_error))
+
+    volumes = np.union1d(original.cumulated_volume_axis, resampled.cumulated_volume_axis)
+    step = np.maximum(np.abs(volumes), 1.0) * 1e-9
+    volumes = np.concatenate((volumes, volumes - step, volumes + step))
+    volumes = volumes[(volumes > 0) & (volumes <= original.volume)]
+    dose_error = np.abs(original.dose_at(volumes) - resampled.dose_at(volumes)) if len(volumes) else np.zeros(1)
+    worst_volume = int(np.argmax(dose_error))
+
+    return {
+        'structure': original.label, 'rows': len(original.dose_axis), 'resampled_rows': len(resampled.dose_axis),
+        'max_volume_error_cc': float(volume_error[worst_dose]), 'dose_at_max_volume_error': float(doses[worst_dose]),
+        'max_dose_error_cgy': float(dose_error[worst_volume]),
+        'volume_at_max_dose_error': float(volumes[worst_volume]) if len(volumes) else None,
+        'mean_error_cgy': float(abs(original.mean - resampled.mean)),
+        'dmax_error_cgy': float(abs(original.dose_at(MAX_DOSE_ABS_VOLUME) - resampled.dose_at(MAX_DOSE_ABS_VOLUME))),
+        'max_constraint_difference': None, 'status_changes': None,
+    }
+
+
+def verify_resampling(original: DVH, resampled: DVH, prescription: Prescription = None) -> List[dict]:
+    """
+    Una fila (DEVIATION_FIELDS) por estructura presente en los dos DVH. Con prescripcion, para las
+    estructuras que tienen constraints se agrega la mayor diferencia en el valor de un constraint
+    (sin redondear) y cuantos cambian de estado.
+    """
+    plans = prescription.compiled() if prescription is not None else {}
+    rows = []
+    for key, structure in original.structures.items():
+        if key not in resampled.structures:
+            continue
+        other = resampled.structures[key]
+        row = structure_deviation(structure, other)
+        row['structure'] = key
+        if key in plans:
+            plan = plans[key]
+            _, values = plan.evaluate(structure)
+            _, other_values = plan.evaluate(other)
+            difference = np.abs(values - other_values)
+            row['max_constraint_difference'] = float(np.nanmax(difference)) if np.isfinite(difference).any() else None
+            row['status_changes'] = sum(a.status != b.status for a, b in zip(plan.verify(structure), plan.verify(other)))
+        rows.append(row)
+    return rows
+
+
+def worst_deviation(rows: List[dict]) -> dict:
+    """ Maximo de cada columna de error sobre todas las estructuras, y el total de filas """
+    worst = {'rows': sum(row['rows'] for row in rows), 'resampled_rows': sum(row['resampled_rows'] for row in rows)}
+    for field in ('max_volume_error_cc', 'max_dose_error_cgy', 'mean_error_cgy', 'dmax_error_cgy',
+                  'max_constraint_difference', 'status_changes'):
+        values = [row[field] for row in rows if row[field] is not None]
+        worst[field] = max(values) if values else None
+    return worst
+
+
+def format_deviation(rows: List[dict]) -> str:
+    lines = [f"{'Estructura':<20}{'Filas':>8}{'Quedan':>8}{'dV [cc]':>10}{'dD [cGy]':>10}"
+             f"{'dDmedia':>10}{'dDmax':>10}{'dConstr':>10}{'Estados':>9}"]
+    for row in rows:
+        constraint = f"{row['max_constraint_difference']:.3f}" if row['max_constraint_difference'] is not None else '-'
+        changes = row['status_changes'] if row['status_changes'] is not None else '-'
+        lines.append(f"{row['structure']:<20}{row['rows']:>8}{row['resampled_rows']:>8}{row['max_volume_error_cc']:>10.4f}"
+                     f"{row['max_dose_error_cgy']:>10.3f}{row['mean_error_cgy']:>10.3f}{row['dmax_error_cgy']:>10.3f}"
+                     f"{constraint:>10}{changes:>9}")
+    return '\n'.join(lines)
+
+
+def write_deviation(file_path: str, rows: List[dict]) -> None:
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=DEVIATION_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Simplifica o remuestrea un DVH y verifica el error contra el original.")
+    parser.add_argument("dvh", help="DVH exportado por Monaco (.txt)")
+    parser.add_argument("--volumen", type=float, default=MAX_VOLUME_ERROR, help="Error maximo en volumen [cc]")
+    parser.add_argument("--dosis", type=float, default=MAX_DOSE_ERROR, help="Error maximo en dosis [cGy]")
+    parser.add_argument("--grilla", type=float, help="Remuestrear a una grilla uniforme con este paso [cGy] en vez de simplificar")
+    parser.add_argument("-p", "--protocolo", help="Protocolo del Excel para verificar los constraints")
+    parser.add_argument("--excel", help="Excel de protocolos de constraints")
+    parser.add_argument("-o", "--salida", help="CSV con el error de cada estructura")
+    args = parser.parse_args(argv)
+
+    try:
+        original = DVH(args.dvh)
+    except DVHParseError as e:
+        print(e)
+        return 1
+    resampled = original.copy()
+    if args.grilla:
+        resampled.resample(args.grilla)
+    else:
+        resampled.simplify(args.volumen, args.dosis)
+
+    prescription = None
+    if args.protocolo:
+        from settings import constraint_excel_file_path
+        prescription = Prescription(args.excel or constraint_excel_file_path, args.protocolo)
+
+    rows = verify_resampling(original, resampled, prescription)
+    print(format_deviation(rows))
+    worst = worst_deviation(rows)
+    print(f"\nFilas: {worst['rows']} -> {worst['resampled_rows']} "
+          f"({100.0 * worst['resampled_rows'] / max(worst['rows'], 1):.1f} %)")
+    print(f"Peor error: {worst['max_volume_error_cc']:.4f} cc en volumen, {worst['max_dose_error_cgy']:.3f} cGy en dosis, "
+          f"{worst['mean_error_cgy']:.3f} cGy en Dmedia, {worst['dmax_error_cgy']:.3f} cGy en Dmax")
+    if worst['max_constraint_difference'] is not None:
+        print(f"Constraints: diferencia maxima {worst['max_constraint_difference']:.3f}, "
+              f"{worst['status_changes']} cambios de estado")
+    if args.salida:
+        write_deviation(args.salida, rows)
+
+    within = (worst['max_volume_error_cc'] <= args.volumen * (1 + 1e-9)
+              and max(worst['max_dose_error_cgy'], worst['mean_error_cgy']) <= args.dosis * (1 + 1e-9))
+    print("Dentro de la tolerancia." if within else "FUERA de la tolerancia.")
+    return 0 if within else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Estadisticas de dosis de todas las estructuras de un DVH en una sola pasada vectorizada sobre
+los buffers de PackedStructures: Dmin, Dmax (0.03 cc), Dmedia, D2/D50/D95/D98 %, desvio,
+indice de homogeneidad y, para los targets de la prescripcion, cobertura e indices de conformidad.
+
+    python dvhstats.py "DVH Output/plan.txt" -p "PR+VS+LN 6000-20FX"
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from backend import DVH, DVHParseError, MAX_DOSE_ABS_VOLUME, PackedStructures, Prescription, structure_key
+
+# Columnas de DVHStatistics: (nombre, titulo, formato)
+STATISTICS = [
+    ('volume', 'Vol [cc]', '{:.2f}'),
+    ('dmin', 'Dmin', '{:.1f}'),
+    ('dmax', 'Dmax', '{:.1f}'),
+    ('dmean', 'Dmedia', '{:.1f}'),
+    ('d98', 'D98%', '{:.1f}'),
+    ('d95', 'D95%', '{:.1f}'),
+    ('d50', 'D50%', '{:.1f}'),
+    ('d2', 'D2%', '{:.1f}'),
+    ('sigma', 'Desvio', '{:.1f}'),
+    ('hi', 'HI', '{:.3f}'),
+]
+TARGET_STATISTICS = [
+    ('prescribed_dose', 'Dpresc', '{:.0f}'),
+    ('coverage', 'V100% [%]', '{:.1f}'),
+    ('ci_rtog', 'CI RTOG', '{:.3f}'),
+    ('ci_paddick', 'CI Paddick', '{:.3f}'),
+]
+# Fraccion del volumen de cada estructura para Dmin y los Dx %
+PERCENT_LEVELS = {'dmin': 1.0, 'd98': 0.98, 'd95': 0.95, 'd50': 0.50, 'd2': 0.02}
+
+
+def packed_segments(structures, keys=None):
+    """
+    (packed, indices): PackedStructures con las filas de keys y la posicion de cada una en sus
+    offsets. Si structures no esta empaquetado (dict, LazyStructures) se empaqueta aparte.
+    """
+    keys = list(structures) if keys is None else list(keys)
+    if isinstance(structures, PackedStructures):
+        indices = [structures.index_of(key) for key in keys]
+        if None not in indices:
+            return structures, np.array(indices, dtype=np.int64)
+    packed = PackedStructures.from_structures({key: structures[key] for key in keys})
+    return packed, np.arange(len(keys), dtype=np.int64)
+
+
+def _segment_interp(x, y, offsets, indices, queries, left, right):
+    """
+    np.interp por segmento: para cada segmento indices[i] (filas offsets[i]:offsets[i+1], con x no
+    decreciente adentro) interpola queries[i, :] y devuelve un array (len(indices), n_queries).
+    Fuera del rango usa left[i] / right[i], y en valores repetidos de x toma la ultima fila,
+    igual que np.interp.
+
+    Una sola busqueda binaria para todos: cada segmento se corre a su propio tramo de la recta
+    sumandole segmento * span (potencia de 2 mayor que el rango de x). El redondeo de la suma es
+    monotono, asi que el orden dentro de cada segmento se mantiene.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    queries = np.asarray(queries, dtype=np.float64)
+    if queries.size == 0:
+        return np.empty(queries.shape)
+    lengths = np.diff(offsets)
+    span = 2.0 ** np.ceil(np.log2(2 * max(np.abs(x).max(initial=0.0), np.abs(queries).max(initial=0.0)) + 2))
+    keys = np.repeat(np.arange(len(lengths), dtype=np.float64), lengths) * span + x
+    starts = offsets[indices][:, None]
+    stops = offsets[indices + 1][:, None]
+
+    shifted = indices[:, None] * span + queries
+    position = np.searchsorted(keys, shifted, side='right')
+    # Una fila apenas mayor que la consulta puede redondear a la misma clave y contarse como
+    # menor o igual: esas filas (claves iguales, en la practica una meseta) se descuentan
+    tied = (position > starts) & (x[np.maximum(position - 1, 0)] > queries)
+    if tied.any():
+        position = np.where(tied, np.searchsorted(keys, shifted, side='left'), position)
+    below = position <= starts     # todas las filas del segmento son mayores que la consulta
+    above = position >= stops      # ninguna es mayor
+    low = np.clip(position - 1, starts, np.maximum(stops - 2, starts))
+    high = np.minimum(low + 1, stops - 1)
+    x0, x1, y0, y1 = x[low], x[high], y[low], y[high]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = y0 + (queries - x0) / (x1 - x0) * (y1 - y0)
+    result = np.where(queries == x0, y0, result)
+
+    last = np.maximum(stops - 1, starts)
+    at_end = np.where(queries == x[last], y[last], np.broadcast_to(np.asarray(right, dtype=np.float64)[:, None], result.shape))
+    result = np.where(above, at_end, result)
+    result = np.where(below, np.asarray(left, dtype=np.float64)[:, None], result)
+    return result
+
+
+def dose_at(structures, keys, volumes):
+    """
+    Dosis [cGy] a los volumenes [cm3] volumes[i, :] de cada estructura keys[i], igual que
+    Structure.dose_at pero para todas las estructuras de una vez.
+    """
+    return packed_dose_at(*packed_segments(structures, keys), volumes)
+
+
+def volume_at(structures, keys, doses):
+    """
+    Volumen [cm3] a las dosis [cGy] doses[i, :] de cada estructura keys[i], igual que
+    Structure.volume_at pero para todas las estructuras de una vez.
+    """
+    return packed_volume_at(*packed_segments(structures, keys), doses)
+
+
+def packed_dose_at(packed, indices, volumes):
+    """ dose_at sobre los segmentos indices de un PackedStructures (ver packed_segments) """
+    offsets = packed.offsets
+    first, last = offsets[indices], offsets[indices + 1] - 1
+    return _segment_interp(-np.asarray(packed.volume, dtype=np.float64), packed.dose, offsets, indices,
+                           -np.asarray(volumes, dtype=np.float64), left=packed.dose[last], right=packed.dose[first])
+
+
+def packed_volume_at(packed, indices, doses):
+    """ volume_at sobre los segmentos indices de un PackedStructures (ver packed_segments) """
+    offsets = packed.offsets
+    first, last = offsets[indices], offsets[indices + 1] - 1
+    return _segment_interp(packed.dose, packed.volume, offsets, indices, doses,
+                           left=packed.volume[first], right=packed.volume[last])
+
+
+def _moments(packed, indices, volumes):
+    """ (Dmedia, desvio) de cada segmento con el DVH diferencial, como Structure.mean """
+    offsets = packed.offsets
+    dose = np.asarray(packed.dose, dtype=np.float64)
+    volume = np.asarray(packed.volume, dtype=np.float64)
+    n_segments = len(offsets) - 1
+    segment = np.repeat(np.arange(n_segments), np.diff(offsets))
+
+    differential = np.zeros_like(volume)
+    differential[:-1] = volume[:-1] - volume[1:]
+    differential[offsets[1:][offsets[1:] > 0] - 1] = 0.0   # la ultima fila de cada estructura
+
+    weight = np.bincount(segment, weights=differential, minlength=n_segments)
+    weighted_dose = np.bincount(segment, weights=differential * dose, minlength=n_segments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        center = weighted_dose / weight
+        variance = np.bincount(segment, weights=differential * (dose - center[segment]) ** 2, minlength=n_segments) / weight
+        mean = np.where(volumes > 0, weighted_dose[indices] / volumes, np.nan)
+    return mean, np.sqrt(variance[indices])
+
+
+class DVHStatistics:
+    """
+    Tabla de estadisticas por estructura: columns[nombre] es un array alineado con keys
+    (NaN donde no aplica, por ejemplo los indices de conformidad de los organos de riesgo).
+    """
+    def __init__(self, dvh, keys: list, columns: dict):
+        self.dvh = dvh
+        self.keys = keys
+        self.columns = columns
+
+    def __getitem__(self, key) -> dict:
+        i = self.keys.index(key)
+        return {name: float(values[i]) for name, values in self.columns.items()}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def rows(self) -> list:
+        """ Una fila por estructura: {'structure': clave, columna: valor, ...} """
+        return [{'structure': key, **self[key]} for key in self.keys]
+
+    def format_table(self) -> str:
+        specs = [spec for spec in STATISTICS + TARGET_STATISTICS
+                 if spec[0] in self.columns and not np.isnan(self.columns[spec[0]]).all()]
+        name_width = max([len('Estructura')] + [len(key) for key in self.keys]) + 2
+        width = max(len(title) for _, title, _ in specs) + 2
+        lines = ['Estructura'.ljust(name_width) + ''.join(title.rjust(width) for _, title, _ in specs)]
+        for i, key in enumerate(self.keys):
+            cells = []
+            for name, _, fmt in specs:
+                value = self.columns[name][i]
+                cells.append(('-' if np.isnan(value) else fmt.format(value)).rjust(width))
+            lines.append(key.ljust(name_width) + ''.join(cells))
+        return '\n'.join(lines)
+
+
+def dvh_statistics(dvh: DVH, prescription: Prescription = None, keys=None, body_key: str = None) -> DVHStatistics:
+    """
+    Estadisticas de las estructuras keys del DVH (todas por defecto).
+
+    HI = (D2 - D98) / D50 (ICRU 83). Para los targets de prescription.target_structures que
+    estan en el DVH: cobertura = % del volumen con la dosis prescripta, CI RTOG = V_presc / TV y
+    CI Paddick = TV_presc^2 / (TV * V_presc), donde V_presc es el volumen de body_key con la
+    dosis prescripta. body_key tiene que contener a los targets: el PACIENTE de Monaco
+    (Paciente(Unsp.Tiss.)) es solo el tejido fuera de las estructuras contorneadas y no sirve, y
+    BODY/EXTERNAL se descartan al leer el DVH. Sin body_key los CI quedan en NaN.
+    """
+    structures = dvh.structures
+    keys = list(structures) if keys is None else list(keys)
+    packed, indices = packed_segments(structures, keys)
+    volumes = np.array([structures[key].volume for key in keys], dtype=np.float64)
+
+    # Todas las dosis a volumen de todas las estructuras en una sola interpolacion
+    levels = list(PERCENT_LEVELS)
+    queries = np.column_stack([volumes * PERCENT_LEVELS[name] for name in levels] + [np.full(len(keys), MAX_DOSE_ABS_VOLUME)])
+    doses = packed_dose_at(packed, indices, queries)
+
+    columns = {'volume': volumes}
+    for j, name in enumerate(levels):
+        columns[name] = doses[:, j]
+    columns['dmax'] = doses[:, -1]
+    columns['dmean'], columns['sigma'] = _moments(packed, indices, volumes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        columns['hi'] = (columns['d2'] - columns['d98']) / columns['d50']
+
+    for name, _, _ in TARGET_STATISTICS:
+        columns[name] = np.full(len(keys), np.nan)
+    # Los nombres del Excel se llevan a la clave de DVH.structures, igual que al mapear los constraints
+    target_doses = {structure_key(name): doses for name, doses in prescription.target_structures.items()} \
+        if prescription is not None else {}
+    targets = [(i, key) for i, key in enumerate(keys) if key in target_doses]
+    if targets:
+        rows = [i for i, _ in targets]
+        prescribed = np.array([target_doses[key][0] for _, key in targets], dtype=np.float64)
+        covered = packed_volume_at(packed, indices[rows], prescribed[:, None])[:, 0]
+        columns['prescribed_dose'][rows] = prescribed
+        with np.errstate(invalid='ignore', divide='ignore'):
+            columns['coverage'][rows] = covered / volumes[rows] * 100.0
+            if body_key is not None and body_key in structures:
+                body = structures[body_key]
+                isodose_volume = body.volume_at(prescribed)
+                columns['ci_rtog'][rows] = isodose_volume / volumes[rows]
+                columns['ci_paddick'][rows] = covered ** 2 / (volumes[rows] * isodose_volume)
+
+    return DVHStatistics(dvh, keys, columns)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Estadisticas de dosis de todas las estructuras de un DVH.")
+    parser.add_argument("dvh", help="DVH exportado por Monaco (.txt)")
+    parser.add_argument("-p", "--protocolo", help="Protocolo del Excel, para los indices de los targets")
+    parser.add_argument("--excel", help="Excel de protocolos de constraints")
+    parser.add_argument("--body", help="Estructura que contiene a los targets, para los indices de conformidad")
+    args = parser.parse_args(argv)
+
+    try:
+        dvh = DVH(args.dvh)
+    except DVHParseError as e:
+        print(e)
+        return 1
+    prescription = None
+    if args.protocolo:
+        from settings import constraint_excel_file_path
+        prescription = Prescription(args.excel or constraint_excel_file_path, args.protocolo)
+
+    print(f"{dvh.plan_name} ({dvh.patient_id}) - {dvh.date_and_time}\n")
+    print(dvh_statistics(dvh, prescription, body_key=args.body.upper() if args.body else None).format_table())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Medicion opcional por etapa (lectura y parseo del DVH, carga de la prescripcion, mapeo,
+evaluacion, reporte): tiempo real, tiempo de CPU y pico de memoria (tracemalloc).
+
+Apagada no cuesta nada: stage() devuelve un contexto vacio. Se prende con la variable de
+entorno DOSE_POLICE_TRACE=<archivo .json o .csv> (o con --traza en cli.py) y al final de la
+corrida se escribe la traza con un registro por etapa y un resumen agregado.
+
+    with stage('dvh', file=file_path):
+        dvh = DVH(file_path)
+"""
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+TRACE_ENV = 'DOSE_POLICE_TRACE'
+TRACE_MEMORY_ENV = 'DOSE_POLICE_TRACE_MEMORY'   # '0' para no usar tracemalloc (es lo que mas frena)
+
+RECORD_FIELDS = ['stage', 'parent', 'file', 'wall_s', 'cpu_s', 'peak_kb', 'start_s', 'pid', 'thread']
+
+
+class StageTracer:
+    """
+    Junta un registro por etapa. Las etapas se pueden anidar (parent queda con el nombre de la
+    de afuera); cpu_s es tiempo de CPU del hilo y peak_kb el pico de memoria sobre la del inicio
+    de la etapa. Con varios hilos a la vez el pico de memoria es del proceso, no de cada etapa.
+    """
+    def __init__(self, path: str = None, memory: bool = True):
+        self.path = path
+        self.memory = memory
+        self.records = []
+        self.started = datetime.now()
+        self._t0 = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _sink(self) -> list:
+        sink = getattr(self._local, 'sink', None)
+        return sink if sink is not None else self.records
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        stack = self._stack()
+        frame = {'peak': 0}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:   # el pico hasta aca es de la etapa de afuera
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['start_memory'] = current
+        parent = stack[-1]['name'] if stack else None
+        frame['name'] = name
+        stack.append(frame)
+
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            stack.pop()
+            peak_kb = None
+            if self.memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                peak_kb = round(max(peak - frame['start_memory'], 0) / 1024, 1)
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            record = {'stage': name, 'parent': parent, 'file': info.pop('file', None),
+                      'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6), 'peak_kb': peak_kb,
+                      'start_s': round(start_wall - self._t0, 6), 'pid': os.getpid(),
+                      'thread': threading.current_thread().name}
+            record.update(info)
+            with self._lock:
+                self._sink().append(record)
+
+    @contextmanager
+    def capture(self):
+        """
+        Junta en una lista aparte (en vez de self.records) lo que se mida en este hilo dentro del
+        with; sirve para devolver la traza de un worker de batch al proceso principal.
+        """
+        previous = getattr(self._local, 'sink', None)
+        captured = []
+        self._local.sink = captured
+        try:
+            yield captured
+        finally:
+            self._local.sink = previous
+
+    def extend(self, records) -> None:
+        with self._lock:
+            self.records.extend(records or [])
+
+    def summary(self) -> list:
+        """ Una fila por etapa: cantidad, tiempos totales/medios/maximos y pico de memoria maximo """
+        stages = {}
+        for record in self.records:
+            stats = stages.setdefault(record['stage'], {'stage': record['stage'], 'count': 0, 'wall_total_s': 0.0,
+                                                        'wall_max_s': 0.0, 'cpu_total_s': 0.0, 'peak_max_kb': None})
+            stats['count'] += 1
+            stats['wall_total_s'] += record['wall_s']
+            stats['wall_max_s'] = max(stats['wall_max_s'], record['wall_s'])
+            stats['cpu_total_s'] += record['cpu_s']
+            if record['peak_kb'] is not None:
+                stats['peak_max_kb'] = max(stats['peak_max_kb'] or 0.0, record['peak_kb'])
+        for stats in stages.values():
+            stats['wall_mean_s'] = stats['wall_total_s'] / stats['count']
+            for key in ('wall_total_s', 'wall_max_s', 'cpu_total_s', 'wall_mean_s'):
+                stats[key] = round(stats[key], 6)
+        return list(stages.values())
+
+    def format_summary(self) -> str:
+        lines = [f"{'etapa':<16}{'n':>6}{'total [s]':>12}{'medio [ms]':>12}{'max [ms]':>12}{'CPU [s]':>10}{'pico [MB]':>11}"]
+        for stats in self.summary():
+            peak = f"{stats['peak_max_kb'] / 1024:.1f}" if stats['peak_max_kb'] is not None else '-'
+            lines.append(f"{stats['stage']:<16}{stats['count']:>6}{stats['wall_total_s']:>12.3f}"
+                         f"{stats['wall_mean_s'] * 1e3:>12.1f}{stats['wall_max_s'] * 1e3:>12.1f}"
+                         f"{stats['cpu_total_s']:>10.3f}{peak:>11}")
+        return '\n'.join(lines)
+
+    def write(self, path: str = None) -> str:
+        """
+        Escribe la traza: CSV (un registro por fila) si el archivo termina en .csv, si no JSON con
+        los datos de la corrida, los registros y el resumen.
+        """
+        path = path or self.path
+        with self._lock:
+            records = list(self.records)
+        if path.lower().endswith('.csv'):
+            extra = sorted({key for record in records for key in record} - set(RECORD_FIELDS))
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS + extra)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            run = {'started': self.started.isoformat(timespec='seconds'), 'argv': sys.argv,
+                   'pid': os.getpid(), 'memory': self.memory}
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'run': run, 'stages': records, 'summary': self.summary()}, f, ensure_ascii=False, indent=1)
+        return path
+
+
+_tracer = None
+
+
+def enable(path: str = None, memory: bool = None) -> StageTracer:
+    """ Prende la medicion en este proceso (memory por defecto segun DOSE_POLICE_TRACE_MEMORY) """
+    global _tracer
+    if memory is None:
+        memory = os.environ.get(TRACE_MEMORY_ENV, '1') != '0'
+    _tracer = StageTracer(path, memory)
+    return _tracer
+
+
+def enable_from_env() -> StageTracer:
+    """ Prende la medicion si esta definida DOSE_POLICE_TRACE; devuelve el tracer o None """
+    path = os.environ.get(TRACE_ENV)
+    if path and _tracer is None:
+        enable(path)
+    return _tracer
+
+
+def tracer() -> StageTracer:
+    return _tracer
+
+
+def stage(name: str, **info):
+    """ Contexto que mide la etapa name si la medicion esta prendida (info: file=..., etc.) """
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.stage(name, **info)
@@ -0,0 +1,106 @@
+"""
+Matriz de constraints x planes para comparar varios planes candidatos de un paciente contra un
+mismo protocolo: valor y estado (ideal / aceptable / no pasa) de cada constraint en cada plan y
+cual es el mejor plan en cada fila. Se exporta a CSV (y a PDF con report.write_matrix_pdf).
+"""
+import csv
+from typing import List
+
+from backend import CONSTRAINT_TYPES, actualizar_dvh_con_mapeos, dose_police_in_action
+from batch import PlanEvaluation
+from instrumentation import stage
+from report import plan_labels, reference_text
+
+STATUS_RANK = {'ideal': 2, 'acceptable': 1, 'fail': 0}
+STATUS_TEXT = {'ideal': 'IDEAL', 'acceptable': 'ACEPTABLE', 'fail': 'NO PASA'}
+LOWER_BOUND_TYPES = CONSTRAINT_TYPES[:2]   # V(D)>V: mejor cuanto mas alto; el resto, cuanto mas bajo
+
+
+def evaluate_plan(dvh, presc, name_mapping: dict = None, volume_mapping: dict = None,
+                  ignored_structures=()) -> PlanEvaluation:
+    """
+    Aplica el mapeo de estructuras de la GUI ({nombre_presc: nombre_dvh}) y evalua el DVH.
+    Las estructuras de la prescripcion que no estan en el DVH quedan en missing_structures.
+    """
+    mapping_invertido = {v: k for k, v in (name_mapping or {}).items() if v and v != "-"}
+    if mapping_invertido:
+        with stage('mapeo', file=dvh.file_path):
+            actualizar_dvh_con_mapeos(dvh, mapping_invertido, volume_mapping or {})
+    missing = [name for name in presc.structures if name not in ignored_structures and name not in dvh.structures]
+    results = dose_police_in_action([dvh], presc, list(ignored_structures) + missing)
+    return PlanEvaluation(dvh.file_path, presc, dvh.patient_id, dvh.plan_name, dvh.date_and_time, results, missing)
+
+
+class ConstraintMatrix:
+    """
+    rows: una por constraint de la prescripcion, {'structure', 'constraint', 'cells', 'best'}.
+    cells[i] es el ConstraintResult del plan i (None si la estructura no se evaluo en ese plan) y
+    best la lista de planes con el mejor resultado (vacia si todos dan lo mismo).
+
+    Se compara el valor del nivel ideal, que es la misma consulta en todos los planes; el estado
+    sale de ambos niveles.
+    """
+    def __init__(self, prescription, evaluations: List[PlanEvaluation]):
+        self.prescription = prescription
+        self.evaluations = evaluations
+        self.labels = plan_labels(evaluations)
+        self.rows = []
+        for name, constraints in prescription.structures.items():
+            for k, constraint in enumerate(constraints):
+                cells = [evaluation.results[name][k] if name in evaluation.results else None for evaluation in evaluations]
+                self.rows.append({'structure': name, 'constraint': constraint, 'cells': cells,
+                                  'best': self._best(constraint, cells)})
+
+    @staticmethod
+    def _best(constraint, cells) -> list:
+        scores = {}
+        for i, result in enumerate(cells):
+            if result is None or not isinstance(result.ideal[1], float):
+                continue
+            value = result.ideal[1] if constraint.type in LOWER_BOUND_TYPES else -result.ideal[1]
+            scores[i] = (STATUS_RANK[result.status], value)
+        if len(set(scores.values())) < 2:
+            return []
+        top = max(scores.values())
+        return [i for i, score in scores.items() if score == top]
+
+    @property
+    def patient_id(self) -> str:
+        ids = sorted({evaluation.patient_id for evaluation in self.evaluations if evaluation.patient_id})
+        return ', '.join(ids)
+
+    def plan_counts(self) -> list:
+        """ {'ideal', 'acceptable', 'fail', 'best'}: cantidad de constraints por estado de cada plan """
+        counts = [{'ideal': 0, 'acceptable': 0, 'fail': 0, 'best': 0} for _ in self.evaluations]
+        for row in self.rows:
+            for i, result in enumerate(row['cells']):
+                if result is not None:
+                    counts[i][result.status] += 1
+            for i in row['best']:
+                counts[i]['best'] += 1
+        return counts
+
+    @staticmethod
+    def constraint_text(constraint) -> str:
+        text = f"{constraint.type}: {reference_text(constraint.ideal_dose)} {reference_text(constraint.ideal_volume)}"
+        if constraint.ACCEPTABLE_LV_AVAILABLE:
+            text += f" ({reference_text(constraint.acceptable_dose)} {reference_text(constraint.acceptable_volume)})"
+        return text.replace(' None', '')
+
+    def write_csv(self, file_path: str) -> None:
+        """ Una fila por constraint: valor y estado en cada plan y los mejores planes """
+        header = ['structure', 'constraint_type', 'ideal_dose', 'ideal_volume', 'acceptable_dose', 'acceptable_volume']
+        for label in self.labels:
+            header += [f'{label} valor', f'{label} estado']
+        header.append('mejor')
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in self.rows:
+                constraint = row['constraint']
+                line = [row['structure'], constraint.type] + [reference_text(value) for value in (
+                    constraint.ideal_dose, constraint.ideal_volume, constraint.acceptable_dose, constraint.acceptable_volume)]
+                for result in row['cells']:
+                    line += [result.ideal[1], result.status] if result is not None else ['', 'no evaluada']
+                line.append('; '.join(self.labels[i] for i in row['best']))
+                writer.writerow(line)
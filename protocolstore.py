@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+
+from backend import prescription_sheet_charts
+from settings import local_data_dir
+from xlstools import XlsxWorkbook
+
+STORE_VERSION = 2   # 2: celdas tipadas (float, str, None) en vez de str con 'None'
+
+
+def default_store_path(excel_path: str, suffix: str = '') -> str:
+    """
+    Un archivo por Excel en la carpeta local: <local_data_dir>/protocolos/<hash(ruta)><suffix>.json
+    """
+    key = hashlib.blake2b(os.path.abspath(excel_path).encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(local_data_dir(), 'protocolos', f'{key}{suffix}.json')
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _WorkbookSnapshot(ABC):
+    """
+    Algo derivado del Excel de protocolos y guardado en un JSON local, con el tamaño, mtime y
+    hash del Excel del que salio.
+
+    Si cambia el tamaño/mtime del Excel se compara el hash del contenido y solo se reconstruye
+    (_build) si el contenido es otro. Si el Excel no esta accesible (NAS caido) se usa la ultima copia.
+    """
+    SUFFIX = ''
+
+    def __init__(self, excel_path: str, store_path: str = None):
+        self.excel_path = excel_path
+        self.store_path = store_path or default_store_path(excel_path, self.SUFFIX)
+        self._data = None   # {'version', 'size', 'mtime_ns', 'hash', 'content'}
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _build(self):
+        """ Contenido a guardar (serializable a JSON), leido del Excel """
+
+    def _load(self):
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data if data.get('version') == STORE_VERSION else None
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.store_path) or '.', exist_ok=True)
+        temp_path = f'{self.store_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(temp_path, self.store_path)
+
+    def load_cached(self) -> bool:
+        """
+        Carga la ultima copia guardada sin mirar el Excel. Devuelve True si habia una.
+        """
+        if self._data is None:
+            self._data = self._load()
+        return self._data is not None
+
+    def refresh(self) -> bool:
+        """
+        Revisa si el Excel cambio y reconstruye si hace falta. Devuelve True si se reconstruyo.
+        """
+        with self._lock:
+            self.load_cached()
+            try:
+                stat = os.stat(self.excel_path)
+            except OSError:
+                if self._data is None:
+                    raise
+                return False
+
+            if self._data is not None and (self._data['size'], self._data['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                return False
+
+            digest = file_hash(self.excel_path)
+            rebuilt = self._data is None or self._data['hash'] != digest
+            content = self._build() if rebuilt else self._data['content']
+            self._data = {'version': STORE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                          'hash': digest, 'content': content}
+            self._save()
+            return rebuilt
+
+    def refresh_in_background(self, on_done=None) -> threading.Thread:
+        """
+        refresh() en un hilo aparte; on_done(reconstruido) se llama desde ese hilo al terminar.
+        Los errores (por ejemplo el NAS no accesible) solo se imprimen: queda la copia anterior.
+        """
+        def run():
+            try:
+                rebuilt = self.refresh()
+            except Exception as e:
+                print(f"No se pudo actualizar {self.store_path}: {e}")
+                return
+            if on_done is not None:
+                on_done(rebuilt)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def content_hash(self, refresh: bool = True) -> str:
+        """ Hash del Excel del que sale la copia actual (cambia cuando se reconstruye) """
+        self._content(refresh)
+        return self._data['hash']
+
+    def _content(self, refresh: bool):
+        if refresh or not self.load_cached():
+            self.refresh()
+        return self._data['content']
+
+
+class ProtocolStore(_WorkbookSnapshot):
+    """
+    Copia local compilada del Excel de protocolos: cada hoja ya convertida a
+    [tabla_targets, tabla_constraints] (lo que devuelve prescription_sheet_charts).
+
+    El Excel se lee entero una sola vez; despues buscar un protocolo es un acceso a un dict.
+    """
+    def _build(self) -> dict:
+        sheets = {}
+        workbook = XlsxWorkbook(self.excel_path)
+        try:
+            for sheet_name in workbook.sheetnames:
+                try:
+                    targets, constraints = prescription_sheet_charts(workbook[sheet_name])
+                except (AssertionError, ValueError, IndexError):   # hojas que no son protocolos (indice, notas, ...)
+                    continue
+                sheets[sheet_name] = [targets, constraints]
+        finally:
+            workbook.close()
+        return sheets
+
+    def sheet_names(self, refresh: bool = True) -> list:
+        return list(self._content(refresh))
+
+    def constraints_chart(self, sheet_name: str) -> list:
+        """
+        [tabla_targets, tabla_constraints] de la hoja (float, str o None en celdas vacias).
+        Devuelve copias, Prescription las modifica.
+        """
+        try:
+            targets, constraints = self._content(refresh=True)[sheet_name]
+        except KeyError:
+            raise KeyError(f"No existe el protocolo '{sheet_name}' en {self.excel_path}") from None
+        return [[list(row) for row in targets], [list(row) for row in constraints]]
+
+
+class ProtocolIndex(_WorkbookSnapshot):
+    """
+    Indice de las hojas del Excel de protocolos, en el orden del libro:
+    [{'sheet': nombre_hoja, 'protocol': celda B2, 'dimensions': 'A1:G45' o None}].
+
+    Es lo unico que necesita la ventana de seleccion para armar la lista de protocolos, asi
+    que al arrancar no hace falta abrir el Excel salvo que haya cambiado.
+    """
+    SUFFIX = '.indice'
+    NAME_CELL = 'B2'
+
+    def _build(self) -> list:
+        entries = []
+        workbook = XlsxWorkbook(self.excel_path)
+        try:
+            for sheet in workbook:
+                try:
+                    dimensions = sheet.calculate_dimension()
+                except ValueError:   # la hoja no trae el tag de dimensiones
+                    dimensions = None
+                entries.append({'sheet': sheet.title, 'protocol': sheet[self.NAME_CELL].value,
+                                'dimensions': dimensions})
+        finally:
+            workbook.close()
+        return entries
+
+    def entries(self, refresh: bool = True) -> list:
+        return list(self._content(refresh))
+
+    def protocol_names(self, refresh: bool = True) -> list:
+        """
+        Contenido de B2 de cada hoja, en el orden del libro (como get_cell_content(..., 'B2')).
+        """
+        return [entry['protocol'] for entry in self._content(refresh)]
+
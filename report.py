@@ -0,0 +1,276 @@
+import csv
+import json
+import os
+from datetime import datetime
+from typing import List
+
+from settings import resource_path
+
+FLECHA = "➜"  # flecha más grande y elegante
+PDF_COLORS = {"green": "green", "yellow": "orange", "red": "red"}   # nombres de reportlab.lib.colors
+
+
+def plan_labels(plans) -> List[str]:
+    """
+    Nombre de cada plan para las tablas (cualquier objeto con plan_name: DVH, PlanEvaluation);
+    si se repite se le agrega el numero de orden.
+    """
+    names = [plan.plan_name for plan in plans]
+    return [f'{name} ({i + 1})' if names.count(name) > 1 else name for i, name in enumerate(names)]
+
+
+def reference_text(value) -> str:
+    """
+    Valor de referencia de un constraint como se escribio en el Excel: 4000.0 -> '4000',
+    35.5 -> '35.5' y celda vacia -> 'None'.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def result_segments(presc, results: dict, ignored_structures=()) -> List[tuple]:
+    """
+    Texto del reporte de constraints como lista de (texto, tag), con tag en
+    'title', 'green', 'yellow' o 'red'. Es lo que muestra ResultsWindow y lo que va al PDF.
+    """
+    segments = []
+    for p_name in presc.structures:
+        if p_name in ignored_structures or p_name not in results:
+            continue
+        segments.append((f'{p_name} constraints:\n', "title"))
+        for result in results[p_name]:
+            constraint = result.constraint
+            ideal_dose, ideal_volume = reference_text(constraint.ideal_dose), reference_text(constraint.ideal_volume)
+            acceptable_dose, acceptable_volume = reference_text(constraint.acceptable_dose), reference_text(constraint.acceptable_volume)
+            if not constraint.ACCEPTABLE_LV_AVAILABLE:
+                if result.ideal[0]:
+                    mensaje = (
+                        f"    PASA IDEAL: {constraint.type}: "
+                        f"{ideal_dose} {ideal_volume}  {FLECHA}  "
+                        f"{ideal_dose} {result.ideal[1]}\n\n"
+                    )
+                    segments.append((mensaje, "green"))
+                else:
+                    mensaje = (
+                        f"    NO PASA: {constraint.type}: "
+                        f"{ideal_dose} {ideal_volume}  {FLECHA}  "
+                        f"{ideal_dose} {result.ideal[1]}\n\n"
+                    )
+                    segments.append((mensaje, "red"))
+            else:
+                if result.ideal[0]:
+                    mensaje = (
+                        f"    PASA IDEAL: {constraint.type}: "
+                        f"{ideal_dose} {ideal_volume}  {FLECHA}  "
+                        f"{ideal_dose} {result.ideal[1]}\n\n"
+                    )
+                    segments.append((mensaje, "green"))
+                elif result.acceptable[0]:
+                    mensaje = (
+                        f"    PASA ACEPTABLE: {constraint.type}: "
+                        f"{acceptable_dose} {acceptable_volume}  {FLECHA}  "
+                        f"{acceptable_dose} {result.acceptable[1]}\n\n"
+                    )
+                    segments.append((mensaje, "yellow"))
+                else:
+                    mensaje = (
+                        f"    NO PASA: {constraint.type}: "
+                        f"{acceptable_dose} {acceptable_volume}  {FLECHA}  "
+                        f"{acceptable_dose} {result.acceptable[1]}\n\n"
+                    )
+                    segments.append((mensaje, "red"))
+    return segments
+
+
+def write_results_pdf(file_path: str, plan_name: str, patient_id: str, segments: List[tuple]) -> None:
+    """
+    Genera el PDF de resultados (logo, encabezado y cuerpo coloreado) a partir de result_segments.
+    No necesita ventana, sirve tanto para la GUI como para el modo batch.
+    """
+    # reportlab se importa recien aca: el modo batch sin --pdf y los workers no lo necesitan
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+
+    lines = []
+    for text, tag in segments:
+        for line in text.split("\n")[:-1] if text.endswith("\n") else text.split("\n"):
+            lines.append((line, tag))
+
+    c = canvas.Canvas(file_path, pagesize=letter)
+    width, height = letter
+
+    # --- LOGO INTECNUS ---
+    try:
+        logo_path = resource_path(os.path.join("images", "logo_intecnus.png"))
+        c.drawImage(logo_path, 40, height - 130, width=120, preserveAspectRatio=True, mask='auto')
+    except Exception as e:
+        print("No se pudo cargar el logo:", e)
+
+    # --- ENCABEZADO ---
+    y = height - 50
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(180, y, "Resultados de Constraints")
+    y -= 25
+    c.setFont("Helvetica", 12)
+    c.drawString(180, y, f"Plan: {plan_name}")
+    y -= 20
+    c.drawString(180, y, f"Paciente ID: {patient_id}")
+    y -= 20
+    fecha = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    c.drawString(180, y, f"Fecha de generación: {fecha}")
+    y -= 40
+
+    # --- CUERPO CON COLORES ---
+    c.setFont("Helvetica", 10)
+    for line, tag in lines:
+        c.setFillColor(getattr(colors, PDF_COLORS.get(tag, "black")))
+        c.drawString(40, y, line)
+        y -= 14  # interlineado más grande
+        if y < 40:
+            c.showPage()
+            y = height - 50
+            c.setFont("Helvetica", 10)
+
+    c.save()
+
+
+STATUS_TAGS = {"ideal": "green", "acceptable": "yellow", "fail": "red"}
+
+
+def write_matrix_pdf(file_path: str, matrix) -> None:
+    """
+    PDF de una planmatrix.ConstraintMatrix: una fila por constraint y una columna por plan con el
+    valor coloreado segun el estado, mas los mejores planes de cada fila.
+    """
+    from reportlab.lib.pagesizes import landscape, letter
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+
+    c = canvas.Canvas(file_path, pagesize=landscape(letter))
+    width, height = landscape(letter)
+    structure_width, constraint_width, best_width = 110, 190, 90
+    plan_width = (width - 80 - structure_width - constraint_width - best_width) / max(len(matrix.labels), 1)
+
+    def header():
+        y = height - 50
+        try:
+            logo_path = resource_path(os.path.join("images", "logo_intecnus.png"))
+            c.drawImage(logo_path, 40, height - 110, width=100, preserveAspectRatio=True, mask='auto')
+        except Exception as e:
+            print("No se pudo cargar el logo:", e)
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(160, y, "Comparación de planes")
+        c.setFont("Helvetica", 11)
+        c.drawString(160, y - 20, f"Protocolo: {matrix.prescription.presc_template_name}")
+        c.drawString(160, y - 36, f"Paciente ID: {matrix.patient_id}")
+        c.drawString(160, y - 52, f"Fecha de generación: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+        y -= 90
+        c.setFont("Helvetica-Bold", 9)
+        x = 40 + structure_width + constraint_width
+        c.drawString(40, y, "Estructura")
+        c.drawString(40 + structure_width, y, "Constraint")
+        for label in matrix.labels:
+            c.drawString(x, y, label[:int(plan_width / 5)])
+            x += plan_width
+        c.drawString(x, y, "Mejor")
+        c.line(40, y - 4, width - 40, y - 4)
+        c.setFont("Helvetica", 9)
+        return y - 16
+
+    y = header()
+    for row in matrix.rows:
+        if y < 40:
+            c.showPage()
+            y = header()
+        c.setFillColor(colors.black)
+        c.drawString(40, y, row['structure'])
+        c.drawString(40 + structure_width, y, matrix.constraint_text(row['constraint']))
+        x = 40 + structure_width + constraint_width
+        for result in row['cells']:
+            if result is None:
+                c.setFillColor(colors.grey)
+                c.drawString(x, y, "-")
+            else:
+                c.setFillColor(getattr(colors, PDF_COLORS[STATUS_TAGS[result.status]]))
+                c.drawString(x, y, f"{result.ideal[1]}")
+            x += plan_width
+        c.setFillColor(colors.black)
+        c.drawString(x, y, ', '.join(matrix.labels[i] for i in row['best'])[:int(best_width / 4)])
+        y -= 14
+
+    c.save()
+
+
+SUMMARY_FIELDS = ['file', 'patient_id', 'plan_name', 'date_and_time', 'protocol', 'structure', 'constraint_type',
+                  'ideal_dose', 'ideal_volume', 'acceptable_dose', 'acceptable_volume', 'status', 'value', 'error']
+
+
+def summary_rows(evaluation) -> List[dict]:
+    """
+    Filas planas (una por constraint) de un batch.PlanEvaluation para el resumen CSV.
+    Un DVH ilegible da una fila con status 'error' y cada estructura faltante una con 'missing'.
+    """
+    plan = {'file': evaluation.file_path, 'patient_id': evaluation.patient_id, 'plan_name': evaluation.plan_name,
+            'date_and_time': evaluation.date_and_time, 'protocol': evaluation.prescription.presc_template_name}
+    if evaluation.error is not None:
+        return [dict(plan, status='error', error=evaluation.error)]
+
+    rows = [dict(plan, structure=name, status='missing') for name in evaluation.missing_structures]
+    for name, results in evaluation.results.items():
+        for result in results:
+            constraint = result.constraint
+            rows.append(dict(plan, structure=name, constraint_type=str(constraint.type),
+                             ideal_dose=reference_text(constraint.ideal_dose), ideal_volume=reference_text(constraint.ideal_volume),
+                             acceptable_dose=reference_text(constraint.acceptable_dose), acceptable_volume=reference_text(constraint.acceptable_volume),
+                             status=result.status, value=result.value))
+    return rows
+
+
+def summary_record(evaluation) -> dict:
+    """
+    Registro JSON (una linea por plan y protocolo) de un batch.PlanEvaluation.
+    """
+    rows = summary_rows(evaluation)
+    plan_fields = ('file', 'patient_id', 'plan_name', 'date_and_time', 'protocol')
+    record = {field: rows[0][field] for field in plan_fields}
+    record['passed'] = evaluation.passed
+    record['error'] = evaluation.error
+    record['missing_structures'] = list(evaluation.missing_structures)
+    record['constraints'] = [{k: v for k, v in row.items() if k not in plan_fields and k != 'error'}
+                             for row in rows if row['status'] not in ('error', 'missing')]
+    return record
+
+
+class SummaryWriter:
+    """
+    Escribe el resumen de un batch a medida que llegan los resultados: CSV (una fila por
+    constraint) si el archivo termina en .csv, si no JSON lines (una linea por plan).
+    """
+    def __init__(self, file_path: str, append: bool = False):
+        self.file_path = file_path
+        self.csv = file_path.lower().endswith('.csv')
+        write_header = not (append and os.path.exists(file_path) and os.path.getsize(file_path) > 0)
+        self._file = open(file_path, 'a' if append else 'w', encoding='utf-8', newline='')
+        if self.csv:
+            self._writer = csv.DictWriter(self._file, fieldnames=SUMMARY_FIELDS)
+            if write_header:
+                self._writer.writeheader()
+
+    def write(self, evaluation) -> None:
+        if self.csv:
+            self._writer.writerows(summary_rows(evaluation))
+        else:
+            self._file.write(json.dumps(summary_record(evaluation), ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
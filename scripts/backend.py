@@ -152,7 +152,7 @@ class Constraint:
         self.structure_name = self.structure_name.upper()
         self.VERIFIED_IDEAL = (False, 0.0)
         self.VERIFIED_ACCEPTABLE = (False, 0.0)
-        self.ACCEPTABLE_LV_AVAILABLE = self.acceptable_dose != 'None'
+        self.ACCEPTABLE_LV_AVAILABLE = self.acceptable_dose is not None
 
     def _evaluate(self, structure, ref1, ref2):   #ref1 y ref2 despues podran ser contraint ideal o aceptable
         constraint_types = ['V(D)>V_%', 'V(D)>V_cc', 'V(D)<V_%', 'V(D)<V_cc', 'D(V_%)<D', 'D(V_cc)<D', 'Dmax', 'Dmedia']
@@ -239,27 +239,29 @@ class Prescription:
 
         for constraint_chart_line in constraints_chart:
             new_structure_name = constraint_chart_line[0]
-            if new_structure_name != 'None':
-                structure_name = new_structure_name.upper()
+            if new_structure_name is not None:
+                structure_name = str(new_structure_name).upper()
                 self.structures[structure_name] = []
-                self.structures[structure_name].append(Constraint(constraint_chart_line))
-            else:
-                self.structures[structure_name].append(Constraint(constraint_chart_line))   
+            self.structures[structure_name].append(Constraint([structure_name] + list(constraint_chart_line[1:])))
 
             
     def _prescription_importer(self):
         workbook = openpyxl.load_workbook(self.constraint_excel_filepath)
         # for name in workbook.sheetnames:
         #     print(name)
-        excel_data = xlstools.cell_data_importer(open_workbook(self.constraint_excel_filepath, self.presc_template_name),
-                                                (4,'A'), 
-                                                (45,'G'))
+        sheet = open_workbook(self.constraint_excel_filepath, self.presc_template_name)
+        try:
+            excel_data = xlstools.cell_data_importer(sheet,
+                                                    (4,'A'), 
+                                                    (45,'G'))
+        finally:
+            sheet.parent.close()
 
         chunks_charts = xlstools.none_based_data_parser(excel_data)
 
         assert len(chunks_charts)==2, "Error de importacion de chunks. Numero de chunks: "+f'{len(chunks_charts)}'
         if len(chunks_charts)==2:
-            constraints_chart = [chunks_charts[0][1:], chunks_charts[1][2:]]
+            constraints_chart = [chunks_charts[0][1:], chunks_charts[1][1:]]
 
         return constraints_chart
 
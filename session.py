@@ -0,0 +1,149 @@
+import os
+import threading
+from collections import OrderedDict
+
+from backend import DVH, PackedStructures, Prescription, load_mapping_and_volumes_if_exists
+
+DEFAULT_MAX_PRESCRIPTIONS = 16
+DEFAULT_MAX_DVHS = 8
+DEFAULT_MAX_DVH_BYTES = 256 * 1024 * 1024  # 256 MB
+DVH_LOAD_LOCKS = 16   # locks repartidos por archivo: se leen varios DVHs a la vez, cada uno una sola vez
+
+
+def dvh_nbytes(dvh) -> int:
+    """
+    Memoria aproximada de un DVH: arrays de las estructuras ya parseadas + el buffer si es lazy
+    (o los buffers compartidos si es un PackedStructures)
+    """
+    structures = dvh.structures
+    packed = isinstance(structures, PackedStructures)
+    total = structures.nbytes if packed else 0
+    buffer = getattr(structures, '_buffer', None)
+    if buffer is not None:
+        total += len(buffer)
+    for key in structures:
+        if hasattr(structures, 'is_loaded') and not structures.is_loaded(key):
+            continue
+        structure = structures[key]
+        if not packed:
+            total += structure.dose_axis.nbytes + structure.cumulated_volume_axis.nbytes
+        total += structure.derived_nbytes
+    return total
+
+
+class LRUCache:
+    """
+    Dict acotado por cantidad de elementos y (opcionalmente) por bytes: al pasarse se
+    descartan los usados hace mas tiempo. sizeof(valor) da el tamaño de cada elemento.
+    """
+    def __init__(self, max_items: int, max_bytes: int = None, sizeof=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._items = OrderedDict()   # {clave: (valor, bytes)}
+        self.nbytes = 0
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value) -> None:
+        self.discard(key)
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        self._items[key] = (value, size)
+        self.nbytes += size
+        while len(self._items) > self.max_items or (self.max_bytes is not None and self.nbytes > self.max_bytes
+                                                    and len(self._items) > 1):
+            _, (_, old_size) = self._items.popitem(last=False)
+            self.nbytes -= old_size
+
+    def discard(self, key) -> None:
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DosePoliceSession:
+    """
+    Estado que vive mientras la aplicacion esta abierta, para que "Elegir nuevo DVH..." no
+    empiece de cero: prescripciones y DVHs ya leidos (LRU acotados) y el ultimo mapeo de
+    estructuras usado para cada plan y protocolo.
+
+    Las prescripciones son de solo lectura y se comparten. De los DVHs se guarda una copia
+    sin remapear y dvh() devuelve siempre una copia nueva (ver DVH.copy).
+    prescription() y dvh() se pueden llamar desde hilos de fondo (background.BackgroundTasks).
+    """
+    def __init__(self, excel_path: str, protocol_store=None, dvh_cache=None,
+                 max_prescriptions: int = DEFAULT_MAX_PRESCRIPTIONS, max_dvhs: int = DEFAULT_MAX_DVHS,
+                 max_dvh_bytes: int = DEFAULT_MAX_DVH_BYTES):
+        self.excel_path = excel_path
+        self.protocol_store = protocol_store
+        self.dvh_cache = dvh_cache
+        self.prescriptions = LRUCache(max_prescriptions)
+        self.dvhs = LRUCache(max_dvhs, max_dvh_bytes, sizeof=dvh_nbytes)
+        self._prescriptions_lock = threading.Lock()
+        self._dvhs_lock = threading.Lock()
+        self._dvh_load_locks = [threading.Lock() for _ in range(DVH_LOAD_LOCKS)]
+        self._mappings = {}   # {(clave_dvh, protocolo): (name_mapping, volume_mapping, ignored_structures)}
+
+    def _excel_version(self):
+        if self.protocol_store is not None:
+            return self.protocol_store.content_hash()
+        return os.stat(self.excel_path).st_mtime_ns
+
+    @staticmethod
+    def dvh_key(file_path: str) -> tuple:
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+    def prescription(self, protocol_name: str) -> Prescription:
+        key = (protocol_name.upper(), self._excel_version())
+        with self._prescriptions_lock:
+            presc = self.prescriptions.get(key)
+            if presc is None:
+                presc = Prescription(self.excel_path, protocol_name, store=self.protocol_store)
+                self.prescriptions.put(key, presc)
+        return presc
+
+    def dvh(self, file_path: str) -> DVH:
+        """
+        DVH listo para remapear. Si el archivo no cambio desde la ultima vez no se vuelve a leer.
+        Con dvh_cache el DVH sale del cache (cache gana sobre lazy, ver DVH); sin cache es lazy.
+        """
+        key = self.dvh_key(file_path)
+        # El mismo archivo cae siempre en el mismo lock: evita parsearlo dos veces (precarga + seleccion)
+        with self._dvh_load_locks[hash(key) % DVH_LOAD_LOCKS]:
+            with self._dvhs_lock:
+                dvh = self.dvhs.get(key)
+            if dvh is None:
+                dvh = DVH(file_path, lazy=True, cache=self.dvh_cache)
+                with self._dvhs_lock:
+                    self.dvhs.put(key, dvh)
+            return dvh.copy()
+
+    def remember_mapping(self, dvh, protocol_name: str, name_mapping: dict, volume_mapping: dict,
+                         ignored_structures: list) -> None:
+        key = (self.dvh_key(dvh.file_path), protocol_name.upper())
+        self._mappings[key] = (dict(name_mapping or {}), dict(volume_mapping or {}), list(ignored_structures or []))
+
+    def last_mapping(self, dvh, protocol_name: str) -> tuple:
+        """
+        (name_mapping, volume_mapping, ignored_structures) usado antes con este plan y protocolo;
+        si no hay, el mapeo guardado en disco para el plan (sin estructuras ignoradas).
+        """
+        key = (self.dvh_key(dvh.file_path), protocol_name.upper())
+        if key in self._mappings:
+            return self._mappings[key]
+        name_mapping, volume_mapping = load_mapping_and_volumes_if_exists(dvh)
+        return name_mapping or {}, volume_mapping or {}, []
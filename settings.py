@@ -0,0 +1,21 @@
+import os
+import sys
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, relative_path)
+
+# Define the paths for the NAS directory and the Excel file
+NAS_directory = resource_path("//FS-201-Radioterapia.intecnus.org.ar/")
+constraint_excel_file_path = resource_path(NAS_directory + "fisicos/8 - Físicos Médicos/Natalia Espector/2024 - Protocolos clínicos/Protocolo de constraints.xlsx")
+dvh_folder_path = resource_path(NAS_directory + "monaco/FocalData/DVH Output/")
+results_folder_path = resource_path(NAS_directory + "fisicos/2 - Pacientes/0 - REPORTES/REPORTES DVH/")
+
+def local_data_dir():
+    """ Carpeta local (no el NAS) para caches: %LOCALAPPDATA%/DosePolice o ~/.cache/DosePolice """
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'DosePolice')
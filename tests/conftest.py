@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+EXAMPLES_DIR = os.path.join(REPO_DIR, 'ejemplos_dvh')
+EXAMPLE_DVHS = sorted(os.path.join(EXAMPLES_DIR, name) for name in os.listdir(EXAMPLES_DIR) if name.endswith('.txt'))
+
+
+@pytest.fixture(params=EXAMPLE_DVHS, ids=os.path.basename)
+def example_dvh(request):
+    """ Ruta de cada DVH de ejemplos_dvh/ """
+    return request.param
+
+
+@pytest.fixture
+def prostate_dvh():
+    """ DVH de prostata (recto, vejiga, femures, PTV_PR, ...) de ejemplos_dvh/ """
+    return os.path.join(EXAMPLES_DIR, '68216079_PrmVsVMAT_DVH_1.txt')
+
+
+PROTOCOL = 'PROSTATA 6000-20FX'
+# Para el DVH de prostata: (estructura o None si sigue la anterior, tipo, dosis/vol ideal, dosis/vol aceptable)
+PROTOCOL_TARGETS = [('PTV_PR', 6000, 300), ('PTV_VS', 5600, 280)]
+PROTOCOL_ROWS = [
+    ('RECTO', 'V(D)<V_%', 4000, 35, 4000, 40), (None, 'V(D)<V_cc', 6500, 1, None, None), (None, 'Dmax', 6000, None, 6200, None),
+    ('VEJIGA', 'V(D)<V_%', 4000, 35, 4000, 50), (None, 'Dmedia', 1000, None, 1200, None),
+    ('BULBO_PENEANO', 'Dmedia', 500, None, 700, None), (None, 'D(V_%)<D', 90, 500, 90, 800),
+    ('FEMUR_D', 'D(V_cc)<D', 10, 2000, 10, 3000),
+    ('SIGMA', 'Dmax', 2000, None, 2500, None),
+    ('PTV_PR', 'V(D)>V_%', 5700, 95, 5600, 95), (None, 'D(V_%)<D', 2, 6300, 2, 6420),
+]
+
+
+@pytest.fixture(scope='session')
+def protocol_workbook(tmp_path_factory):
+    """ Excel de protocolos con PROTOCOL (ver benchmarks/synthetic_dvh.write_protocol_workbook) """
+    from synthetic_dvh import write_protocol_workbook
+    path = str(tmp_path_factory.mktemp('protocolos') / 'protocolos.xlsx')
+    write_protocol_workbook(path, {PROTOCOL: (PROTOCOL_TARGETS, PROTOCOL_ROWS)})
+    return path
+
+
+@pytest.fixture(autouse=True)
+def local_data_dir(tmp_path, monkeypatch):
+    """ Carpeta local propia de cada test (mapeos, cache, protocolos compilados) """
+    monkeypatch.setenv('LOCALAPPDATA', str(tmp_path / 'local'))
+    return tmp_path / 'local'
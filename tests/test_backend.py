@@ -0,0 +1,243 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from backend import CONSTRAINT_TYPES, DVH, Constraint, ConstraintPlan, DVHParseError, Structure, round_value
+from dvhcache import DVHCache
+
+
+def legacy_parse(file_path):
+    """
+    Parser original (readlines + split por 20 espacios), como referencia:
+    (patient_id, plan_name, date_and_time, {clave: (label, dosis, volumen)})
+    """
+    with open(file_path, 'r', encoding='latin-1') as file:
+        data = file.readlines()
+    header = data[0]
+    data_dict = {}
+    for row in data[3:-3]:
+        row = row.replace('\n', '').split('                    ')
+        data_dict.setdefault(row[0], []).append([float(row[1]), float(row[2])])
+
+    structures = {}
+    for key, rows in data_dict.items():
+        dose, volume = np.array(rows).T
+        if key.lower() in ['camilla', 'espuma', 'isoctsim', 'isoautocontour', 'encastre', 'body', 'external']:
+            continue
+        structures['PACIENTE' if key.lower() == 'paciente(unsp.tiss.)' else key.upper()] = (key.upper(), dose, volume)
+    return header.split(' ')[2], header.split(' ')[6], data[-1].strip(), structures
+
+
+def load(file_path, mode, tmp_path):
+    if mode == 'cache':
+        DVH(file_path, cache=DVHCache(str(tmp_path)))   # primera lectura: guarda
+        return DVH(file_path, cache=DVHCache(str(tmp_path)))
+    return DVH(file_path, lazy=mode == 'lazy')
+
+
+def write_export(file_path, runs, blank='', separator=' ' * 20):
+    """ Exportacion con el formato de Monaco; runs = [(label, n_filas), ...] en el orden del archivo """
+    lines = ['Patient ID: 1~123 | Plan Name: Prueba | Resolution: 0.10(cm) | Bin Width: 1.0(cGy)', blank,
+             'Structure Name |                     Dose |                     Volume']
+    for label, n_rows in runs:
+        offset = sum(n for other, n in runs[:runs.index((label, n_rows))] if other == label)
+        lines += [f'{label}{separator}{offset + row:.1f}{separator}{100.0 - offset - row:.3f}' for row in range(n_rows)]
+    lines += [blank, blank, '2025-11-13-Thu  12:37:34']
+    with open(file_path, 'w', encoding='latin-1', newline='') as file:
+        file.write('\r\n'.join(lines))
+
+
+def assert_same_structures(dvh, other):
+    assert list(dvh.structures) == list(other.structures)
+    for key, structure in dvh.structures.items():
+        assert structure.label == other.structures[key].label
+        np.testing.assert_array_equal(structure.dose_axis, other.structures[key].dose_axis)
+        np.testing.assert_array_equal(structure.cumulated_volume_axis, other.structures[key].cumulated_volume_axis)
+
+
+def sloped_midpoints(structure):
+    """ (dosis, volumen) en la mitad de cada tramo con volumen estrictamente decreciente """
+    dose, volume = structure.dose_axis, structure.cumulated_volume_axis
+    sloped = np.flatnonzero((volume[:-1] > volume[1:]) & (dose[:-1] < dose[1:]))
+    return (dose[sloped] + dose[sloped + 1]) / 2, (volume[sloped] + volume[sloped + 1]) / 2
+
+
+MODES = ['eager', 'lazy', 'cache']
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_parser_matches_legacy(example_dvh, mode, tmp_path):
+    patient_id, plan_name, date_and_time, expected = legacy_parse(example_dvh)
+    dvh = load(example_dvh, mode, tmp_path)
+
+    assert (dvh.patient_id, dvh.plan_name, dvh.date_and_time) == (patient_id, plan_name, date_and_time)
+    assert list(dvh.structures) == list(expected)
+    for key, (label, dose, volume) in expected.items():
+        structure = dvh.structures[key]
+        assert structure.label == label
+        np.testing.assert_array_equal(structure.dose_axis, dose)
+        np.testing.assert_array_equal(structure.cumulated_volume_axis, volume)
+        assert structure.volume == volume[0]
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_unreadable_file_raises_parse_error(mode, tmp_path):
+    garbage = tmp_path / 'garbage.txt'
+    garbage.write_text('garbage\n')
+    with pytest.raises(DVHParseError):
+        load(str(garbage), mode, tmp_path / 'cache')
+    with pytest.raises(DVHParseError, match='no fue encontrado'):
+        load(str(tmp_path / 'missing.txt'), mode, tmp_path / 'cache')
+
+
+@pytest.mark.parametrize('runs', [
+    [('Recto', 3), ('Vejiga', 2), ('Recto', 3)],                   # la busqueda encuentra la segunda corrida
+    [('Recto', 5), ('Vejiga', 1), ('Recto', 15), ('Sigma', 3)],    # la busqueda salta por encima de Vejiga
+    [('Recto', 2), ('Vejiga', 4), ('Sigma', 1), ('Vejiga', 9), ('Recto', 1)],
+], ids=['contigua', 'salteada', 'varias'])
+def test_lazy_merges_non_contiguous_runs_like_eager(runs, tmp_path):
+    path = str(tmp_path / 'dvh.txt')
+    write_export(path, runs)
+    eager, lazy = DVH(path), DVH(path, lazy=True)
+    assert_same_structures(lazy, eager)
+    assert len(eager.structures['RECTO'].dose_axis) == sum(n for label, n in runs if label == 'Recto')
+
+
+def test_whitespace_only_lines_are_blank(tmp_path):
+    path = str(tmp_path / 'dvh.txt')
+    write_export(path, [('Recto', 4), ('Vejiga', 3)], blank='    \t ')
+    eager, lazy = DVH(path), DVH(path, lazy=True)
+    assert_same_structures(lazy, eager)
+    assert lazy.date_and_time == '2025-11-13-Thu  12:37:34'
+    assert list(lazy.structures) == ['RECTO', 'VEJIGA']
+
+
+def test_volume_and_dose_at_match_legacy_interpolation(example_dvh):
+    interp1d = pytest.importorskip('scipy.interpolate').interp1d
+    rng = np.random.default_rng(0)
+    for structure in DVH(example_dvh).structures.values():
+        dose, volume = structure.dose_axis, structure.cumulated_volume_axis
+        doses = np.concatenate((rng.uniform(-100, dose[-1] + 100, 200), dose[::7]))
+        legacy = interp1d(dose, volume, bounds_error=False, fill_value=(volume[0], volume[-1]))
+        np.testing.assert_allclose(structure.volume_at(doses), legacy(doses), rtol=0, atol=1e-9)
+
+        # D(V) es ambigua en las mesetas; en los tramos con pendiente tiene que dar lo mismo que antes
+        mid_doses, mid_volumes = sloped_midpoints(structure)
+        np.testing.assert_allclose(structure.dose_at(mid_volumes), mid_doses, rtol=0, atol=1e-6)
+        assert structure.volume_function(float(doses[0])) == round(float(legacy(doses[0])), 1)
+
+
+def test_dose_at_plateau_and_out_of_range():
+    structure = Structure('X', np.array([0.0, 10.0, 20.0, 30.0, 40.0]), np.array([5.0, 4.0, 4.0, 4.0, 0.0]))
+    assert structure.dose_at(4.0) == 30.0
+    # fuera de la curva, el mismo relleno que el interp1d original: (dosis inicial, dosis final)
+    assert structure.dose_at(6.0) == 40.0
+    assert structure.dose_at(-1.0) == 0.0
+
+
+def constraint_grid(structure):
+    """ Constraints de todos los tipos con referencias dentro y fuera de la curva """
+    max_dose = float(structure.dose_axis[-1])
+    doses = [round(x, 1) for x in np.linspace(0, max_dose * 1.1, 12)] + [float(d) for d in structure.dose_axis[::max(1, len(structure.dose_axis) // 10)]]
+    percents = [1, 2, 5, 10, 25, 50, 90, 95, 99.5]
+    ccs = [0.03, 0.5, 1, round(float(structure.volume) / 3, 2), float(structure.volume)]
+
+    lines = []
+    for dose in doses:
+        for kind, limits in (('V(D)>V_%', percents), ('V(D)<V_%', percents), ('V(D)>V_cc', ccs), ('V(D)<V_cc', ccs)):
+            for limit in limits[::3]:
+                lines.append(('X', kind, float(dose), float(limit), float(dose), float(limit * 1.5)))
+        lines.append(('X', 'Dmax', float(dose), None, float(dose * 1.05), None))
+        lines.append(('X', 'Dmedia', float(dose), None, None, None))
+    for percent in percents:
+        lines.append(('X', 'D(V_%)<D', float(percent), float(max_dose / 2), float(percent), float(max_dose * 0.8)))
+    for cc in ccs:
+        lines.append(('X', 'D(V_cc)<D', float(cc), float(max_dose / 2), None, None))
+    lines.append(('X', 'Dmin', 100.0, None, None, None))   # tipo desconocido
+    return [Constraint(line) for line in lines]
+
+
+@pytest.mark.filterwarnings('ignore:No existe el tipo de constraint')
+def test_compiled_constraints_match_legacy(example_dvh):
+    for structure in DVH(example_dvh).structures.values():
+        constraints = constraint_grid(structure)
+        assert {c.type for c in constraints} >= set(CONSTRAINT_TYPES)
+        for constraint, compiled in zip(constraints, ConstraintPlan(constraints).verify(structure)):
+            legacy = constraint.verify(structure)
+            assert (compiled.ideal, compiled.acceptable) == (legacy.ideal, legacy.acceptable), (constraint.type, constraint.ideal_dose)
+            assert compiled.status == legacy.status
+
+
+def test_compiled_constraints_match_legacy_on_ties():
+    # Filas justo en x.x5: donde el redondeo de numpy (escala por 10) y round() difieren
+    structure = Structure('X', np.array([0.0, 1000.25, 2000.35, 4122.15, 5000.0]),
+                          np.array([20.0, 2.675, 1.05, 0.03, 0.0]))
+    constraints = [Constraint(line) for line in [
+        ('X', 'V(D)<V_cc', 1000.25, 2.0, 1000.25, 3.0),
+        ('X', 'V(D)<V_cc', 2000.35, 1.0, 2000.35, 2.0),
+        ('X', 'V(D)<V_%', 1000.25, 10.0, 1000.25, 20.0),
+        ('X', 'D(V_cc)<D', 1.05, 2000.0, 1.05, 2000.3),
+        ('X', 'Dmax', 4000.0, None, 4122.1, None),
+    ]]
+    compiled = ConstraintPlan(constraints).verify(structure)
+    assert [(r.ideal, r.acceptable) for r in compiled] == [(c.verify(structure).ideal, c.verify(structure).acceptable) for c in constraints]
+    assert compiled[-1].value == 4122.1
+
+
+def test_round_value_is_python_round():
+    assert round_value(4122.15) == 4122.1        # el binario de 4122.15 esta por debajo de la mitad
+    assert np.round(4122.15, 1) == 4122.2         # np.round escala por 10 antes de redondear
+    values = np.array([[4122.15, 0.25], [2.675, -1.05]])
+    np.testing.assert_array_equal(round_value(values), [[round(v, 1) for v in row] for row in values.tolist()])
+    np.testing.assert_array_equal(round_value(values.T), [[round(v, 1) for v in row] for row in values.T.tolist()])
+    assert isinstance(round_value(np.float64(1.26)), float)
+
+    # valores al azar y justo en x.x5, en el rango de dosis y volumenes
+    rng = np.random.default_rng(0)
+    values = np.concatenate((rng.uniform(-100, 7000, 100000), np.arange(140000) * 0.05))
+    np.testing.assert_array_equal(round_value(values), [round(v, 1) for v in values.tolist()])
+
+
+def test_non_numeric_reference_raises(prostate_dvh):
+    structure = DVH(prostate_dvh).structures['RECTO']
+    bad = Constraint(('RECTO', 'V(D)<V_%', '40 Gy', 35.0, None, None))
+    with pytest.raises(ValueError):
+        bad.verify(structure)
+    with pytest.raises(ValueError, match='no numerico'):
+        ConstraintPlan([bad]).evaluate(structure)
+
+    # el nivel aceptable vacio no se evalua, no es un error
+    fine = Constraint(('RECTO', 'Dmax', 100000.0, None, None, None))
+    assert ConstraintPlan([fine]).verify(structure)[0].status == fine.verify(structure).status == 'ideal'
+
+
+def test_non_numeric_acceptable_reference_only_raises_if_ideal_fails(prostate_dvh):
+    structure = DVH(prostate_dvh).structures['RECTO']
+    passes = Constraint(('RECTO', 'Dmax', 100000.0, None, 'abc', None))
+    assert passes.verify(structure).status == 'ideal'
+    assert ConstraintPlan([passes]).verify(structure)[0].status == 'ideal'
+    assert ConstraintPlan([passes]).evaluate(structure)[0][0].tolist() == [True, False]
+
+    fails = Constraint(('RECTO', 'Dmax', 100.0, None, 'abc', None))
+    with pytest.raises(ValueError):
+        fails.verify(structure)
+    with pytest.raises(ValueError, match='no numerico'):
+        ConstraintPlan([passes, fails]).verify(structure)
+
+
+def test_unknown_constraint_type_warns_once_when_compiled(prostate_dvh, capsys):
+    structure = DVH(prostate_dvh).structures['RECTO']
+    constraints = [Constraint(('RECTO', kind, 100000.0, None, None, None)) for kind in ('Dmin', 'Dmax', 'Dmin', 'D2cc')]
+    with pytest.warns(UserWarning) as record:
+        plan = ConstraintPlan(constraints)
+    assert [str(w.message) for w in record] == [
+        "No existe el tipo de constraint 'Dmin' en la lista de tipos de constraints.",
+        "No existe el tipo de constraint 'D2cc' en la lista de tipos de constraints."]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        results = plan.verify(structure)
+    assert [r.status for r in results] == ['fail', 'ideal', 'fail', 'fail']
+    assert results[0].ideal == (False, 'None')
+    assert capsys.readouterr().out == ''
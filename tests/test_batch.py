@@ -0,0 +1,81 @@
+import os
+import shutil
+
+import pytest
+
+from backend import Prescription
+from batch import BatchEvaluator, evaluate_batch, iter_batch
+from conftest import EXAMPLES_DIR, PROTOCOL
+
+BREAST_DVH = os.path.join(EXAMPLES_DIR, '12616855_VMI_DVH_1.txt')
+
+
+@pytest.fixture
+def prescription(protocol_workbook):
+    return Prescription(protocol_workbook, PROTOCOL)
+
+
+@pytest.fixture
+def dvh_paths(tmp_path, prostate_dvh):
+    """ Dos copias del DVH de prostata, uno de mama (sin las estructuras del protocolo) y uno ilegible """
+    paths = []
+    for name, source in (('a.txt', prostate_dvh), ('b.txt', prostate_dvh), ('c.txt', BREAST_DVH)):
+        paths.append(str(tmp_path / name))
+        shutil.copyfile(source, paths[-1])
+    paths.append(str(tmp_path / 'roto.txt'))
+    (tmp_path / 'roto.txt').write_text('garbage\n')
+    return paths
+
+
+def expected_results(dvh_path, prescription):
+    from backend import DVH
+    dvh = DVH(dvh_path)
+    return {name: [(r.ideal, r.acceptable) for r in plan.verify(dvh.structures[name])]
+            for name, plan in prescription.compiled().items() if name in dvh.structures}
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_evaluate_batch(dvh_paths, prescription, prostate_dvh, max_workers):
+    evaluations = evaluate_batch(dvh_paths, [prescription], max_workers=max_workers)
+    assert [e.file_path for e in evaluations] == dvh_paths
+
+    expected = expected_results(prostate_dvh, prescription)
+    for evaluation in evaluations[:2]:
+        assert evaluation.error is None and evaluation.missing_structures == []
+        assert evaluation.plan_name == 'PrmVsVMAT'
+        assert {name: [(r.ideal, r.acceptable) for r in results] for name, results in evaluation.results.items()} == expected
+        assert all(r.constraint in prescription.structures[name] for name, results in evaluation.results.items() for r in results)
+        assert evaluation.passed == all(r.status != 'fail' for results in evaluation.results.values() for r in results)
+
+    assert evaluations[2].missing_structures == list(prescription.structures) and not evaluations[2].passed
+    assert 'roto.txt' in evaluations[3].error and evaluations[3].results == {} and not evaluations[3].passed
+
+
+def test_ignored_structures_are_not_evaluated(dvh_paths, prescription):
+    evaluation, = evaluate_batch(dvh_paths[:1], [prescription], max_workers=1, ignored_structures=['SIGMA'])
+    assert 'SIGMA' not in evaluation.results and 'RECTO' in evaluation.results
+
+
+def test_mappings_rename_structures_before_evaluating(dvh_paths, prescription):
+    # El recto del DVH evaluado como si fuera la vejiga del protocolo
+    mapping = {'RECTO': 'VEJIGA', 'VEJIGA': 'OTRA'}
+    plain, mapped = evaluate_batch(dvh_paths[:2], [prescription], max_workers=1, mappings={dvh_paths[1]: mapping})
+    assert mapped.results['VEJIGA'][0].value == plain.results['RECTO'][0].value
+
+
+def test_batch_evaluator_keeps_pool_between_calls(dvh_paths, prescription):
+    with BatchEvaluator([prescription], max_workers=2) as evaluator:
+        first = sorted(e.file_path for e in evaluator.iter(dvh_paths[:2]))
+        executor = evaluator._executor
+        second = sorted(e.file_path for e in evaluator.iter(dvh_paths[1:2]))
+        assert executor is not None and evaluator._executor is executor
+    assert evaluator._executor is None
+    assert first == sorted(dvh_paths[:2]) and second == dvh_paths[1:2]
+
+
+def test_iter_batch_with_cache(dvh_paths, prescription, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    first = evaluate_batch(dvh_paths[:1], [prescription], max_workers=1, cache_dir=cache_dir)
+    second = list(iter_batch(dvh_paths[:1], [prescription], max_workers=1, cache_dir=cache_dir))
+    assert list((tmp_path / 'cache').glob('*.npz'))
+    assert [(r.ideal, r.acceptable) for r in first[0].results['RECTO']] == [(r.ideal, r.acceptable) for r in second[0].results['RECTO']]
@@ -0,0 +1,72 @@
+import csv
+import json
+import os
+import shutil
+
+import pytest
+
+import cli
+from backend import DVH, get_temp_json_path, load_mapping_and_volumes_if_exists, save_mapping_and_volumes
+from conftest import PROTOCOL
+
+
+@pytest.fixture
+def dvh_folder(tmp_path, prostate_dvh):
+    folder = tmp_path / 'DVH Output'
+    folder.mkdir()
+    for name in ('plan_a.txt', 'plan_b.txt'):
+        shutil.copyfile(prostate_dvh, folder / name)
+    return folder
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_main_writes_summary_and_matrix(dvh_folder, protocol_workbook, tmp_path, capsys):
+    summary, matrix = str(tmp_path / 'resumen.csv'), str(tmp_path / 'matriz.csv')
+    assert cli.main([str(dvh_folder), '-p', PROTOCOL, '--excel', protocol_workbook, '-o', summary,
+                     '--matriz', matrix, '-j', '1']) == 0
+
+    with open(summary, encoding='utf-8') as file:
+        rows = list(csv.DictReader(file))
+    assert {row['file'] for row in rows} == {str(dvh_folder / 'plan_a.txt'), str(dvh_folder / 'plan_b.txt')}
+    assert {row['status'] for row in rows} <= {'ideal', 'acceptable', 'fail'}
+    assert len(rows) == 2 * 11   # 11 constraints en el protocolo de prueba
+    assert os.path.exists(matrix)
+    out = capsys.readouterr().out
+    assert '2 evaluaciones (2 DVH)' in out and '0 con error' in out
+
+
+def test_main_reports_unreadable_files(dvh_folder, protocol_workbook, tmp_path):
+    (dvh_folder / 'roto.txt').write_text('garbage\n')
+    summary = str(tmp_path / 'resumen.jsonl')
+    assert cli.main([str(dvh_folder), '-p', PROTOCOL, '--excel', protocol_workbook, '-o', summary, '-j', '1']) == 1
+    errors = [record for record in read_jsonl(summary) if record['error']]
+    assert [os.path.basename(record['file']) for record in errors] == ['roto.txt']
+
+
+def test_main_empty_folder(tmp_path, protocol_workbook, capsys):
+    assert cli.main([str(tmp_path), '-p', PROTOCOL, '--excel', protocol_workbook]) == 1
+    assert 'No hay archivos .txt' in capsys.readouterr().out
+
+
+def test_mapping_saved_by_gui_is_used_unless_disabled(dvh_folder, protocol_workbook, tmp_path, local_data_dir):
+    dvh = DVH(str(dvh_folder / 'plan_a.txt'))
+    # La GUI guarda {nombre_en_prescripcion: nombre_en_dvh}: el recto del plan como vejiga del protocolo
+    save_mapping_and_volumes(dvh, {'VEJIGA': 'RECTO', 'RECTO': '-'}, {})
+    assert get_temp_json_path(dvh).startswith(str(local_data_dir))
+    assert load_mapping_and_volumes_if_exists(dvh)[0] == {'VEJIGA': 'RECTO', 'RECTO': '-'}
+
+    def bladder_values(*extra):
+        summary = str(tmp_path / 'resumen.jsonl')
+        cli.main([str(dvh_folder), '-p', PROTOCOL, '--excel', protocol_workbook, '-o', summary, '-j', '1', *extra])
+        return [[c['value'] for c in record['constraints'] if c['structure'] == 'VEJIGA'] for record in read_jsonl(summary)]
+
+    rectum = DVH(str(dvh_folder / 'plan_a.txt')).structures['RECTO']
+    expected = round(rectum.volume_at(4000.0) / rectum.volume * 100.0, 1)
+    mapped = bladder_values()
+    assert mapped[0][0] == pytest.approx(expected, abs=0.1)    # ambos planes tienen el mismo plan_name y patient_id
+    assert mapped[0] == mapped[1]
+    assert bladder_values('--sin-mapeos')[0][0] != mapped[0][0]
@@ -0,0 +1,52 @@
+import shutil
+
+import numpy as np
+
+from backend import DVH
+from dvhcache import DVHCache
+
+
+def read(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def test_put_and_get_round_trip(example_dvh, tmp_path):
+    cache = DVHCache(str(tmp_path))
+    assert cache.get(example_dvh) is None
+
+    raw = read(example_dvh)
+    digest = cache.digest(raw)
+    entry = {'patient_id': '1~1', 'plan_name': 'Plan', 'date_and_time': 'hoy', 'names': ['A', 'B'],
+             'offsets': np.array([0, 2, 3]), 'dose': np.array([0.0, 1.0, 0.0]), 'volume': np.array([2.0, 0.0, 1.0])}
+    cache.put(example_dvh, digest, entry)
+
+    cached = cache.get(example_dvh)
+    assert (cached['patient_id'], cached['plan_name'], cached['date_and_time'], cached['names']) == ('1~1', 'Plan', 'hoy', ['A', 'B'])
+    for name in ('offsets', 'dose', 'volume'):
+        np.testing.assert_array_equal(cached[name], entry[name])
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == ['.key', '.npz']   # sin temporales
+
+
+def test_copied_export_is_found_by_content(prostate_dvh, tmp_path):
+    cache = DVHCache(str(tmp_path / 'cache'))
+    original = DVH(prostate_dvh, cache=cache)
+
+    copy_path = str(tmp_path / 'copia.txt')
+    shutil.copyfile(prostate_dvh, copy_path)
+    assert cache.get(copy_path) is None                             # otra ruta: sin alias todavia
+    assert cache.get(copy_path, cache.digest(read(copy_path))) is not None
+    assert cache.get(copy_path) is not None                         # get por contenido escribio el alias
+
+    copied = DVH(copy_path, cache=cache)
+    assert list(copied.structures) == list(original.structures)
+    np.testing.assert_array_equal(copied.structures['RECTO'].cumulated_volume_axis,
+                                  original.structures['RECTO'].cumulated_volume_axis)
+    assert len(list((tmp_path / 'cache').glob('*.npz'))) == 1
+
+
+def test_clear(prostate_dvh, tmp_path):
+    cache = DVHCache(str(tmp_path))
+    DVH(prostate_dvh, cache=cache)
+    cache.clear()
+    assert cache.get(prostate_dvh) is None
@@ -0,0 +1,90 @@
+import csv
+
+import numpy as np
+import pytest
+from conftest import EXAMPLE_DVHS, PROTOCOL
+
+from backend import DVH, Prescription, Structure, actualizar_dvh_con_mapeos
+from dvhcompare import common_keys, compare_plans, write_comparison
+
+
+def linear_plan(dvh, plan_name, max_doses):
+    """ Copia de dvh con estructuras de curva lineal: volumen 10 cc a 0 cGy y 0 cc a max_doses[key] """
+    plan = dvh.copy()
+    plan.plan_name = plan_name
+    plan.structures = {key: Structure(key, np.array([0.0, max_dose]), np.array([10.0, 0.0]))
+                       for key, max_dose in max_doses.items()}
+    return plan
+
+
+def test_area_and_max_difference_of_linear_curves(prostate_dvh):
+    dvh = DVH(prostate_dvh)
+    reference = linear_plan(dvh, 'A', {'RECTO': 1000.0, 'VEJIGA': 2000.0})
+    other = linear_plan(dvh, 'B', {'RECTO': 2000.0, 'VEJIGA': 2000.0})
+    comparison = compare_plans([reference, other])
+
+    assert comparison.keys == ['RECTO', 'VEJIGA']
+    assert comparison.dose_grid[-1] == 2000.0
+    np.testing.assert_array_equal(comparison.difference[0], 0.0)
+    # B - A = 10 (1 - d/2000) - 10 max(0, 1 - d/1000): siempre >= 0, maximo 5 cc en 1000 cGy
+    assert comparison.area[1, 0] == pytest.approx(10 * 2000 / 2 - 10 * 1000 / 2)
+    assert comparison.area[1, 1] == 0.0
+
+    recto, vejiga = comparison.curve_rows()
+    assert recto['plan'] == 'B' and recto['reference_plan'] == 'A'
+    assert recto['max_difference_cc'] == 5.0 and recto['max_difference_percent'] == 50.0
+    assert recto['dose_at_max_difference'] == 1000.0
+    assert recto['area_percent_gy'] == pytest.approx(500.0)   # 5000 cc*cGy de 10 cc, en % * Gy
+    assert vejiga['area_cc_cgy'] == 0.0 and vejiga['max_difference_cc'] == 0.0
+
+
+def test_curves_match_structure_on_the_grid():
+    dvhs = [DVH(path) for path in EXAMPLE_DVHS]
+    dvhs.append(DVH(EXAMPLE_DVHS[0], lazy=True))
+    keys = common_keys(dvhs)
+    assert keys and all(key in dvh.structures for dvh in dvhs for key in keys)
+
+    comparison = compare_plans(dvhs, dose_step=2.5)
+    assert comparison.keys == keys
+    assert comparison.labels[0] != comparison.labels[-1]   # mismo plan_name: se numeran
+    for i, dvh in enumerate(dvhs):
+        for j, key in enumerate(keys):
+            np.testing.assert_allclose(comparison.curves[i, j], dvh.structures[key].volume_at(comparison.dose_grid),
+                                       rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(comparison.area[-1], 0.0)   # la ultima es la referencia leida lazy
+    expected = np.trapezoid(np.abs(comparison.curves[1] - comparison.curves[0]), comparison.dose_grid, axis=-1)
+    np.testing.assert_allclose(comparison.area[1], expected)
+
+
+def test_needs_two_plans(prostate_dvh):
+    with pytest.raises(ValueError):
+        compare_plans([DVH(prostate_dvh)])
+
+
+def test_constraint_differences(prostate_dvh, protocol_workbook, tmp_path):
+    prescription = Prescription(protocol_workbook, PROTOCOL)
+    reference = DVH(prostate_dvh)
+    swapped = DVH(prostate_dvh)
+    swapped.plan_name = 'INTERCAMBIADO'
+    actualizar_dvh_con_mapeos(swapped, {'RECTO': 'VEJIGA', 'VEJIGA': 'RECTO'}, {})
+
+    comparison = compare_plans([reference, swapped])
+    rows = comparison.constraint_rows(prescription)
+    by_plan = {}
+    for row in rows:
+        by_plan.setdefault((row['structure'], row['type'], row['ideal_dose']), {})[row['plan']] = row
+    recto = by_plan[('RECTO', 'V(D)<V_%', '4000')]
+    vejiga = by_plan[('VEJIGA', 'V(D)<V_%', '4000')]
+    reference_label, swapped_label = comparison.labels
+    assert recto[reference_label]['difference'] == 0.0
+    # RECTO del plan intercambiado es la VEJIGA del de referencia
+    assert recto[swapped_label]['value'] == vejiga[reference_label]['value']
+    assert recto[swapped_label]['difference'] == round(vejiga[reference_label]['value'] - recto[reference_label]['value'], 1)
+    assert by_plan[('SIGMA', 'Dmax', '2000')][swapped_label]['difference'] == 0.0
+
+    output = str(tmp_path / 'comparacion.csv')
+    write_comparison(output, comparison, prescription)
+    with open(tmp_path / 'comparacion_constraints.csv', encoding='utf-8', newline='') as f:
+        assert len(list(csv.DictReader(f))) == len(rows)
+    with open(output, encoding='utf-8', newline='') as f:
+        assert len(list(csv.DictReader(f))) == len(comparison.keys)
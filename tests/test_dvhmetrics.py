@@ -0,0 +1,83 @@
+import csv
+import os
+import shutil
+
+import numpy as np
+import pytest
+from conftest import EXAMPLE_DVHS
+
+from backend import DVH
+from dvhmetrics import iter_metrics, main, metrics_table, metrics_tables, parse_grid, write_metrics
+
+DOSES = np.array([-10.0, 0.0, 500.0, 2000.5, 4000.0, 6000.0, 9000.0])
+VOLUME_PERCENTS = np.array([0.5, 2.0, 50.0, 95.0, 98.0, 100.0])
+
+
+def assert_matches_structures(table, dvh):
+    assert table.keys == list(dvh.structures)
+    for i, key in enumerate(table.keys):
+        structure = dvh.structures[key]
+        assert table.volumes[i] == structure.volume
+        np.testing.assert_allclose(table.volume_cc[i], structure.volume_at(DOSES), rtol=0, atol=1e-9)
+        np.testing.assert_allclose(table.volume_percent[i], structure.volume_at(DOSES) / structure.volume * 100.0,
+                                   rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(table.dose[i], structure.dose_at(structure.volume * VOLUME_PERCENTS / 100.0),
+                                   rtol=0, atol=1e-9)
+
+
+def test_metrics_table_matches_structure(example_dvh):
+    dvh = DVH(example_dvh)
+    assert_matches_structures(metrics_table(dvh, DOSES, VOLUME_PERCENTS), dvh)
+
+
+def test_metrics_tables_stack_several_dvhs():
+    dvhs = [DVH(path) for path in EXAMPLE_DVHS] + [DVH(EXAMPLE_DVHS[0], lazy=True)]
+    tables = metrics_tables(dvhs, DOSES, VOLUME_PERCENTS)
+    assert len(tables) == len(dvhs)
+    for table, dvh in zip(tables, dvhs):
+        assert table.file_path == dvh.file_path
+        assert_matches_structures(table, dvh)
+
+
+def test_metrics_table_keys(prostate_dvh):
+    dvh = DVH(prostate_dvh)
+    table = metrics_table(dvh, DOSES, VOLUME_PERCENTS, keys=['VEJIGA', 'RECTO'])
+    assert table.keys == ['VEJIGA', 'RECTO']
+    np.testing.assert_allclose(table.volume_cc[1], dvh.structures['RECTO'].volume_at(DOSES), rtol=0, atol=1e-9)
+
+
+def test_parse_grid():
+    np.testing.assert_array_equal(parse_grid('5:7:1'), [5.0, 6.0, 7.0])
+    np.testing.assert_array_equal(parse_grid('2,50,98'), [2.0, 50.0, 98.0])
+
+
+def test_rows_and_csv(tmp_path, prostate_dvh):
+    dvh = DVH(prostate_dvh)
+    table = metrics_table(dvh, [2000.0, 4000.0], [50.0])
+    assert table.columns() == ['V20Gy[cc]', 'V20Gy[%]', 'V40Gy[cc]', 'V40Gy[%]', 'D50%[cGy]']
+
+    output = str(tmp_path / 'metricas.csv')
+    assert write_metrics(output, [table]) == len(dvh.structures)
+    with open(output, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    recto = next(row for row in rows if row['structure'] == 'RECTO')
+    structure = dvh.structures['RECTO']
+    assert float(recto['V40Gy[cc]']) == pytest.approx(structure.volume_at(4000.0), abs=1e-3)
+    assert float(recto['D50%[cGy]']) == pytest.approx(structure.dose_at(structure.volume / 2), abs=1e-3)
+
+
+def test_iter_metrics_and_main(tmp_path, prostate_dvh):
+    folder = tmp_path / 'dvhs'
+    folder.mkdir()
+    shutil.copy(prostate_dvh, folder / 'a.txt')
+    (folder / 'roto.txt').write_text('no es un DVH\n', encoding='utf-8')
+
+    tables = {os.path.basename(table.file_path): table
+              for table in iter_metrics(sorted(str(path) for path in folder.iterdir()), DOSES, VOLUME_PERCENTS, max_workers=1)}
+    assert tables['roto.txt'].error is not None and tables['roto.txt'].keys == []
+    assert_matches_structures(tables['a.txt'], DVH(prostate_dvh))
+
+    output = str(tmp_path / 'metricas.csv')
+    assert main([str(folder), '-o', output, '--dosis', '20,40', '--volumenes', '50', '-j', '1']) == 1
+    with open(output, encoding='utf-8', newline='') as f:
+        assert len(list(csv.DictReader(f))) == len(DVH(prostate_dvh).structures)
@@ -0,0 +1,74 @@
+import csv
+
+import numpy as np
+import pytest
+from conftest import PROTOCOL
+
+from backend import DVH, MAX_DOSE_ERROR, MAX_VOLUME_ERROR, Prescription, simplify_curve
+from dvhresample import main, verify_resampling, worst_deviation
+
+TOLERANCE = 1 + 1e-9
+
+
+def test_simplify_keeps_the_error_bound(example_dvh):
+    original = DVH(example_dvh)
+    simplified = original.copy().simplify()
+    rows = verify_resampling(original, simplified)
+    assert [row['structure'] for row in rows] == list(original.structures)
+    for row in rows:
+        assert row['resampled_rows'] <= row['rows']
+        assert row['max_volume_error_cc'] <= MAX_VOLUME_ERROR * TOLERANCE, row['structure']
+        assert row['max_dose_error_cgy'] <= MAX_DOSE_ERROR * TOLERANCE, row['structure']
+        assert row['mean_error_cgy'] <= MAX_DOSE_ERROR * TOLERANCE, row['structure']
+    assert worst_deviation(rows)['resampled_rows'] < worst_deviation(rows)['rows']
+
+
+def test_simplify_curve_keeps_ends_and_short_curves():
+    assert simplify_curve([0.0, 1.0], [2.0, 0.0]).tolist() == [0, 1]
+    dose, volume = np.arange(100.0), np.linspace(10.0, 0.0, 100)
+    # Una recta se interpola bien con los extremos; lo que agrega filas es la cota de Dmedia
+    assert simplify_curve(dose, volume, max_dose_error=1e6).tolist() == [0, 99]
+    rows = simplify_curve(dose, volume)
+    mean = np.sum((volume[rows[:-1]] - volume[rows[1:]]) * dose[rows[:-1]]) / volume[0]
+    assert np.sum((volume[:-1] - volume[1:]) * dose[:-1]) / volume[0] - mean <= MAX_DOSE_ERROR * TOLERANCE
+    rows = simplify_curve(dose, 10.0 * np.exp(-dose / 20.0))
+    assert rows[0] == 0 and rows[-1] == 99 and 2 < len(rows) < 100
+    assert np.all(np.diff(rows) > 0)
+
+
+def test_resample_to_a_uniform_grid(prostate_dvh):
+    original = DVH(prostate_dvh)
+    resampled = original.copy().resample(10.0)
+    max_dose = max(structure.dose_axis[-1] for structure in original.structures.values())
+    for key, structure in resampled.structures.items():
+        grid = structure.dose_axis
+        assert grid[0] == 0.0 and grid[-1] >= max_dose
+        np.testing.assert_allclose(np.diff(grid), 10.0)
+        np.testing.assert_allclose(structure.cumulated_volume_axis, original.structures[key].volume_at(grid),
+                                   rtol=0, atol=1e-9)
+        assert structure.volume == original.structures[key].volume
+
+
+def test_verification_with_prescription(prostate_dvh, protocol_workbook):
+    prescription = Prescription(protocol_workbook, PROTOCOL)
+    original = DVH(prostate_dvh)
+    rows = {row['structure']: row for row in verify_resampling(original, original.copy(), prescription)}
+    for key, row in rows.items():
+        assert row['max_volume_error_cc'] == 0.0 and row['max_dose_error_cgy'] == 0.0
+        if key in prescription.structures:
+            assert row['max_constraint_difference'] == 0.0 and row['status_changes'] == 0
+        else:
+            assert row['max_constraint_difference'] is None and row['status_changes'] is None
+
+    coarse = verify_resampling(original, original.copy().resample(500.0), prescription)
+    worst = worst_deviation(coarse)
+    assert worst['max_volume_error_cc'] > MAX_VOLUME_ERROR and worst['max_constraint_difference'] > 0.0
+
+
+@pytest.mark.parametrize('args, code', [([], 0), (['--grilla', '500'], 1)])
+def test_main_reports_if_within_tolerance(prostate_dvh, tmp_path, capsys, args, code):
+    output = str(tmp_path / 'verificacion.csv')
+    assert main([prostate_dvh, '-o', output] + args) == code
+    assert ('Dentro de la tolerancia.' if code == 0 else 'FUERA de la tolerancia.') in capsys.readouterr().out
+    with open(output, encoding='utf-8', newline='') as f:
+        assert len(list(csv.DictReader(f))) == len(DVH(prostate_dvh).structures)
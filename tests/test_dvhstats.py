@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from conftest import PROTOCOL, PROTOCOL_ROWS, PROTOCOL_TARGETS
+from synthetic_dvh import write_protocol_workbook
+
+from backend import DVH, MAX_DOSE_ABS_VOLUME, Prescription
+from dvhstats import dose_at, dvh_statistics, packed_dose_at, packed_segments, packed_volume_at, volume_at
+
+
+def test_packed_interpolation_matches_structure(example_dvh):
+    dvh = DVH(example_dvh)
+    keys = list(dvh.structures)
+    packed, indices = packed_segments(dvh.structures, keys)
+    rng = np.random.default_rng(1)
+
+    doses, volumes = [], []
+    for key in keys:
+        structure = dvh.structures[key]
+        # consultas fuera de rango, justo en las filas (incluidas mesetas) y al azar
+        doses.append(np.concatenate(([-5.0, 0.0, structure.dose_axis[-1] + 10], structure.dose_axis[:5],
+                                     rng.uniform(0, structure.dose_axis[-1], 32))))
+        volumes.append(np.concatenate(([-1.0, 0.0, structure.volume, structure.volume * 2], structure.cumulated_volume_axis[-5:],
+                                       rng.uniform(0, structure.volume, 31))))
+    doses, volumes = np.array(doses), np.array(volumes)
+
+    expected_volumes = np.array([dvh.structures[key].volume_at(d) for key, d in zip(keys, doses)])
+    expected_doses = np.array([dvh.structures[key].dose_at(v) for key, v in zip(keys, volumes)])
+    # la formula de interpolacion no es la de np.interp: puede diferir en el ultimo bit
+    np.testing.assert_allclose(packed_volume_at(packed, indices, doses), expected_volumes, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(packed_dose_at(packed, indices, volumes), expected_doses, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(volume_at(dvh.structures, keys, doses), expected_volumes, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(dose_at(dvh.structures, keys, volumes), expected_doses, rtol=0, atol=1e-9)
+
+
+def test_packed_interpolation_on_subset_and_unpacked_structures(prostate_dvh):
+    dvh = DVH(prostate_dvh, lazy=True)
+    keys = ['VEJIGA', 'RECTO']
+    doses = np.array([[1000.0, 4000.0], [2500.5, 6000.0]])
+    expected = np.array([dvh.structures[key].volume_at(d) for key, d in zip(keys, doses)])
+    np.testing.assert_allclose(volume_at(dvh.structures, keys, doses), expected, rtol=0, atol=1e-9)
+
+
+def test_statistics_match_structure(prostate_dvh):
+    dvh = DVH(prostate_dvh)
+    statistics = dvh_statistics(dvh)
+    assert statistics.keys == list(dvh.structures)
+    for key, structure in dvh.structures.items():
+        row = statistics[key]
+        assert row['volume'] == structure.volume
+        assert row['dmax'] == pytest.approx(structure.dose_at(MAX_DOSE_ABS_VOLUME), abs=1e-9)
+        assert row['d50'] == pytest.approx(structure.dose_at(structure.volume * 0.5), abs=1e-9)
+        assert row['dmean'] == pytest.approx(structure.mean, rel=1e-6)
+        assert row['hi'] == pytest.approx((row['d2'] - row['d98']) / row['d50'])
+        assert np.isnan(row['coverage'])
+
+
+def test_target_names_follow_structure_key(tmp_path, prostate_dvh):
+    # En el Excel los targets pueden estar en minusculas: se buscan con la clave de DVH.structures
+    excel_path = str(tmp_path / 'protocolos.xlsx')
+    targets = [(name.lower(), total, daily) for name, total, daily in PROTOCOL_TARGETS]
+    write_protocol_workbook(excel_path, {PROTOCOL: (targets, PROTOCOL_ROWS)})
+    prescription = Prescription(excel_path, PROTOCOL)
+    assert set(prescription.target_structures) == {'ptv_pr', 'ptv_vs'}
+
+    dvh = DVH(prostate_dvh)
+    statistics = dvh_statistics(dvh, prescription, body_key='VEJIGA')
+    for name, total, _ in PROTOCOL_TARGETS:
+        structure = dvh.structures[name]
+        row = statistics[name]
+        assert row['prescribed_dose'] == total
+        assert row['coverage'] == pytest.approx(structure.volume_at(total) / structure.volume * 100.0)
+        isodose_volume = dvh.structures['VEJIGA'].volume_at(total)
+        assert row['ci_rtog'] == pytest.approx(isodose_volume / structure.volume)
+        assert row['ci_paddick'] == pytest.approx(structure.volume_at(total) ** 2 / (structure.volume * isodose_volume))
+    assert np.isnan(statistics['RECTO']['coverage'])
+
+
+def test_packed_interpolation_next_to_every_row(example_dvh):
+    # Consultas a 1 ulp de cada fila: la suma segmento * span no tiene que mover ninguna de lado
+    dvh = DVH(example_dvh)
+    keys = list(dvh.structures)
+    for key in keys:
+        structure = dvh.structures[key]
+        for axis, packed_fn, structure_fn in ((structure.dose_axis, volume_at, structure.volume_at),
+                                              (structure.cumulated_volume_axis, dose_at, structure.dose_at)):
+            queries = np.concatenate((np.nextafter(axis, -np.inf), axis, np.nextafter(axis, np.inf)))
+            queries = np.broadcast_to(queries, (len(keys), len(queries)))
+            np.testing.assert_allclose(packed_fn(dvh.structures, keys, queries)[keys.index(key)],
+                                       structure_fn(queries[0]), rtol=0, atol=1e-6)
@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+import pytest
+from conftest import REPO_DIR
+
+# Modulos pesados que solo usan la GUI, DVH.plot, Prescription.print o el PDF: el camino de
+# evaluacion (batch, workers, cli, watcher) no tiene que importarlos
+DEFERRED_MODULES = {'tkinter', 'customtkinter', 'matplotlib', 'pandas', 'scipy', 'termcolor', 'openpyxl', 'reportlab'}
+
+
+def imported_modules(module: str) -> set:
+    """ Modulos en sys.modules despues de importar module en un interprete nuevo """
+    completed = subprocess.run([sys.executable, '-c', f'import sys, {module}; print("\\n".join(sys.modules))'],
+                               cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return set(completed.stdout.split())
+
+
+@pytest.mark.parametrize('module', ['backend', 'batch', 'cli', 'watcher', 'protocolstore', 'session'])
+def test_evaluation_path_defers_heavy_imports(module):
+    imported = imported_modules(module)
+    assert module in imported
+    assert sorted({name.split('.')[0] for name in imported} & DEFERRED_MODULES) == []
@@ -0,0 +1,67 @@
+import csv
+
+from conftest import PROTOCOL
+
+from backend import DVH, Constraint, ConstraintResult, Prescription
+from planmatrix import STATUS_RANK, ConstraintMatrix, evaluate_plan
+
+
+def result(constraint, ideal_passed, value, acceptable_passed=None):
+    acceptable = None if acceptable_passed is None else (acceptable_passed, value)
+    return ConstraintResult(constraint, (ideal_passed, value), acceptable)
+
+
+def test_best_prefers_status_then_value():
+    upper = Constraint(('RECTO', 'V(D)<V_%', 4000.0, 35.0, 4000.0, 40.0))
+    cells = [result(upper, False, 38.0, True), result(upper, True, 30.0), result(upper, True, 20.0), None]
+    assert ConstraintMatrix._best(upper, cells) == [2]   # ideal y el menor volumen
+    cells = [result(upper, False, 10.0, False), result(upper, False, 38.0, True)]
+    assert ConstraintMatrix._best(upper, cells) == [1]   # aceptable le gana a no pasa aunque el valor sea peor
+
+    lower = Constraint(('PTV', 'V(D)>V_%', 5700.0, 95.0, 5600.0, 95.0))
+    cells = [result(lower, True, 96.0), result(lower, True, 99.0), result(lower, True, 99.0)]
+    assert ConstraintMatrix._best(lower, cells) == [1, 2]   # en V(D)>V gana el mayor; empates todos
+
+
+def test_best_is_empty_when_all_plans_tie():
+    dmax = Constraint(('SIGMA', 'Dmax', 2000.0, None, 2500.0, None))
+    assert ConstraintMatrix._best(dmax, [result(dmax, True, 150.0), result(dmax, True, 150.0)]) == []
+    assert ConstraintMatrix._best(dmax, [result(dmax, True, 150.0), None]) == []
+    unknown = Constraint(('SIGMA', 'Dmin', 2000.0, None, None, None))
+    assert ConstraintMatrix._best(unknown, [result(unknown, False, 'None'), result(unknown, False, 'None')]) == []
+
+
+def test_matrix_of_swapped_plans(prostate_dvh, protocol_workbook, tmp_path):
+    prescription = Prescription(protocol_workbook, PROTOCOL)
+    reference = evaluate_plan(DVH(prostate_dvh), prescription)
+    # Plan con RECTO y VEJIGA intercambiados (mapeo de la GUI: {nombre_presc: nombre_dvh})
+    swapped_dvh = DVH(prostate_dvh)
+    swapped_dvh.plan_name = 'INTERCAMBIADO'
+    swapped = evaluate_plan(swapped_dvh, prescription, {'RECTO': 'VEJIGA', 'VEJIGA': 'RECTO'})
+    # Plan sin SIGMA: esa fila no se evalua ahi
+    without_sigma = evaluate_plan(DVH(prostate_dvh), prescription, ignored_structures=['SIGMA'])
+
+    matrix = ConstraintMatrix(prescription, [reference, swapped, without_sigma])
+    assert len(matrix.rows) == sum(len(constraints) for constraints in prescription.structures.values())
+    for row in matrix.rows:
+        first, second, third = row['cells']
+        assert third is None if row['structure'] == 'SIGMA' else third.ideal == first.ideal
+        if row['structure'] not in ('RECTO', 'VEJIGA') or first.ideal[1] == second.ideal[1]:
+            assert row['best'] == []   # todos los planes dan lo mismo
+            continue
+        # El plan intercambiado evalua la otra estructura (todas de limite superior: gana el menor valor)
+        first_wins = (STATUS_RANK[first.status], -first.ideal[1]) > (STATUS_RANK[second.status], -second.ideal[1])
+        assert row['best'] == ([0, 2] if first_wins else [1])
+
+    counts = matrix.plan_counts()
+    assert [sum(count[status] for status in ('ideal', 'acceptable', 'fail')) for count in counts] == \
+        [len(matrix.rows), len(matrix.rows), len(matrix.rows) - len(prescription.structures['SIGMA'])]
+    assert sum(count['best'] for count in counts) == sum(len(row['best']) for row in matrix.rows)
+
+    output = str(tmp_path / 'matriz.csv')
+    matrix.write_csv(output)
+    with open(output, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['mejor'] for row in rows] == ['; '.join(matrix.labels[i] for i in row['best']) for row in matrix.rows]
+    assert rows[0]['ideal_dose'] == '4000'
+    assert {row[f'{matrix.labels[2]} estado'] for row in rows if row['structure'] == 'SIGMA'} == {'no evaluada'}
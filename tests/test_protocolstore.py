@@ -0,0 +1,138 @@
+import os
+import shutil
+import time
+import zipfile
+
+import pytest
+from conftest import PROTOCOL, PROTOCOL_ROWS, PROTOCOL_TARGETS
+from synthetic_dvh import write_protocol_workbook
+
+from backend import Prescription, prescription_sheet_charts
+from protocolstore import ProtocolIndex, ProtocolStore, default_store_path
+from xlstools import XlsxWorkbook, get_cell_content
+
+
+@pytest.fixture
+def excel_path(tmp_path, protocol_workbook):
+    """ Copia propia del Excel de protocolos (los tests lo tocan, lo cambian o lo borran) """
+    path = tmp_path / 'nas' / 'protocolos.xlsx'
+    path.parent.mkdir()
+    shutil.copy(protocol_workbook, path)
+    return str(path)
+
+
+def set_mtime(path, seconds_ago):
+    mtime = time.time() - seconds_ago
+    os.utime(path, (mtime, mtime))
+
+
+def prescription_summary(prescription):
+    return prescription.target_structures, {
+        name: [(c.type, c.ideal_dose, c.ideal_volume, c.acceptable_dose, c.acceptable_volume) for c in constraints]
+        for name, constraints in prescription.structures.items()}
+
+
+def test_store_matches_the_workbook(excel_path, local_data_dir):
+    store = ProtocolStore(excel_path)
+    assert store.sheet_names() == [PROTOCOL]   # INDICE, PLANTILLA y NOTAS no son protocolos
+    assert store.store_path == default_store_path(excel_path)
+    assert store.store_path.startswith(str(local_data_dir))
+
+    with XlsxWorkbook(excel_path) as workbook:
+        assert store.constraints_chart(PROTOCOL) == prescription_sheet_charts(workbook[PROTOCOL])
+    assert (prescription_summary(Prescription(excel_path, PROTOCOL, store=store))
+            == prescription_summary(Prescription(excel_path, PROTOCOL)))
+
+
+def test_constraints_chart_returns_copies(excel_path):
+    store = ProtocolStore(excel_path)
+    chart = store.constraints_chart(PROTOCOL)
+    chart[1].clear()
+    assert store.constraints_chart(PROTOCOL)[1]
+    with pytest.raises(KeyError, match='NOTAS'):
+        store.constraints_chart('NOTAS')
+
+
+def test_rebuilds_only_when_the_content_changes(excel_path):
+    store = ProtocolStore(excel_path)
+    assert store.refresh()
+    assert not store.refresh()
+    first_hash = store.content_hash()
+
+    set_mtime(excel_path, 30)   # se toco sin cambiar: se compara el hash y no se recompila
+    assert not store.refresh()
+    assert store.content_hash() == first_hash
+
+    write_protocol_workbook(excel_path, {PROTOCOL: (PROTOCOL_TARGETS, PROTOCOL_ROWS[:3]),
+                                         'OTRO': (PROTOCOL_TARGETS, PROTOCOL_ROWS)})
+    assert store.refresh()
+    assert store.content_hash() != first_hash
+    assert store.sheet_names(refresh=False) == [PROTOCOL, 'OTRO']
+    assert len(store.constraints_chart(PROTOCOL)[1]) == 3
+
+
+def test_offline_uses_the_saved_copy(excel_path):
+    ProtocolStore(excel_path).refresh()
+    expected = ProtocolStore(excel_path).constraints_chart(PROTOCOL)
+
+    os.remove(excel_path)   # NAS caido: otra instancia (otro arranque) lee la copia local
+    store = ProtocolStore(excel_path)
+    assert not store.refresh()
+    assert store.constraints_chart(PROTOCOL) == expected
+    assert prescription_summary(Prescription(excel_path, PROTOCOL, store=ProtocolStore(excel_path)))
+
+
+def test_offline_without_saved_copy_raises(excel_path, capsys):
+    os.remove(excel_path)
+    store = ProtocolStore(excel_path)
+    assert not store.load_cached()
+    with pytest.raises(OSError):
+        store.refresh()
+
+    done = []
+    store.refresh_in_background(done.append).join()
+    assert done == []
+    assert 'No se pudo actualizar' in capsys.readouterr().out
+
+
+def test_unreadable_workbook_keeps_the_saved_copy(excel_path):
+    store = ProtocolStore(excel_path)
+    first_hash = store.content_hash()
+
+    with open(excel_path, 'wb') as f:   # a medio guardar
+        f.write(b'PK\x03\x04')
+    with pytest.raises(zipfile.BadZipFile):
+        store.refresh()
+    assert store.content_hash(refresh=False) == first_hash
+    restarted = ProtocolStore(excel_path)
+    assert restarted.sheet_names(refresh=False) == [PROTOCOL]
+    assert restarted.content_hash(refresh=False) == first_hash
+
+
+def test_index_matches_the_workbook(excel_path):
+    index = ProtocolIndex(excel_path)
+    assert index.protocol_names() == get_cell_content(excel_path, 'B2')
+    assert [entry['sheet'] for entry in index.entries(refresh=False)] == ['INDICE', 'PLANTILLA', 'NOTAS', PROTOCOL]
+    assert index.store_path != ProtocolStore(excel_path).store_path
+
+
+def test_index_offline_uses_the_saved_copy(excel_path):
+    ProtocolIndex(excel_path).refresh()
+    os.remove(excel_path)
+
+    index = ProtocolIndex(excel_path)
+    assert index.load_cached()   # lo que usa la ventana de seleccion al arrancar, sin abrir el Excel
+    assert index.protocol_names(refresh=False) == [None, None, None, PROTOCOL]
+    assert not index.refresh()
+    assert index.protocol_names() == [None, None, None, PROTOCOL]
+
+
+def test_index_follows_workbook_changes(excel_path):
+    index = ProtocolIndex(excel_path)
+    index.refresh()
+    set_mtime(excel_path, 30)
+    assert not index.refresh()
+
+    write_protocol_workbook(excel_path, {PROTOCOL: (PROTOCOL_TARGETS, PROTOCOL_ROWS), 'OTRO': (PROTOCOL_TARGETS, PROTOCOL_ROWS)})
+    assert index.refresh()
+    assert index.protocol_names(refresh=False)[3:] == [PROTOCOL, 'OTRO']
@@ -0,0 +1,175 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+from conftest import EXAMPLES_DIR, PROTOCOL, PROTOCOL_ROWS, PROTOCOL_TARGETS
+from synthetic_dvh import write_protocol_workbook
+
+import session as session_module
+from backend import LazyStructures, PackedStructures, actualizar_dvh_con_mapeos, save_mapping_and_volumes
+from dvhcache import DVHCache
+from protocolstore import ProtocolStore
+from session import DosePoliceSession, LRUCache
+
+BREAST_DVH = os.path.join(EXAMPLES_DIR, '12616855_VMI_DVH_1.txt')
+
+
+@pytest.fixture
+def excel_path(tmp_path, protocol_workbook):
+    path = tmp_path / 'protocolos.xlsx'
+    shutil.copy(protocol_workbook, path)
+    return str(path)
+
+
+@pytest.fixture
+def dvh_path(tmp_path, prostate_dvh):
+    path = tmp_path / 'plan.txt'
+    shutil.copy(prostate_dvh, path)
+    return str(path)
+
+
+def set_mtime(path, seconds_ago):
+    mtime = time.time() - seconds_ago
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def count_dvh_loads(monkeypatch):
+    loads = []
+    original = session_module.DVH
+
+    def counting_dvh(file_path, *args, **kwargs):
+        loads.append(file_path)
+        return original(file_path, *args, **kwargs)
+
+    monkeypatch.setattr(session_module, 'DVH', counting_dvh)
+    return loads
+
+
+def test_prescription_follows_the_workbook_content(excel_path):
+    session = DosePoliceSession(excel_path, ProtocolStore(excel_path))
+    prescription = session.prescription(PROTOCOL)
+    assert session.prescription(PROTOCOL.lower()) is prescription
+
+    set_mtime(excel_path, 30)   # se toco sin cambiar: misma prescripcion
+    assert session.prescription(PROTOCOL) is prescription
+
+    write_protocol_workbook(excel_path, {PROTOCOL: (PROTOCOL_TARGETS, PROTOCOL_ROWS[:3])})
+    changed = session.prescription(PROTOCOL)
+    assert changed is not prescription
+    assert list(changed.structures) == ['RECTO']
+
+
+def test_prescription_without_store_follows_the_mtime(excel_path):
+    session = DosePoliceSession(excel_path)
+    prescription = session.prescription(PROTOCOL)
+    assert session.prescription(PROTOCOL) is prescription
+    set_mtime(excel_path, 30)
+    assert session.prescription(PROTOCOL) is not prescription
+
+
+def test_dvh_is_read_once_until_the_file_changes(dvh_path, count_dvh_loads):
+    session = DosePoliceSession('protocolos.xlsx')
+    first = session.dvh(dvh_path)
+    second = session.dvh(dvh_path)
+    assert count_dvh_loads == [dvh_path]
+    assert first is not second and list(first.structures) == list(second.structures)
+
+    shutil.copy(BREAST_DVH, dvh_path)
+    changed = session.dvh(dvh_path)
+    assert len(count_dvh_loads) == 2
+    assert list(changed.structures) != list(first.structures)
+
+
+def test_remapping_a_copy_does_not_touch_the_cached_dvh(dvh_path):
+    session = DosePoliceSession('protocolos.xlsx')
+    dvh = session.dvh(dvh_path)
+    volume = dvh.structures['RECTO'].volume
+    actualizar_dvh_con_mapeos(dvh, {'RECTO': 'VEJIGA', 'VEJIGA': 'RECTO'}, {})
+    dvh.structures['VEJIGA'].volume_update(1.0)
+    assert dvh.structures['VEJIGA'].label == 'VEJIGA'
+
+    fresh = session.dvh(dvh_path)
+    assert fresh.structures['RECTO'].volume == volume
+    assert fresh.structures['RECTO'].label == 'RECTO'
+
+
+def test_dvh_cache_wins_over_lazy(dvh_path, tmp_path):
+    assert isinstance(DosePoliceSession('protocolos.xlsx').dvh(dvh_path).structures, LazyStructures)
+
+    dvh_cache = DVHCache(str(tmp_path / 'cache'))
+    dvh = DosePoliceSession('protocolos.xlsx', dvh_cache=dvh_cache).dvh(dvh_path)
+    assert isinstance(dvh.structures, PackedStructures)
+    assert dvh_cache.get(dvh_path) is not None
+    assert 'RECTO' in DosePoliceSession('protocolos.xlsx', dvh_cache=dvh_cache).dvh(dvh_path).structures
+
+
+def test_concurrent_loads_parse_once(dvh_path, count_dvh_loads):
+    session = DosePoliceSession('protocolos.xlsx')
+    barrier = threading.Barrier(8)
+    results = []
+
+    def load():
+        barrier.wait()
+        results.append(session.dvh(dvh_path))
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8
+    assert count_dvh_loads == [dvh_path]
+
+
+def test_dvhs_are_bounded(tmp_path, prostate_dvh, count_dvh_loads):
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f'plan{i}.txt'))
+        shutil.copy(prostate_dvh, paths[-1])
+    session = DosePoliceSession('protocolos.xlsx', max_dvhs=2)
+    for path in paths:
+        session.dvh(path)
+    assert len(session.dvhs) == 2
+    session.dvh(paths[0])   # el mas viejo se descarto
+    assert count_dvh_loads == paths + [paths[0]]
+
+    by_bytes = DosePoliceSession('protocolos.xlsx', max_dvh_bytes=1)
+    for path in paths:
+        by_bytes.dvh(path)
+    assert len(by_bytes.dvhs) == 1   # siempre queda el ultimo aunque se pase
+
+
+def test_lru_cache():
+    cache = LRUCache(2, max_bytes=10, sizeof=len)
+    cache.put('a', 'xxx')
+    cache.put('b', 'yyy')
+    assert cache.get('a') == 'xxx'   # 'a' pasa a ser el mas reciente
+    cache.put('c', 'zzz')
+    assert 'b' not in cache and 'a' in cache and cache.nbytes == 6
+    cache.put('d', 'wwwwwwww')
+    assert list(cache._items) == ['d'] and cache.nbytes == 8
+
+
+def test_last_mapping_is_forgotten_when_the_dvh_changes(dvh_path):
+    session = DosePoliceSession('protocolos.xlsx')
+    dvh = session.dvh(dvh_path)
+    assert session.last_mapping(dvh, PROTOCOL) == ({}, {}, [])
+
+    session.remember_mapping(dvh, PROTOCOL.lower(), {'RECTO': 'VEJIGA'}, {'RECTO': 50.0}, ['SIGMA'])
+    assert session.last_mapping(dvh, PROTOCOL) == ({'RECTO': 'VEJIGA'}, {'RECTO': 50.0}, ['SIGMA'])
+    assert session.last_mapping(dvh, 'OTRO') == ({}, {}, [])
+
+    with open(dvh_path, 'ab') as f:
+        f.write(b'\n')
+    assert session.last_mapping(dvh, PROTOCOL) == ({}, {}, [])
+
+
+def test_last_mapping_falls_back_to_the_saved_one(dvh_path):
+    session = DosePoliceSession('protocolos.xlsx')
+    dvh = session.dvh(dvh_path)
+    save_mapping_and_volumes(dvh, {'VEJIGA': 'RECTO'}, {})
+    name_mapping, _, ignored = session.last_mapping(dvh, PROTOCOL)
+    assert name_mapping == {'VEJIGA': 'RECTO'} and ignored == []
@@ -0,0 +1,161 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+from conftest import PROTOCOL
+
+from watcher import DVHWatcher
+
+
+@pytest.fixture
+def nas(tmp_path, protocol_workbook):
+    """ Carpeta local que hace de NAS: DVHs/ (salida de Monaco) y el Excel de protocolos """
+    folder = tmp_path / 'nas'
+    (folder / 'DVHs').mkdir(parents=True)
+    shutil.copy(protocol_workbook, folder / 'protocolos.xlsx')
+    return folder
+
+
+@pytest.fixture
+def make_watcher(nas, tmp_path):
+    watchers = []
+
+    def make(**kwargs):
+        kwargs.setdefault('settle_time', 0)
+        watcher = DVHWatcher(str(nas / 'DVHs'), str(nas / 'protocolos.xlsx'), [PROTOCOL],
+                             str(tmp_path / 'resumen.jsonl'), interval=0.01, max_workers=1, **kwargs)
+        watchers.append(watcher)
+        return watcher
+
+    yield make
+    for watcher in watchers:
+        watcher.close()
+
+
+def set_mtime(path, seconds_ago):
+    mtime = time.time() - seconds_ago
+    os.utime(path, (mtime, mtime))
+
+
+def evaluated_files(evaluations):
+    return sorted(os.path.basename(evaluation.file_path) for evaluation in evaluations)
+
+
+def test_waits_until_the_file_settles(make_watcher, nas, prostate_dvh):
+    watcher = make_watcher(settle_time=60)
+    dvh_path = nas / 'DVHs' / 'plan.txt'
+    shutil.copy(prostate_dvh, dvh_path)
+
+    assert watcher.poll_once() == []   # primera vez que se ve
+    assert watcher.poll_once() == []   # sin cambios pero escrito hace menos de settle_time
+
+    set_mtime(dvh_path, 120)
+    assert watcher.poll_once() == []   # cambio el mtime: se espera otro escaneo igual
+    assert evaluated_files(watcher.poll_once()) == ['plan.txt']
+    assert watcher.poll_once() == []
+
+
+def test_file_still_being_written_is_not_evaluated(make_watcher, nas, prostate_dvh):
+    watcher = make_watcher()
+    dvh_path = nas / 'DVHs' / 'plan.txt'
+    with open(prostate_dvh, 'rb') as f:
+        content = f.read()
+
+    dvh_path.write_bytes(content[:len(content) // 2])
+    assert watcher.poll_once() == []
+    dvh_path.write_bytes(content)
+    assert watcher.poll_once() == []
+    assert evaluated_files(watcher.poll_once()) == ['plan.txt']
+
+
+def test_touch_without_change_is_not_reevaluated(make_watcher, nas, prostate_dvh, tmp_path):
+    watcher = make_watcher()
+    dvh_path = nas / 'DVHs' / 'plan.txt'
+    shutil.copy(prostate_dvh, dvh_path)
+    watcher.poll_once()
+    assert evaluated_files(watcher.poll_once()) == ['plan.txt']
+
+    set_mtime(dvh_path, 30)
+    assert watcher.poll_once() == []
+    assert watcher.poll_once() == []
+    assert watcher.state[str(dvh_path)]['mtime_ns'] == os.stat(dvh_path).st_mtime_ns
+
+    # El estado sobrevive a un reinicio
+    restarted = make_watcher()
+    assert restarted.poll_once() == [] and restarted.poll_once() == []
+
+    with open(dvh_path, 'ab') as f:
+        f.write(b'\n')
+    restarted.poll_once()
+    assert evaluated_files(restarted.poll_once()) == ['plan.txt']
+    with open(tmp_path / 'resumen.jsonl', encoding='utf-8') as f:
+        assert len(f.read().splitlines()) == 2
+
+
+def test_touched_workbook_keeps_the_evaluator(make_watcher, nas, prostate_dvh):
+    watcher = make_watcher()
+    watcher.poll_once()
+    prescriptions, evaluator = watcher.prescriptions, watcher._evaluator
+
+    set_mtime(nas / 'protocolos.xlsx', 30)
+    shutil.copy(prostate_dvh, nas / 'DVHs' / 'plan.txt')
+    watcher.poll_once()
+    assert evaluated_files(watcher.poll_once()) == ['plan.txt']
+    assert watcher.prescriptions is prescriptions and watcher._evaluator is evaluator
+
+
+def test_missing_workbook_uses_last_prescriptions(make_watcher, nas, prostate_dvh):
+    watcher = make_watcher()
+    watcher.poll_once()
+    prescriptions = watcher.prescriptions
+
+    os.remove(nas / 'protocolos.xlsx')   # NAS caido
+    shutil.copy(prostate_dvh, nas / 'DVHs' / 'plan.txt')
+    watcher.poll_once()
+    evaluations = watcher.poll_once()
+    assert evaluated_files(evaluations) == ['plan.txt']
+    assert watcher.prescriptions is prescriptions and evaluations[0].prescription is prescriptions[0]
+
+
+def test_half_saved_workbook_keeps_last_prescriptions(make_watcher, nas, prostate_dvh, capsys):
+    watcher = make_watcher()
+    watcher.poll_once()
+    prescriptions = watcher.prescriptions
+
+    (nas / 'protocolos.xlsx').write_bytes(b'PK\x03\x04 a medio guardar')
+    shutil.copy(prostate_dvh, nas / 'DVHs' / 'plan.txt')
+    watcher.poll_once()
+    assert evaluated_files(watcher.poll_once()) == ['plan.txt']
+    assert watcher.prescriptions is prescriptions
+    assert 'se siguen usando los anteriores' in capsys.readouterr().err
+
+
+def test_run_survives_errors_and_retries(make_watcher, nas, prostate_dvh, capsys):
+    excel_path = nas / 'protocolos.xlsx'
+    saved_excel = nas.parent / 'protocolos.xlsx'
+    shutil.move(excel_path, saved_excel)   # sin Excel ni copia local: no hay con que evaluar
+    watcher = make_watcher()
+    shutil.copy(prostate_dvh, nas / 'DVHs' / 'plan.txt')
+    with pytest.raises(OSError):
+        watcher.poll_once()
+
+    stop_event = threading.Event()
+    evaluations = []
+
+    def on_evaluation(evaluation):
+        evaluations.append(evaluation)
+        stop_event.set()
+
+    thread = threading.Thread(target=watcher.run, args=(stop_event, on_evaluation))
+    thread.start()
+    time.sleep(0.1)
+    assert thread.is_alive()
+    shutil.move(saved_excel, excel_path)
+    thread.join(timeout=30)
+    stop_event.set()
+
+    assert not thread.is_alive()
+    assert evaluated_files(evaluations) == ['plan.txt']
+    assert 'se reintenta' in capsys.readouterr().err
@@ -0,0 +1,85 @@
+import pytest
+
+from backend import Prescription, prescription_sheet_charts
+from synthetic_dvh import make_structures, protocol_rows, protocol_targets, write_protocol_workbook
+from xlstools import (XlsxWorkbook, cell_data_importer, column_index, column_letters, none_based_data_parser,
+                      split_cell_reference)
+
+openpyxl = pytest.importorskip('openpyxl')
+
+PROTOCOL = 'SINTETICO 6000-20FX'
+
+
+@pytest.fixture(scope='module')
+def workbook_path(tmp_path_factory):
+    structures = make_structures(12)
+    path = str(tmp_path_factory.mktemp('xlsx') / 'protocolos.xlsx')
+    write_protocol_workbook(path, {PROTOCOL: (protocol_targets(structures, 20), protocol_rows(structures, 6000.0))})
+    return path
+
+
+def test_cell_references():
+    assert [column_index(letters) for letters in ('A', 'Z', 'AA', 'AZ', 'BA')] == [1, 26, 27, 52, 53]
+    assert [column_letters(index) for index in (1, 26, 27, 52, 53)] == ['A', 'Z', 'AA', 'AZ', 'BA']
+    assert split_cell_reference('AB12') == (12, 28)
+
+
+def test_iter_rows_matches_openpyxl(workbook_path):
+    reference = openpyxl.load_workbook(workbook_path, read_only=True)
+    with XlsxWorkbook(workbook_path) as workbook:
+        assert workbook.sheetnames == reference.sheetnames
+        sheet, expected = workbook[PROTOCOL], reference[PROTOCOL]
+        for min_row, max_row, min_col, max_col in ((1, 8, 1, 3), (3, 20, 2, 7), (10, 200, 1, 8), (1, None, 1, 7)):
+            assert list(sheet.iter_rows(min_row, max_row, min_col, max_col)) == \
+                list(expected.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col, values_only=True))
+        assert sheet['B2'].value == expected['B2'].value == PROTOCOL
+        assert sheet['Z99'].value is None
+        assert sheet.calculate_dimension() == expected.calculate_dimension()
+    reference.close()
+
+
+def test_prescription_from_xlsx(workbook_path):
+    prescription = Prescription(workbook_path, PROTOCOL)
+    structures = make_structures(12)
+    assert set(prescription.target_structures) == {s.name.upper() for s in structures if s.kind == 'target'}
+    assert sum(len(constraints) for constraints in prescription.structures.values()) == len(protocol_rows(structures, 6000.0))
+
+
+def test_cell_data_importer_types(workbook_path):
+    with XlsxWorkbook(workbook_path) as workbook:
+        rows = cell_data_importer(workbook[PROTOCOL], (2, 'A'), (6, 'C'))
+    assert rows[0] == [None, PROTOCOL, None]
+    assert rows[1] == [None, None, None]
+    assert rows[2] == ['Target', 'Dosis total', 'Dosis diaria']
+    assert all(isinstance(value, float) for value in rows[3][1:])
+    assert isinstance(rows[3][0], str)
+
+
+def test_none_based_data_parser():
+    rows = [[None, None], ['a', 1.0], [None, 2.0], [None, None], [None, None], ['b', None], [None, None]]
+    assert none_based_data_parser(rows) == [[['a', 1.0], [None, 2.0]], [['b', None]]]
+    assert none_based_data_parser([[None]]) == []
+
+
+def test_prescription_sheet_charts(workbook_path):
+    structures = make_structures(12)
+    with XlsxWorkbook(workbook_path) as workbook:
+        targets, constraints = prescription_sheet_charts(workbook[PROTOCOL])
+    assert targets == [[name, float(total), float(daily), None, None, None, None]
+                       for name, total, daily in protocol_targets(structures, 20)]
+    expected = [[None] + [float(v) if isinstance(v, (int, float)) else v for v in row]
+                for row in protocol_rows(structures, 6000.0)]
+    assert constraints == expected
+
+
+def test_prescription_closes_the_workbook(workbook_path, monkeypatch):
+    closed = []
+    original_close = XlsxWorkbook.close
+
+    def close(self):
+        closed.append(self.file_path)
+        original_close(self)
+
+    monkeypatch.setattr(XlsxWorkbook, 'close', close)
+    Prescription(workbook_path, PROTOCOL)
+    assert closed == [workbook_path]
@@ -0,0 +1,186 @@
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from typing import List
+
+from backend import Prescription
+from batch import BatchEvaluator, PlanEvaluation
+from dvhcache import content_hash
+from protocolstore import ProtocolStore
+from report import SummaryWriter
+
+
+class DVHWatcher:
+    """
+    Vigila la carpeta de salida de DVHs de Monaco y evalua solo los archivos nuevos o modificados.
+
+    Un archivo se evalua cuando su tamaño/mtime no cambio entre dos escaneos seguidos (ya se
+    termino de escribir) y su contenido difiere del ultimo evaluado. Los resultados se agregan a
+    results_path (CSV o JSON lines) y lo ya evaluado queda en state_path, asi un reinicio no
+    repite el trabajo. Las prescripciones se leen una vez y se recargan solo si cambia el contenido
+    del Excel (con el NAS caido se sigue con la ultima copia de ProtocolStore).
+
+    Un error en un escaneo (Excel a medio guardar, NAS no accesible, falla del pool) no corta la
+    vigilancia: se informa, se siguen usando las ultimas prescripciones buenas y se reintenta en
+    el proximo escaneo.
+    """
+    def __init__(self, folder: str, excel_path: str, protocol_names: List[str], results_path: str,
+                 state_path: str = None, interval: float = 5.0, settle_time: float = 2.0,
+                 max_workers: int = None, ignored_structures=(), use_saved_mappings: bool = True,
+                 cache_dir: str = None, skip_existing: bool = False):
+        self.folder = folder
+        self.excel_path = excel_path
+        self.protocol_names = protocol_names
+        self.results_path = results_path
+        self.state_path = state_path or f'{results_path}.estado.json'
+        self.interval = interval
+        self.settle_time = settle_time
+        self.evaluator_options = dict(max_workers=max_workers, ignored_structures=ignored_structures,
+                                      use_saved_mappings=use_saved_mappings, cache_dir=cache_dir)
+
+        self.state = self._load_state()   # {ruta: {'size', 'mtime_ns', 'hash'}} de lo ya evaluado
+        self._pending = {}                # {ruta: (size, mtime_ns)} vistos en el escaneo anterior
+        self._protocols_hash = None   # hash del Excel del que salen las prescripciones actuales
+        self._evaluator = None
+        self.prescriptions = []
+        self.protocol_store = ProtocolStore(excel_path)
+
+        if skip_existing:
+            for file_path, signature in self._signatures().items():
+                self.state.setdefault(file_path, {'size': signature[0], 'mtime_ns': signature[1], 'hash': None})
+            self._save_state()
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        temp_path = f'{self.state_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(temp_path, self.state_path)
+
+    def _signatures(self) -> dict:
+        signatures = {}
+        for file_path in glob.glob(os.path.join(self.folder, '*.txt')):
+            try:
+                stat = os.stat(file_path)
+            except OSError:   # borrado entre el listado y el stat
+                continue
+            signatures[file_path] = (stat.st_size, stat.st_mtime_ns)
+        return signatures
+
+    def _refresh_prescriptions(self) -> None:
+        # Si el Excel no esta accesible ProtocolStore devuelve la ultima copia compilada; si solo
+        # cambio el mtime (se toco sin cambiar) el hash es el mismo y no se recarga nada
+        protocols_hash = self.protocol_store.content_hash()
+        if protocols_hash == self._protocols_hash and self._evaluator is not None:
+            return
+        prescriptions = [Prescription(self.excel_path, name, store=self.protocol_store)
+                         for name in self.protocol_names]
+        # Los workers tienen las prescripciones viejas: se arma un pool nuevo
+        if self._evaluator is not None:
+            self._evaluator.close()
+        self.prescriptions = prescriptions
+        self._evaluator = BatchEvaluator(prescriptions, **self.evaluator_options)
+        self._protocols_hash = protocols_hash
+
+    @staticmethod
+    def _report_error(message: str, error: Exception) -> None:
+        print(f"{message} ({type(error).__name__}: {error})", file=sys.stderr)
+
+    def scan(self) -> List[tuple]:
+        """
+        Devuelve [(ruta, size, mtime_ns, hash)] de los archivos listos para evaluar.
+        """
+        now_ns = time.time_ns()
+        signatures = self._signatures()
+        ready = []
+        for file_path, signature in sorted(signatures.items()):
+            known = self.state.get(file_path)
+            if known is not None and (known['size'], known['mtime_ns']) == signature:
+                continue
+            # Todavia se esta escribiendo (o es la primera vez que se ve): se espera al proximo escaneo
+            if self._pending.get(file_path) != signature or now_ns - signature[1] < self.settle_time * 1e9:
+                self._pending[file_path] = signature
+                continue
+            try:
+                with open(file_path, 'rb') as f:
+                    digest = content_hash(f.read())
+            except OSError:
+                continue
+            if known is not None and known['hash'] == digest:   # solo se toco el archivo
+                self.state[file_path] = {'size': signature[0], 'mtime_ns': signature[1], 'hash': digest}
+                continue
+            ready.append((file_path, signature[0], signature[1], digest))
+
+        self._pending = {path: sig for path, sig in self._pending.items() if path in signatures}
+        return ready
+
+    def poll_once(self) -> List[PlanEvaluation]:
+        """
+        Un escaneo: evalua lo que este listo, agrega los resultados y guarda el estado.
+
+        Si no se pueden recargar las prescripciones se evalua con las anteriores; si todavia no
+        hay ninguna, o falla la evaluacion, se lanza el error y los archivos que faltaron quedan
+        para el proximo escaneo.
+        """
+        try:
+            self._refresh_prescriptions()
+        except Exception as e:
+            if self._evaluator is None:
+                raise
+            self._report_error(f"No se pudieron recargar los protocolos de '{self.excel_path}', se siguen usando los anteriores", e)
+        ready = self.scan()
+        if not ready:
+            return []
+
+        signatures = {file_path: (size, mtime_ns, digest) for file_path, size, mtime_ns, digest in ready}
+        evaluations = []
+        try:
+            with SummaryWriter(self.results_path, append=True) as writer:
+                for evaluation in self._evaluator.iter(list(signatures)):
+                    writer.write(evaluation)
+                    evaluations.append(evaluation)
+                    size, mtime_ns, digest = signatures[evaluation.file_path]
+                    self.state[evaluation.file_path] = {'size': size, 'mtime_ns': mtime_ns, 'hash': digest}
+        except Exception:
+            # Un pool roto no se recupera: se cierra y el proximo escaneo arma uno nuevo
+            self._evaluator.close()
+            raise
+        finally:
+            self._save_state()   # lo que ya se escribio en el resumen no se vuelve a evaluar
+        return evaluations
+
+    def run(self, stop_event: threading.Event = None, on_evaluation=None) -> None:
+        """
+        Escanea cada interval segundos hasta que se active stop_event (o Ctrl+C).
+        on_evaluation(PlanEvaluation) se llama con cada resultado nuevo. Los errores de un
+        escaneo se informan por stderr y se reintenta en el siguiente.
+        """
+        stop_event = stop_event or threading.Event()
+        try:
+            while not stop_event.is_set():
+                try:
+                    evaluations = self.poll_once()
+                except Exception as e:
+                    self._report_error(f"Fallo el escaneo de '{self.folder}', se reintenta en {self.interval:g} s", e)
+                    evaluations = []
+                for evaluation in evaluations:
+                    if on_evaluation is not None:
+                        on_evaluation(evaluation)
+                stop_event.wait(self.interval)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._evaluator is not None:
+            self._evaluator.close()
+            self._evaluator = None
+            self._protocols_hash = None
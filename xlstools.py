@@ -1,43 +1,254 @@
-import openpyxl
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse
+
 import numpy as np
 
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+CELL_REFERENCE = re.compile(r'^\$?([A-Za-z]{1,3})\$?(\d+)$')
+
+
 def open_workbook(file_path, workbook_name):
-    return openpyxl.load_workbook(file_path, read_only=True)[workbook_name]
-    
+    """
+    Hoja workbook_name del Excel. La hoja lee del zip abierto: al terminar hay que cerrar
+    sheet.parent (o leer dentro de un with XlsxWorkbook(...)).
+    """
+    return XlsxWorkbook(file_path)[workbook_name]
+
+
+def column_index(letters):
+    """ 'A' -> 1, 'Z' -> 26, 'AA' -> 27 (sin tabla de columnas) """
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - 64
+    return index
+
+
+def column_letters(index):
+    """ 1 -> 'A', 27 -> 'AA' """
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def split_cell_reference(reference):
+    """ 'B12' -> (12, 2) """
+    match = CELL_REFERENCE.match(reference)
+    if match is None:
+        raise ValueError(f"Celda invalida: {reference}")
+    return int(match.group(2)), column_index(match.group(1))
+
+
+def _cast_number(value):
+    # Igual que openpyxl: int si no tiene punto ni exponente
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def _text_content(element):
+    # Texto de un <si> o <is>: <t> directo o los <t> de cada <r> (sin la fonetica <rPh>)
+    parts = []
+    for child in element:
+        if child.tag == SHEET_NS + 't':
+            parts.append(child.text or '')
+        elif child.tag == SHEET_NS + 'r':
+            parts.extend(t.text or '' for t in child.iter(SHEET_NS + 't'))
+    return ''.join(parts)
+
+
+class XlsxWorkbook:
+    """
+    Lector minimo de .xlsx que lee el XML de las hojas en streaming (zipfile + iterparse).
+
+    Solo devuelve valores (de las formulas, el ultimo valor calculado que guardo Excel) y no
+    interpreta estilos (las fechas quedan como numero). A cambio abrir una hoja y leer un rango
+    no arma el libro entero como openpyxl y deja de parsear al pasar la ultima fila pedida.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._zip = zipfile.ZipFile(file_path)
+        self._shared_strings = None
+
+        targets = {}
+        with self._zip.open('xl/_rels/workbook.xml.rels') as source:
+            for _, element in iterparse(source):
+                if element.tag == PKG_REL_NS + 'Relationship':
+                    target = element.get('Target')
+                    if target.startswith('/'):
+                        target = target[1:]
+                    else:
+                        target = posixpath.normpath(posixpath.join('xl', target))
+                    targets[element.get('Id')] = target
+
+        self._sheet_paths = {}
+        with self._zip.open('xl/workbook.xml') as source:
+            for _, element in iterparse(source):
+                if element.tag == SHEET_NS + 'sheet':
+                    self._sheet_paths[element.get('name')] = targets[element.get(REL_NS + 'id')]
+        self.sheetnames = list(self._sheet_paths)
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self._sheet_paths:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+        return XlsxSheet(self, sheet_name, self._sheet_paths[sheet_name])
+
+    def __iter__(self):
+        return (self[sheet_name] for sheet_name in self.sheetnames)
+
+    def shared_strings(self):
+        if self._shared_strings is None:
+            strings = []
+            if 'xl/sharedStrings.xml' in self._zip.namelist():
+                with self._zip.open('xl/sharedStrings.xml') as source:
+                    for _, element in iterparse(source):
+                        if element.tag == SHEET_NS + 'si':
+                            strings.append(_text_content(element).replace('x005F_', ''))
+                            element.clear()
+            self._shared_strings = strings
+        return self._shared_strings
+
+    def open_member(self, path):
+        return self._zip.open(path)
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
 
-def excel_column_list_generator():
-    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    column_list = []
+    def __exit__(self, *exc):
+        self.close()
 
-    for letter1 in letters:
-        column_list.append(letter1)
 
-    for letter1 in letters:
-        for letter2 in letters:
-            column_list.append(letter1 + letter2)
+class XlsxSheet:
+    """
+    Hoja de un XlsxWorkbook. iter_rows devuelve lo mismo que el de una hoja de openpyxl en modo
+    read_only con values_only=True sobre el rango dado (filas y columnas 1-based, inclusive).
+    """
+    def __init__(self, workbook, title, path):
+        self.parent = workbook
+        self.title = title
+        self._path = path
+
+    def _parse_cell(self, element):
+        data_type = element.get('t', 'n')
+        if data_type == 'inlineStr':
+            inline = element.find(SHEET_NS + 'is')
+            return _text_content(inline) if inline is not None else None
+
+        value = element.findtext(SHEET_NS + 'v') or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            return _cast_number(value)
+        if data_type == 's':
+            return self.parent.shared_strings()[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        return value   # 'str', 'e' (error) y 'd' (fecha ISO) quedan como texto
+
+    def _rows(self):
+        # (fila, {columna: elemento <c>}) para cada <row> del XML, en orden
+        row_counter = 0
+        with self.parent.open_member(self._path) as source:
+            for _, element in iterparse(source):
+                if element.tag != SHEET_NS + 'row':
+                    continue
+                row_counter = int(float(element.get('r'))) if element.get('r') else row_counter + 1
+                cells = {}
+                column = 0
+                for cell in element:
+                    if cell.tag != SHEET_NS + 'c':
+                        continue
+                    column = split_cell_reference(cell.get('r'))[1] if cell.get('r') else column + 1
+                    cells[column] = cell
+                yield row_counter, cells
+                element.clear()
+
+    def iter_rows(self, min_row, max_row, min_col, max_col):
+        """ Tuplas de valores de cada fila; max_row None lee hasta la ultima fila de la hoja """
+        empty_row = (None,) * (max_col + 1 - min_col)
+
+        counter = min_row
+        idx = 1
+        for idx, cells in self._rows():
+            if max_row is not None and idx > max_row:
+                break
+            # filas que no estan en el XML
+            for _ in range(counter, idx):
+                counter += 1
+                yield empty_row
+            if counter <= idx:
+                counter += 1
+                yield tuple(self._parse_cell(cells[column]) if column in cells else None
+                            for column in range(min_col, max_col + 1))
+
+        # Como openpyxl: solo se completa hasta max_row si la hoja sigue despues de max_row
+        if max_row is not None and max_row < idx:
+            for _ in range(counter, max_row + 1):
+                yield empty_row
+
+    def __getitem__(self, reference):
+        row, column = split_cell_reference(reference)
+        for values in self.iter_rows(row, row, column, column):
+            return _CellValue(values[0])
+        return _CellValue(None)
+
+    def calculate_dimension(self):
+        """ Rango del tag <dimension> de la hoja, por ejemplo 'A1:G45' """
+        with self.parent.open_member(self._path) as source:
+            for event, element in iterparse(source, events=('start',)):
+                if element.tag == SHEET_NS + 'dimension':
+                    return element.get('ref')
+                if element.tag == SHEET_NS + 'sheetData':
+                    break
+        raise ValueError("La hoja no tiene tag de dimensiones")
+
+
+class _CellValue:
+    # Lo minimo de una celda de openpyxl: sheet['B2'].value
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _typed_cell(value):
+    # float para numeros, str para texto y None para celdas vacias
+    if value is None or isinstance(value, str):
+        return value
+    return float(value)
 
-    return column_list
 
 def cell_data_importer(sheet,start_cell_idx, end_cell_idx, NUMERIC_VALUE=False):
+    """
+    Filas del rango como listas de valores tipados (float, str o None si la celda esta vacia).
+    Con NUMERIC_VALUE, array float32 (todas las celdas tienen que ser numericas).
+    """
     data = []
 
-    excel_columns = excel_column_list_generator()
-    
     for row in sheet.iter_rows(min_row= start_cell_idx[0], 
                                max_row= end_cell_idx[0], 
-                               min_col= excel_columns.index(start_cell_idx[1])+1, 
-                               max_col= excel_columns.index(end_cell_idx[1])+1, 
-                               values_only=True):
-        data.append(row)
+                               min_col= column_index(start_cell_idx[1]), 
+                               max_col= column_index(end_cell_idx[1])):
+        data.append([_typed_cell(value) for value in row])
     
     if NUMERIC_VALUE:
         return np.array(data, dtype=np.float32)  #casteando la lista a array de numpy de float32
-    else:
-        return np.array(data, dtype=str)  #casteando la lista a array de numpy de strings
-    
+    return data
+
+
 def get_cell_content(file_path, cell_coordinate, sheet_name=None):
     try:
         # Open the Excel file
+        import openpyxl   # solo aca: el resto del modulo lee el xlsx sin openpyxl
+
         workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
         cell_content = []
 
@@ -59,19 +270,21 @@ def get_cell_content(file_path, cell_coordinate, sheet_name=None):
         return None
     
 def none_based_data_parser(data):
-
-    if not isinstance(data, np.ndarray): data = np.array(data)
-
-    # Create a boolean mask for rows where all values are 'None'
-    none_rows_mask = np.all(data == 'None', axis=1)
-
-    # Get indices of rows where all values are 'None'
-    none_rows_indices = np.where(none_rows_mask)[0]
-
-    # Split the array into chunks based on NaN rows
-    chunks = np.split(data, none_rows_indices) if len(none_rows_indices) > 0 else [data]
-
-    chunks = [np.array(chunk, dtype=str) for chunk in chunks if not np.all(chunk == 'None')]
+    """
+    Separa las filas en tablas: las filas con todas las celdas vacias (None) son separadores
+    y no quedan en ninguna tabla.
+    """
+    chunks = []
+    chunk = []
+    for row in data:
+        if all(value is None for value in row):
+            if chunk:
+                chunks.append(chunk)
+                chunk = []
+        else:
+            chunk.append(list(row))
+    if chunk:
+        chunks.append(chunk)
 
     # print(f'Numero de chunks: {len(chunks)}')
 